@@ -0,0 +1,269 @@
+###############################################################################
+## Helper functions shared by the MDEB_SPATIAL scripts for calls to ArcGIS   ##
+## Online: retrying transient HTTP failures with exponential backoff,        ##
+## summarizing the outcome of a batch of service updates, caching item and   ##
+## layer definition lookups and running rate limited layer updates in        ##
+## parallel.                                                                 ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from MDEB_SPATIAL_instrument import metrics
+
+# HTTP status codes that are worth retrying (timeouts, throttling and server side errors)
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Default retry settings (can be changed with UPLOAD_RETRIES and UPLOAD_RETRY_DELAY in the .env file)
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 10
+MAX_RETRY_DELAY = 300
+
+# Default layer update settings (can be changed with LAYER_WORKERS and AGOL_RATE_LIMIT in the .env file)
+DEFAULT_LAYER_WORKERS = 4
+DEFAULT_RATE_LIMIT = 5
+
+# The arcgis package raises plain exceptions with the HTTP error in the message
+# (e.g. "Error Code: 503" or "503 Server Error: Service Unavailable")
+_STATUS_CODES_PATTERN = "|".join(str(code) for code in sorted(TRANSIENT_STATUS_CODES))
+_TRANSIENT_MESSAGE = re.compile(
+    rf"(?:error code:?|http)\s*(?:{_STATUS_CODES_PATTERN})\b"
+    rf"|\b(?:{_STATUS_CODES_PATTERN}) (?:client|server) error"
+    r"|timed out|timeout|temporarily unavailable|connection (?:aborted|reset|refused)",
+    re.IGNORECASE
+)
+
+
+def is_transient_error(error):
+    """
+    Returns True if an exception looks like a temporary network or server problem.
+    """
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code in TRANSIENT_STATUS_CODES
+    return bool(_TRANSIENT_MESSAGE.search(str(error)))
+
+
+def call_with_retry(function, *args, retries = DEFAULT_RETRIES, base_delay = DEFAULT_RETRY_DELAY, description = None):
+    """
+    Calls function(*args), retrying transient errors up to retries times.
+    The wait doubles after every attempt (with some jitter) up to MAX_RETRY_DELAY seconds.
+    Returns (result, attempts). Errors that are not transient, or that are still
+    raised after the last retry, are raised to the caller.
+    """
+    description = description or getattr(function, "__name__", "call")
+    for attempt in range(1, retries + 2):
+        try:
+            return function(*args), attempt
+        except Exception as e:
+            if attempt > retries or not is_transient_error(e):
+                raise
+            delay = min(base_delay * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+            delay *= random.uniform(0.8, 1.2)
+            print(f" - Transient error during {description} (attempt {attempt}): {e}. Retrying in {delay:.0f} s.")
+            metrics.count("agol.retries")
+            time.sleep(delay)
+
+
+class UpdateSummary:
+    """
+    Keeps track of which services were updated, which needed retries and which failed.
+    """
+
+    def __init__(self):
+        self.succeeded = []
+        self.retried = []
+        self.failed = []
+        self._lock = threading.Lock()
+
+    def record(self, service_name, success, attempts = 1, message = None):
+        with self._lock:
+            if success:
+                self.succeeded.append(service_name)
+                if attempts > 1:
+                    self.retried.append((service_name, attempts))
+            else:
+                self.failed.append((service_name, message))
+
+    def summary(self):
+        """
+        Returns the summary as printable lines.
+        """
+        lines = [f"Succeeded: {len(self.succeeded)}"]
+        lines += [f"  {name}" for name in self.succeeded]
+        lines.append(f"Succeeded after retrying: {len(self.retried)}")
+        lines += [f"  {name} ({attempts} attempts)" for name, attempts in self.retried]
+        lines.append(f"Failed: {len(self.failed)}")
+        lines += [f"  {name}: {message}" for name, message in self.failed]
+        return lines
+
+
+class ItemCache:
+    """
+    Memoizes AGOL item and layer definition lookups by item ID, so every stage
+    can ask for the same item without another HTTP round trip. The layer
+    definitions of a service are fetched together in one request.
+    Call invalidate(item_id) after writing to an item so the next lookup fetches it again.
+    """
+
+    def __init__(self, gis):
+        self.gis = gis
+        self.hits = 0
+        self.misses = 0
+        self._items = {}
+        self._service_layers = {}
+        self._layer_properties = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, cache, key, fetch):
+        with self._lock:
+            if key in cache:
+                self.hits += 1
+                return cache[key]
+            self.misses += 1
+        metrics.count("agol.http_calls")
+        value = fetch()
+        with self._lock:
+            cache[key] = value
+        return value
+
+    def get_item(self, item_id):
+        """
+        Returns the Item object for an item ID (gis.content.get).
+        """
+        return self._lookup(self._items, item_id, lambda: self.gis.content.get(item_id))
+
+    def get_service_layers(self, item_id):
+        """
+        Returns the definitions of every layer of a feature service item, fetched in one
+        request to the service's /layers endpoint (through the GIS session). Each definition
+        is also cached for get_layer_properties. Returns an empty list if the endpoint cannot
+        be read, get_layer_properties then fetches the layers one by one.
+        """
+        def fetch():
+            item = self.get_item(item_id)
+            try:
+                response = self.gis.session.get(f"{item.url}/layers", params = {"f": "json"})
+                response.raise_for_status()
+                layers = response.json()
+                if "error" in layers:
+                    raise RuntimeError(layers["error"].get("message", layers["error"]))
+            except Exception as e:
+                print(f" - Could not read {item.url}/layers, layers will be fetched one by one: {e}")
+                return []
+            return layers.get("layers", [])
+
+        layers = self._lookup(self._service_layers, item_id, fetch)
+        with self._lock:
+            for layer_index, layer in enumerate(layers):
+                self._layer_properties.setdefault((item_id, layer_index), layer)
+        return layers
+
+    def get_layer_properties(self, item_id, layer_index):
+        """
+        Returns the definition (properties) of one layer of a feature service item.
+        All layers of the service are fetched together (get_service_layers), a layer
+        missing from that response is fetched on its own.
+        """
+        with self._lock:
+            if (item_id, layer_index) in self._layer_properties:
+                self.hits += 1
+                return self._layer_properties[(item_id, layer_index)]
+        layers = self.get_service_layers(item_id)
+        if layer_index < len(layers):
+            return layers[layer_index]
+        return self._lookup(
+            self._layer_properties,
+            (item_id, layer_index),
+            lambda: self.get_item(item_id).layers[layer_index].properties
+        )
+
+    def invalidate(self, item_id):
+        """
+        Forgets the item and all of its layer definitions.
+        """
+        with self._lock:
+            self._items.pop(item_id, None)
+            self._service_layers.pop(item_id, None)
+            for key in [key for key in self._layer_properties if key[0] == item_id]:
+                del self._layer_properties[key]
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return f"AGOL item cache: {lookups} lookups, {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate)"
+
+
+class HostRateLimiter:
+    """
+    Spaces out requests to the same host so that at most rate requests per second
+    are started, however many threads are sending them. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate = DEFAULT_RATE_LIMIT):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        """
+        Blocks until the next request to url's host is allowed.
+        """
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Outcome of one layer update
+LayerUpdateResult = namedtuple("LayerUpdateResult", ["name", "url", "success", "attempts", "seconds", "message"])
+
+
+def update_layers(layer_jobs, update_layer, workers = DEFAULT_LAYER_WORKERS, rate_limiter = None,
+                  retries = DEFAULT_RETRIES, base_delay = DEFAULT_RETRY_DELAY):
+    """
+    Runs update_layer(url, properties) for every (name, url, properties) job on a
+    pool of workers threads. Every attempt waits for the rate limiter first and
+    transient errors are retried. update_layer may return an AGOL response
+    dictionary, which counts as failed when its 'success' is false.
+    Returns a list of LayerUpdateResult in job order.
+    """
+    rate_limiter = rate_limiter or HostRateLimiter(0)
+
+    def run_job(job):
+        name, url, properties = job
+        attempts = 0
+
+        def limited_update():
+            nonlocal attempts
+            attempts += 1
+            rate_limiter.wait(url)
+            metrics.count("agol.http_calls")
+            with metrics.timer("agol.layer_update"):
+                return update_layer(url, properties)
+
+        start = time.perf_counter()
+        try:
+            response, _ = call_with_retry(
+                limited_update, retries = retries, base_delay = base_delay, description = f"update of {name}"
+            )
+        except Exception as e:
+            return LayerUpdateResult(name, url, False, attempts, time.perf_counter() - start, str(e))
+        success = response.get('success', False) if isinstance(response, dict) else True
+        message = None if success else str(response)
+        return LayerUpdateResult(name, url, success, attempts, time.perf_counter() - start, message)
+
+    with ThreadPoolExecutor(max_workers = max(1, workers)) as executor:
+        return list(executor.map(run_job, layer_jobs))
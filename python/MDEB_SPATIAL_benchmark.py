@@ -0,0 +1,750 @@
+###############################################################################
+## This script benchmarks parts of the MDEB_SPATIAL pipeline on synthetic    ##
+## data, so their performance can be measured without connecting to oracle   ##
+## or ArcGIS Online.                                                         ##
+##                                                                           ##
+## Usage: python python/MDEB_SPATIAL_benchmark.py geometry --rows 20000      ##
+##        python python/MDEB_SPATIAL_benchmark.py package --gdb gdb/A.gdb    ##
+##        python python/MDEB_SPATIAL_benchmark.py metadata --surveys 500     ##
+##        python python/MDEB_SPATIAL_benchmark.py layers --layers 200        ##
+##        python python/MDEB_SPATIAL_benchmark.py popup --columns 500        ##
+##        python python/MDEB_SPATIAL_benchmark.py generalize --tolerance 0.01##
+##        python python/MDEB_SPATIAL_benchmark.py snapshot --rows 100000     ##
+##        python python/MDEB_SPATIAL_benchmark.py dtypes --rows 100000       ##
+##        python python/MDEB_SPATIAL_benchmark.py fetch --rows 100000        ##
+##        python python/MDEB_SPATIAL_benchmark.py pipeline --rows 50000      ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import argparse
+import base64
+import copy
+import io
+import json
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from MDEB_SPATIAL_extract import DEFAULT_CHUNK_SIZE, FETCH_ENGINES, get_table_columns, decode_wkb, build_table_query, read_table_chunks, generalize_geometry, plan_dtypes, compact_dtypes
+from MDEB_SPATIAL_publish import DEFAULT_COMPRESSION, zip_fgdb
+from MDEB_SPATIAL_agol import HostRateLimiter, update_layers
+from MDEB_SPATIAL_popupmodel import PopupModel, create_field_info, default_new_field_config, load_field_rules
+from MDEB_SPATIAL_metadatatemplate import TEMPLATE_PATH, MetadataTemplate, load_field_map
+from MDEB_SPATIAL_synthetic import SYNTHETIC_SRID, SYNTHETIC_SCHEMA, SYNTHETIC_TABLES, make_polygons, table_columns, build_synthetic_database, update_survey_rows, create_synthetic_engine
+from MDEB_SPATIAL_fakeagol import FakeAGOLServer, FakeGIS, FakeFeatureLayer, FakeFeatureLayerCollection
+from MDEB_SPATIAL_instrument import metrics
+from MDEB_SPATIAL_snapshot import SnapshotStore
+
+
+def time_call(func, *args):
+    """
+    Runs func once and returns (seconds, result).
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def time_paths(paths, units, unit, per_second = True):
+    """
+    Times every (path name, function, *args) once and prints one line per path, with
+    the units processed per second (per_second) or the milliseconds per unit.
+    units is the number of units each path processes, None to use each function's result.
+    A path whose optional imports are missing is skipped.
+    Returns a dictionary of path name -> units per second (or seconds per unit).
+    """
+    results = {}
+    for path_name, function, *args in paths:
+        try:
+            seconds, result = time_call(function, *args)
+        except ImportError as e:
+            print(f"  {path_name:<18} skipped ({e})")
+            continue
+        count = result if units is None else units
+        if per_second:
+            results[path_name] = count / seconds
+            print(f"  {path_name:<18} {seconds:8.3f} s  {count / seconds:12,.0f} {unit}/s")
+        else:
+            results[path_name] = seconds / count
+            print(f"  {path_name:<18} {seconds:8.3f} s  {seconds / count * 1e3:8.3f} ms/{unit}")
+    return results
+
+
+# GEOMETRY DECODING
+def decode_wkt_per_row(wkt_values, srid):
+    """
+    The original decoding path: each WKT string is loaded with shapely, converted to an
+    arcgis Geometry through its __geo_interface__ and handed to geopandas.
+    """
+    from arcgis.geometry import Geometry
+    from shapely.wkt import loads as wkt_loads
+    df = pd.DataFrame({'SHAPE_WKT': wkt_values})
+    df['SHAPE'] = df['SHAPE_WKT'].apply(
+        lambda wkt: Geometry(
+        wkt_loads(wkt).__geo_interface__,
+        spatial_reference={'wkid': srid}
+        )
+    )
+    df.drop('SHAPE_WKT', axis = 1, inplace = True)
+    return gpd.GeoDataFrame(df, geometry = 'SHAPE', crs = f'EPSG:{srid}')
+
+
+def benchmark_geometry(rows, vertices):
+    """
+    Compares rows/second of the per-row WKT path and the vectorized WKB path
+    on a synthetic polygon table.
+    """
+    polygons = make_polygons(rows, vertices)
+    wkt_values = shapely.to_wkt(polygons)
+    wkb_values = shapely.to_wkb(polygons)
+    print(f"Synthetic polygon table: {rows} rows, {vertices} vertices per polygon")
+    return time_paths([
+        ("wkt per row", decode_wkt_per_row, wkt_values, SYNTHETIC_SRID),
+        ("wkb vectorized", decode_wkb, wkb_values, SYNTHETIC_SRID),
+    ], rows, "rows")
+
+
+# ZIP PACKAGING
+# Compression settings compared by the packaging benchmark
+PACKAGE_MODES = [("store", None), ("deflate", 1), ("deflate", 6), ("deflate", 9)]
+
+# Size (bytes) up to which a benchmark archive is kept in memory before spilling to disk
+SPOOL_SIZE = 256 * 1024 * 1024
+
+
+def zip_fgdb_in_memory(fgdb_path, compression = DEFAULT_COMPRESSION, level = None, max_memory = SPOOL_SIZE):
+    """
+    Zips a file geodatabase folder into a spooled temporary file, which stays in memory
+    until it grows past max_memory bytes. Returns the file object, positioned at the start.
+    """
+    archive = tempfile.SpooledTemporaryFile(max_size = max_memory, suffix = ".zip")
+    zip_fgdb(fgdb_path, archive, compression, level)
+    archive.seek(0)
+    return archive
+
+
+def make_fgdb(folder, rows, vertices, columns = 20):
+    """
+    Writes a synthetic strata table (polygons plus numeric and repeated text columns)
+    to a file geodatabase and returns its path.
+    """
+    rng = np.random.default_rng(1)
+    attributes = {'OID': np.arange(rows), 'SURVEY_NAME': 'Synthetic Survey'}
+    for column in range(columns):
+        if column % 2:
+            attributes[f'VALUE_{column}'] = rng.normal(size = rows)
+        else:
+            attributes[f'LABEL_{column}'] = rng.choice(['STRATUM A', 'STRATUM B', 'STRATUM C'], rows)
+    gdf = gpd.GeoDataFrame(attributes, geometry = make_polygons(rows, vertices), crs = f'EPSG:{SYNTHETIC_SRID}')
+    fgdb_path = os.path.join(folder, "Synthetic.gdb")
+    gdf.to_file(fgdb_path, layer = "SYNTHETIC", driver = "OpenFileGDB")
+    return fgdb_path
+
+
+def folder_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, file))
+        for root, dirs, files in os.walk(path)
+        for file in files
+    )
+
+
+def benchmark_package(fgdb_paths):
+    """
+    Compares archive size and build time of every compression mode for each
+    file geodatabase. Archives are built in memory.
+    """
+    results = {}
+    for fgdb_path in fgdb_paths:
+        size = folder_size(fgdb_path)
+        print(f"{os.path.basename(fgdb_path)}: {size / 1e6:.1f} MB on disk")
+        for compression, level in PACKAGE_MODES:
+            mode = compression if level is None else f"{compression} {level}"
+            seconds, archive = time_call(zip_fgdb_in_memory, fgdb_path, compression, level)
+            archive_size = archive.seek(0, os.SEEK_END)
+            archive.close()
+            results[(fgdb_path, mode)] = (archive_size, seconds)
+            print(f"  {mode:<10} {archive_size / 1e6:8.1f} MB ({archive_size / size:6.1%})  {seconds:7.2f} s")
+    return results
+
+
+# METADATA RENDERING
+def make_survey_values(surveys, field_map, thumbnail_bytes = 20000, seed = 2):
+    """
+    Creates one dictionary of template values per synthetic survey, shaped like the
+    values update_metadata renders from the feature table.
+    """
+    rng = np.random.default_rng(seed)
+    values = []
+    for survey in range(surveys):
+        thumbnail = rng.integers(0, 256, thumbnail_bytes, dtype = np.uint8).tobytes()
+        survey_values = {}
+        for entry in field_map:
+            if "item_tag" in entry:
+                survey_values[entry["element"]] = [f"tag {tag}" for tag in range(10)]
+            else:
+                survey_values[entry["element"]] = f"Synthetic survey {survey} {entry['element']}"
+        survey_values["thumbnail"] = base64.b64encode(thumbnail).decode("utf-8")
+        values.append(survey_values)
+    return values
+
+
+def render_per_survey_parse(values, field_map):
+    """
+    The original rendering path: the template is parsed and every element is found
+    with an XPath scan for each survey.
+    """
+    tree = ET.parse(TEMPLATE_PATH)
+    root = tree.getroot()
+    for entry in field_map:
+        element = root.find(entry["xpath"])
+        value = values[entry["element"]]
+        if "item_tag" in entry:
+            for child in list(element):
+                element.remove(child)
+            for item in value:
+                ET.SubElement(element, entry["item_tag"]).text = item
+        else:
+            element.text = value
+    output = io.BytesIO()
+    tree.write(output)
+    return output.getvalue()
+
+
+def benchmark_metadata(surveys):
+    """
+    Compares the per survey render time of the parse-and-find path and the
+    compiled template (parsed once, copied per survey).
+    """
+    field_map = load_field_map()
+    survey_values = make_survey_values(surveys, field_map)
+    print(f"Synthetic feature table: {surveys} surveys")
+
+    def run_legacy():
+        return [render_per_survey_parse(values, field_map) for values in survey_values]
+
+    def run_compiled():
+        template = MetadataTemplate()
+        return [template.render(values) for values in survey_values]
+
+    return time_paths([("parse per survey", run_legacy), ("compiled template", run_compiled)], surveys, "survey", per_second = False)
+
+
+# LAYER UPDATES
+def benchmark_layers(layers, latency, error_rate, worker_counts, rate):
+    """
+    Compares layers/second of the layer description update for each worker count
+    against the fake AGOL server, a share error_rate of the updates answered with a 503.
+    """
+    server = FakeAGOLServer(latency, failure_rate = error_rate, seed = 3, flaky_routes = {"update_layer_definition"}).start()
+    server.add_service("0" * 32, "Synthetic", [(f"LAYER_{layer}", []) for layer in range(layers)])
+    base_url = f"{server.base_url}/services/Synthetic/FeatureServer"
+    layer_jobs = [
+        (f"LAYER_{layer}", f"{base_url}/{layer}", {"description": f"Synthetic layer {layer}", "copyrightText": ""})
+        for layer in range(layers)
+    ]
+    print(f"Fake AGOL server: {layers} layers, {latency * 1e3:.0f} ms latency, {error_rate:.0%} errors, rate limit {rate or 'off'}")
+
+    def update_layer(url, properties):
+        return FakeFeatureLayer(url).manager.update_definition(properties)
+
+    results = {}
+    for workers in worker_counts:
+        server.reset_counts()
+        seconds, layer_results = time_call(
+            lambda: update_layers(layer_jobs, update_layer, workers = workers,
+                                  rate_limiter = HostRateLimiter(rate), retries = 3, base_delay = 0.05)
+        )
+        failed = sum(not result.success for result in layer_results)
+        retried = sum(result.attempts > 1 for result in layer_results)
+        results[workers] = layers / seconds
+        print(f"  {workers:>3} workers {seconds:8.2f} s  {layers / seconds:8.1f} layers/s  "
+              f"{server.requests['update_layer_definition']} requests, {retried} retried, {failed} failed")
+    server.shutdown()
+    return results
+
+
+# POPUP UPDATES
+def make_popup_layers(layers, columns, missing_share = 0.2, elements = 2, seed = 4):
+    """
+    Creates (layer fields schema, popupInfo) pairs for synthetic wide survey layers.
+    A missing_share of the columns is left out of the popup, as after new columns
+    were added to a table, and the popup has elements 'fields' popup elements.
+    """
+    rng = np.random.default_rng(seed)
+    popup_layers = []
+    for layer in range(layers):
+        schema = [{"name": "OBJECTID", "alias": "OBJECTID", "type": "esriFieldTypeOID"}]
+        schema += [{"name": f"COLUMN_{column}", "alias": f"Column {column}", "type": "esriFieldTypeDouble"}
+                   for column in range(columns - 1)]
+        in_popup = [field for field in schema if field["name"] == "OBJECTID" or rng.random() >= missing_share]
+        field_infos = [create_field_info(field["name"], field["alias"], default_new_field_config) for field in in_popup]
+        popupInfo = {
+            "title": f"LAYER_{layer}",
+            "fieldInfos": field_infos,
+            "popupElements": [{"type": "fields", "fieldInfos": copy.deepcopy(field_infos)} for element in range(elements)],
+        }
+        popup_layers.append((schema, popupInfo))
+    return popup_layers
+
+
+def update_popup_per_field_scan(layer_fields_schema, popupInfo, objectid_config):
+    """
+    The original popup update: rebuilds the name sets, appends each missing field to
+    every 'fields' element in turn, then scans every popup part for OBJECTID.
+    """
+    layer_field_names = {f['name'].lower() for f in layer_fields_schema}
+    existing_popup_field_names = {f['fieldName'].lower() for f in popupInfo.get('fieldInfos', [])}
+    missing_field_names = layer_field_names - existing_popup_field_names
+    for field_schema in layer_fields_schema:
+        field_name = field_schema['name']
+        if field_name.lower() in missing_field_names:
+            new_field_info = create_field_info(field_name, field_schema.get('alias', field_name), default_new_field_config)
+            popupInfo.setdefault('fieldInfos', []).append(new_field_info)
+            for element in popupInfo.get('popupElements', []):
+                if element.get('type') == 'fields':
+                    element.setdefault('fieldInfos', []).append(new_field_info)
+    popup_parts = [popupInfo['fieldInfos']]
+    popup_parts += [element['fieldInfos'] for element in popupInfo.get('popupElements', [])
+                    if element.get('type') == 'fields' and 'fieldInfos' in element]
+    for field_infos in popup_parts:
+        for field_config in field_infos:
+            if field_config.get('fieldName') == 'OBJECTID':
+                field_config.update(objectid_config)
+
+
+def benchmark_popup(layers, columns):
+    """
+    Compares the per layer popup update time of the per field scan and the indexed
+    popup model on synthetic wide layers.
+    """
+    field_rules = load_field_rules()
+    objectid_config = next(rule.config for rule in field_rules.rules if "OBJECTID" in rule.names)
+    popup_layers = make_popup_layers(layers, columns)
+    print(f"Synthetic popups: {layers} layers, {columns} columns")
+
+    def run_legacy(popup_layers):
+        for schema, popupInfo in popup_layers:
+            update_popup_per_field_scan(schema, popupInfo, objectid_config)
+
+    def run_model(popup_layers):
+        for schema, popupInfo in popup_layers:
+            popup_model = PopupModel(popupInfo)
+            popup_model.add_missing_fields(schema)
+            popup_model.apply_rules(field_rules, schema)
+
+    # each path updates its own copy of the popups
+    return time_paths([
+        ("per field scan", run_legacy, copy.deepcopy(popup_layers)),
+        ("indexed model", run_model, copy.deepcopy(popup_layers)),
+    ], layers, "layer", per_second = False)
+
+
+# GEOMETRY GENERALIZATION
+def benchmark_generalize(rows, vertices, tolerances, precision):
+    """
+    Compares vertex count, file geodatabase size and zip size of a synthetic strata
+    table published as is and generalized with each simplify tolerance.
+    """
+    print(f"Synthetic polygon table: {rows} rows, {vertices} vertices per polygon, precision {precision} decimal places")
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        source_path = make_fgdb(folder, rows, vertices)
+        gdf = gpd.read_file(source_path, layer = "SYNTHETIC")
+        for tolerance in [None] + tolerances:
+            generalized = gdf if tolerance is None else generalize_geometry(gdf.copy(), tolerance, precision)
+            fgdb_path = os.path.join(folder, f"Generalized_{len(results)}.gdb")
+            seconds, _ = time_call(lambda: generalized.to_file(fgdb_path, layer = "SYNTHETIC", driver = "OpenFileGDB"))
+            archive = zip_fgdb_in_memory(fgdb_path, "deflate", 6)
+            archive_size = archive.seek(0, os.SEEK_END)
+            archive.close()
+            vertex_count = int(shapely.get_num_coordinates(generalized.geometry.to_numpy()).sum())
+            label = "as is" if tolerance is None else f"tolerance {tolerance}"
+            results[label] = (vertex_count, folder_size(fgdb_path), archive_size)
+            print(f"  {label:<16} {vertex_count:12,} vertices  {folder_size(fgdb_path) / 1e6:8.1f} MB fgdb  "
+                  f"{archive_size / 1e6:8.1f} MB zip  {seconds:6.2f} s write")
+    return results
+
+
+# SYNTHETIC TABLES
+def synthetic_table(folder, rows, vertices, columns):
+    """
+    Builds a synthetic database with one survey table in folder.
+    Returns (database path, table name, the table's query, engine).
+    """
+    database_path = os.path.join(folder, "synthetic.sqlite")
+    services = build_synthetic_database(database_path, "http://127.0.0.1", 1, 1, rows, vertices, columns)
+    table_name = services[0]["tables"][0]
+    query = build_table_query(SYNTHETIC_SCHEMA, table_name, ["OID", "SURVEY_NAME"] + table_columns(columns), dialect = "sqlite")
+    return database_path, table_name, query, create_synthetic_engine(database_path)
+
+
+# COMPACT DTYPES
+def benchmark_dtypes(rows, vertices, columns):
+    """
+    Compares the attribute memory of a synthetic table read from the database with
+    pandas' default dtypes and with compact dtypes, and the time taken to convert it.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        database_path, table_name, query, engine = synthetic_table(folder, rows, vertices, columns)
+        print(f"Synthetic table: {rows} rows, {vertices} vertices, {columns} columns")
+        memory_before = memory_after = 0
+        seconds = 0.0
+        dtypes = None
+        with engine.connect() as connection:
+            for gdf in read_table_chunks(connection, query):
+                # dtypes are chosen from the first batch, as in compact_batches
+                if dtypes is None:
+                    dtypes = plan_dtypes(gdf)
+                batch_seconds, (batch_before, batch_after) = time_call(compact_dtypes, gdf, dtypes)
+                seconds += batch_seconds
+                memory_before += batch_before
+                memory_after += batch_after
+        engine.dispose()
+    print(f"  default dtypes {memory_before / 1e6:8.1f} MB")
+    print(f"  compact dtypes {memory_after / 1e6:8.1f} MB  ({memory_after / memory_before:.0%}, {seconds:.2f} s to convert)")
+    return memory_before, memory_after
+
+
+# FETCH ENGINES
+def benchmark_fetch(rows, vertices, columns, chunk_size, oracle_table = None):
+    """
+    Compares rows/second and peak python memory of reading a table with every fetch
+    engine (see FETCH_ENGINES), with the time split into fetching, conversion and
+    geometry decoding. Without oracle_table the synthetic SQLite database is read, whose
+    Arrow batches are built from cursor rows, so there only the conversion to pandas is
+    compared. With oracle_table that catalog table is read through the .env oracle connection.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        if oracle_table:
+            from MDEB_SPATIAL_catalog import Catalog, load_environment, create_oracle_engine
+            load_environment()
+            engine = create_oracle_engine()
+            catalog = Catalog.load(engine)
+            schema, table_name = catalog.schema, oracle_table
+            query = build_table_query(schema, table_name, get_table_columns(catalog.df_fields, table_name))
+            print(f"Oracle table {schema}.{table_name}, {chunk_size} rows per batch")
+        else:
+            database_path, table_name, query, engine = synthetic_table(folder, rows, vertices, columns)
+            print(f"Synthetic table: {rows} rows, {vertices} vertices, {columns} columns, {chunk_size} rows per batch")
+            print("Note: these offline numbers do not reflect the arrow engine on oracle. The SQLite stand-in builds its\n"
+                  "Arrow batches from python rows instead of fetch_df_batches, use --oracle-table to measure the real engine.")
+
+        results = {}
+        for engine_name, read_table in FETCH_ENGINES.items():
+            def read():
+                with engine.connect() as connection:
+                    return sum(len(gdf) for gdf in read_table(connection, query, chunk_size))
+
+            metrics.reset()
+            seconds, rows_read = time_call(read)
+            stage_seconds = {name: timer["seconds"] for name, timer in metrics.timers.items()}
+            # peak memory is measured in a second pass, tracemalloc slows the first one down
+            tracemalloc.start()
+            read()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[engine_name] = {"rows_per_second": rows_read / seconds, "peak_memory_bytes": peak_memory}
+            print(f"  {engine_name:<8} {seconds:8.3f} s  {rows_read / seconds:12,.0f} rows/s  {peak_memory / 1e6:8.1f} MB peak  ("
+                  + ", ".join(f"{name.split('.')[-1]} {value:.2f} s" for name, value in sorted(stage_seconds.items())) + ")")
+        engine.dispose()
+    metrics.reset()
+    return results
+
+
+# SNAPSHOTS
+def benchmark_snapshot(rows, vertices, columns):
+    """
+    Compares rows/second of reading a table from the database (the synthetic SQLite
+    database standing in for oracle, WKB decoded per batch) and from its GeoParquet snapshot.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        database_path, table_name, query, engine = synthetic_table(folder, rows, vertices, columns)
+        snapshot_store = SnapshotStore(os.path.join(folder, "snapshots"))
+        print(f"Synthetic table: {rows} rows, {vertices} vertices, {columns} columns")
+
+        def read_database():
+            with engine.connect() as connection:
+                return sum(len(gdf) for gdf in read_table_chunks(connection, query))
+
+        def save_snapshot():
+            with engine.connect() as connection:
+                return sum(len(gdf) for gdf in snapshot_store.save(table_name, "benchmark", read_table_chunks(connection, query)))
+
+        def read_snapshot():
+            return sum(len(gdf) for gdf in snapshot_store.read(table_name, "benchmark"))
+
+        results = time_paths([("database", read_database), ("database + save", save_snapshot), ("snapshot", read_snapshot)], None, "rows")
+        print(f"  snapshot size {folder_size(snapshot_store.path(table_name, 'benchmark')) / 1e6:.1f} MB, "
+              f"database {os.path.getsize(database_path) / 1e6:.1f} MB")
+        engine.dispose()
+    return results
+
+
+# END TO END PIPELINE
+# Stages run by the pipeline benchmark, in the order of MDEB_SPATIAL_fullupdate.py
+PIPELINE_STAGES = ["data", "fields", "metadata", "popup"]
+
+# Results of every pipeline benchmark run, one JSON line per run
+DEFAULT_RESULTS_PATH = "benchmark_results.jsonl"
+
+
+def git_commit():
+    """
+    Returns the short commit hash of the checkout (with -dirty if it has uncommitted
+    changes), or "unknown" outside of a git repository.
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = folder,
+                                capture_output = True, text = True, check = True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd = folder,
+                                 capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if changes else commit
+
+
+def run_pipeline_pass(gis, engine, catalog, server, stage_functions):
+    """
+    Runs every stage once on a fresh item cache and returns the pass results:
+    stage seconds, rows/s of the data stage, peak Python memory, requests
+    answered by the fake AGOL server and the run's counters.
+    """
+    from MDEB_SPATIAL_agol import ItemCache
+    metrics.reset()
+    server.reset_counts()
+    tracemalloc.reset_peak()
+    item_cache = ItemCache(gis)
+    start = time.perf_counter()
+    for stage in PIPELINE_STAGES:
+        print(f"\n=== Stage: {stage} ===")
+        stage_functions[stage](item_cache)
+    seconds = time.perf_counter() - start
+    report = metrics.report()
+    data_seconds = report["timers"].get("stage.data", {}).get("seconds", 0)
+    rows_read = report["counters"].get("data.rows_read", 0)
+    return {
+        "seconds": seconds,
+        "stages": {stage: report["timers"].get(f"stage.{stage}", {}).get("seconds", 0) for stage in PIPELINE_STAGES},
+        "rows_per_second": rows_read / data_seconds if data_seconds else 0,
+        "peak_memory_bytes": tracemalloc.get_traced_memory()[1],
+        "requests": sum(server.requests.values()),
+        "bytes_uploaded": server.bytes_received,
+        "counters": report["counters"],
+    }
+
+
+def previous_result(results_path, config, commit):
+    """
+    Returns the latest result in results_path with the same configuration from a
+    different commit, or None.
+    """
+    if not os.path.exists(results_path):
+        return None
+    previous = None
+    with open(results_path) as file:
+        for line in file:
+            result = json.loads(line)
+            if result["config"] == config and result["commit"] != commit:
+                previous = result
+    return previous
+
+
+def print_pipeline_deltas(result, previous):
+    """
+    Prints each pass's stage times, memory and requests next to those of a previous run.
+    """
+    print(f"\nCompared with {previous['commit']} ({previous['recorded_at']}):")
+
+    def delta(new, old):
+        return f"{(new - old) / old:+7.1%}" if old else "    n/a"
+
+    for pass_name, pass_result in result["passes"].items():
+        old_pass = previous["passes"].get(pass_name)
+        if old_pass is None:
+            continue
+        print(f"  {pass_name} pass")
+        for stage in PIPELINE_STAGES:
+            new, old = pass_result["stages"][stage], old_pass["stages"][stage]
+            print(f"    {stage:<10} {old:8.2f} s -> {new:8.2f} s  {delta(new, old)}")
+        print(f"    {'total':<10} {old_pass['seconds']:8.2f} s -> {pass_result['seconds']:8.2f} s  {delta(pass_result['seconds'], old_pass['seconds'])}")
+        print(f"    {'memory':<10} {old_pass['peak_memory_bytes'] / 1e6:8.1f} MB -> {pass_result['peak_memory_bytes'] / 1e6:7.1f} MB "
+              f"{delta(pass_result['peak_memory_bytes'], old_pass['peak_memory_bytes'])}")
+        print(f"    {'requests':<10} {old_pass['requests']:8} -> {pass_result['requests']:8}")
+
+
+def benchmark_pipeline(services, tables, rows, vertices, columns, latency, results_path):
+    """
+    Runs the data, fields, metadata and popup stages end to end against a synthetic
+    SQLite database (standing in for oracle) and a local fake AGOL server.
+    The stages run three times: a cold pass that publishes everything, a warm pass
+    where change detection should skip unchanged services and metadata, and a
+    changed pass after rows of one table were updated in place, where only that
+    table's service should be published again.
+    The result is appended to results_path and compared with the last run of the
+    same configuration from another commit.
+    """
+    # the stage modules import arcgis, so they are only loaded by this benchmark
+    from MDEB_SPATIAL_dataupdate import update_data
+    from MDEB_SPATIAL_metadataupdate import update_metadata
+    from MDEB_SPATIAL_catalog import Catalog
+    from MDEB_SPATIAL_extract import DEFAULT_EXTRACT_WORKERS
+    from MDEB_SPATIAL_fieldsupdate import update_fields
+    from MDEB_SPATIAL_popupupdate import update_popups
+
+    config = {"services": services, "tables": tables, "rows": rows, "vertices": vertices, "columns": columns, "latency": latency}
+    results_path = os.path.abspath(results_path)
+    commit = git_commit()
+    working_directory = os.getcwd()
+    server = FakeAGOLServer(latency).start()
+
+    with tempfile.TemporaryDirectory() as folder:
+        # the stages write their file geodatabases and state file to the working directory
+        os.chdir(folder)
+        os.environ["STATE_DB"] = os.path.join(folder, "state.sqlite")
+        os.environ.setdefault("AGOL_RATE_LIMIT", "0")
+        os.environ.setdefault("UPLOAD_RETRY_DELAY", "0.1")
+        try:
+            database_path = os.path.join(folder, "synthetic.sqlite")
+            print(f"Building synthetic database: {services} services x {tables} tables, {rows} rows, "
+                  f"{vertices} vertices, {columns} columns")
+            synthetic_services = build_synthetic_database(database_path, server.base_url, services, tables, rows, vertices, columns)
+            for service in synthetic_services:
+                server.add_service(service["item_id"], service["service"], [
+                    (table_name, ["OID", "SURVEY_NAME"] + table_columns(columns))
+                    for table_name in service["tables"]
+                ])
+            engine = create_synthetic_engine(database_path, pool_size = int(os.getenv("EXTRACT_WORKERS", DEFAULT_EXTRACT_WORKERS)))
+            catalog = Catalog.load(engine, schema = SYNTHETIC_SCHEMA, **SYNTHETIC_TABLES)
+            gis = FakeGIS(server.base_url)
+            # the stages reach services and layers through the fake server's classes
+            stage_functions = {
+                "data": lambda item_cache: update_data(gis, engine, catalog, item_cache = item_cache, collection_type = FakeFeatureLayerCollection),
+                "fields": lambda item_cache: update_fields(gis, catalog, item_cache),
+                "metadata": lambda item_cache: update_metadata(
+                    gis, catalog, item_cache, collection_type = FakeFeatureLayerCollection, layer_type = FakeFeatureLayer
+                ),
+                "popup": lambda item_cache: update_popups(gis, catalog, item_cache),
+            }
+
+            tracemalloc.start()
+            passes = {}
+            for pass_name in ("cold", "warm", "changed"):
+                if pass_name == "changed":
+                    update_survey_rows(database_path, synthetic_services[0]["tables"][0], max(1, rows // 100))
+                passes[pass_name] = run_pipeline_pass(gis, engine, catalog, server, stage_functions)
+            tracemalloc.stop()
+            engine.dispose()
+        finally:
+            os.chdir(working_directory)
+            server.shutdown()
+
+    result = {"commit": commit, "recorded_at": datetime.now(timezone.utc).isoformat(), "config": config, "passes": passes}
+    print(f"\nPipeline benchmark ({commit}): {services * tables} tables of {rows} rows, {latency * 1e3:.0f} ms AGOL latency")
+    for pass_name, pass_result in passes.items():
+        stage_seconds = ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in pass_result["stages"].items())
+        print(f"  {pass_name:<7} {pass_result['seconds']:8.2f} s ({stage_seconds})  {pass_result['rows_per_second']:10,.0f} rows/s  "
+              f"peak {pass_result['peak_memory_bytes'] / 1e6:.1f} MB  {pass_result['requests']} requests")
+
+    previous = previous_result(results_path, config, commit)
+    with open(results_path, "a") as file:
+        file.write(json.dumps(result) + "\n")
+    print(f"Result appended to {results_path}")
+    if previous:
+        print_pipeline_deltas(result, previous)
+    return result
+
+
+# RUN THE BENCHMARKS
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark parts of the MDEB_SPATIAL pipeline on synthetic data.")
+    subparsers = parser.add_subparsers(dest = "benchmark", required = True)
+
+    geometry_parser = subparsers.add_parser("geometry", help = "WKT vs WKB geometry decoding")
+    geometry_parser.add_argument("--rows", type = int, default = 20000)
+    geometry_parser.add_argument("--vertices", type = int, default = 200)
+
+    package_parser = subparsers.add_parser("package", help = "zip archive size vs build time per compression mode")
+    package_parser.add_argument("--gdb", nargs = "+", help = "file geodatabase(s) to package (a synthetic one is used if omitted)")
+    package_parser.add_argument("--rows", type = int, default = 20000)
+    package_parser.add_argument("--vertices", type = int, default = 200)
+
+    metadata_parser = subparsers.add_parser("metadata", help = "per survey metadata XML render cost")
+    metadata_parser.add_argument("--surveys", type = int, default = 500)
+
+    layers_parser = subparsers.add_parser("layers", help = "parallel layer description updates against the fake AGOL server")
+    layers_parser.add_argument("--layers", type = int, default = 200)
+    layers_parser.add_argument("--latency", type = float, default = 0.1, help = "seconds per request")
+    layers_parser.add_argument("--error-rate", type = float, default = 0.05, help = "share of requests answered with a 503")
+    layers_parser.add_argument("--workers", type = int, nargs = "+", default = [1, 4, 8])
+    layers_parser.add_argument("--rate", type = float, default = 0, help = "requests per second per host (0 = no limit)")
+
+    popup_parser = subparsers.add_parser("popup", help = "popup field updates on wide layers")
+    popup_parser.add_argument("--layers", type = int, default = 50)
+    popup_parser.add_argument("--columns", type = int, default = 500)
+
+    generalize_parser = subparsers.add_parser("generalize", help = "vertex count and archive size per simplify tolerance")
+    generalize_parser.add_argument("--rows", type = int, default = 20000)
+    generalize_parser.add_argument("--vertices", type = int, default = 200)
+    generalize_parser.add_argument("--tolerance", type = float, nargs = "+", default = [0.001, 0.005, 0.01], help = "simplify tolerances (CRS units)")
+    generalize_parser.add_argument("--precision", type = int, default = 5, help = "coordinate decimal places")
+
+    snapshot_parser = subparsers.add_parser("snapshot", help = "database read vs GeoParquet snapshot read")
+    snapshot_parser.add_argument("--rows", type = int, default = 100000)
+    snapshot_parser.add_argument("--vertices", type = int, default = 100)
+    snapshot_parser.add_argument("--columns", type = int, default = 20)
+
+    dtypes_parser = subparsers.add_parser("dtypes", help = "attribute memory with default vs compact dtypes")
+    dtypes_parser.add_argument("--rows", type = int, default = 100000)
+    dtypes_parser.add_argument("--vertices", type = int, default = 10)
+    dtypes_parser.add_argument("--columns", type = int, default = 20)
+
+    fetch_parser = subparsers.add_parser("fetch", help = "pandas vs arrow fetch engine")
+    fetch_parser.add_argument("--rows", type = int, default = 100000)
+    fetch_parser.add_argument("--vertices", type = int, default = 10)
+    fetch_parser.add_argument("--columns", type = int, default = 40)
+    fetch_parser.add_argument("--chunk-size", type = int, default = DEFAULT_CHUNK_SIZE)
+    fetch_parser.add_argument("--oracle-table", help = "read this catalog table from oracle instead of the synthetic database")
+
+    pipeline_parser = subparsers.add_parser("pipeline", help = "all update stages end to end against SQLite and a fake AGOL server")
+    pipeline_parser.add_argument("--services", type = int, default = 2)
+    pipeline_parser.add_argument("--tables", type = int, default = 2, help = "tables per service (at most 10)")
+    pipeline_parser.add_argument("--rows", type = int, default = 5000)
+    pipeline_parser.add_argument("--vertices", type = int, default = 100)
+    pipeline_parser.add_argument("--columns", type = int, default = 20)
+    pipeline_parser.add_argument("--latency", type = float, default = 0.05, help = "seconds per AGOL request")
+    pipeline_parser.add_argument("--results", default = DEFAULT_RESULTS_PATH, help = "JSON lines file the result is appended to")
+
+    args = parser.parse_args()
+    if args.benchmark == "geometry":
+        benchmark_geometry(args.rows, args.vertices)
+    elif args.benchmark == "package":
+        if args.gdb:
+            benchmark_package(args.gdb)
+        else:
+            with tempfile.TemporaryDirectory() as folder:
+                benchmark_package([make_fgdb(folder, args.rows, args.vertices)])
+    elif args.benchmark == "metadata":
+        benchmark_metadata(args.surveys)
+    elif args.benchmark == "layers":
+        benchmark_layers(args.layers, args.latency, args.error_rate, args.workers, args.rate)
+    elif args.benchmark == "popup":
+        benchmark_popup(args.layers, args.columns)
+    elif args.benchmark == "generalize":
+        benchmark_generalize(args.rows, args.vertices, args.tolerance, args.precision)
+    elif args.benchmark == "snapshot":
+        benchmark_snapshot(args.rows, args.vertices, args.columns)
+    elif args.benchmark == "dtypes":
+        benchmark_dtypes(args.rows, args.vertices, args.columns)
+    elif args.benchmark == "fetch":
+        benchmark_fetch(args.rows, args.vertices, args.columns, args.chunk_size, args.oracle_table)
+    elif args.benchmark == "pipeline":
+        benchmark_pipeline(args.services, args.tables, args.rows, args.vertices, args.columns, args.latency, args.results)
@@ -0,0 +1,96 @@
+###############################################################################
+## Oracle connection and catalog shared by the MDEB_SPATIAL scripts. The     ##
+## layer, field and feature catalog tables are loaded once, in a single      ##
+## read-only transaction, and handed to every update stage.                  ##
+###############################################################################
+
+# IMPORT LIBRARIES
+from dotenv import load_dotenv
+import os
+import pandas as pd
+import oracledb
+from sqlalchemy import create_engine, text
+
+# Set once the oracle instant client has been initialized for this process
+_oracle_client_ready = False
+
+
+def load_environment():
+    """
+    Loads the .env variables (oracle credentials and catalog table names).
+    """
+    load_dotenv(dotenv_path = os.path.expandvars(r"%USERPROFILE%\.config\secrets\.env"))
+
+
+def create_oracle_engine(pool_size = 1):
+    """
+    Creates a SQL alchemy engine using the TNS names alias from the .env file.
+    The pool holds pool_size connections, one for each thread using the database.
+    """
+    global _oracle_client_ready
+    # Enable thick mode, using oracle instant client and tnsnames.ora
+    if not _oracle_client_ready:
+        oracledb.init_oracle_client()
+        _oracle_client_ready = True
+
+    tns_name = os.getenv("TNS_NAME")
+    username = os.getenv("ORACLE_USERNAME")
+    password = os.getenv("ORACLE_PASSWORD")
+    connection_string = f"oracle+oracledb://{username}:{password}@{tns_name}"
+    return create_engine(connection_string, pool_size = pool_size, max_overflow = 0)
+
+
+class Catalog:
+    """
+    In-memory copy of the oracle catalog tables:
+    df_layers (AGOL layer info), df_fields (field info) and df_features (feature service metadata).
+    """
+
+    def __init__(self, schema, df_layers, df_fields, df_features):
+        self.schema = schema
+        self.df_layers = df_layers
+        self.df_fields = df_fields
+        self.df_features = df_features
+
+    @classmethod
+    def load(cls, engine, schema = None, lyr_table = None, fld_table = None, ftr_table = None):
+        """
+        Queries the layer, field and feature tables once. Table names default to
+        SCHEMA, LYR_TABLE, FLD_TABLE and FTR_TABLE from the .env file.
+        The three tables are read in one read-only transaction so they are consistent.
+        The layer table is required (every stage works from it), a field or feature
+        table that is not configured is left as None.
+        """
+        schema = schema or os.getenv("SCHEMA")
+        lyr_table = lyr_table or os.getenv("LYR_TABLE")
+        fld_table = fld_table or os.getenv("FLD_TABLE")
+        ftr_table = ftr_table or os.getenv("FTR_TABLE")
+        if not lyr_table:
+            raise ValueError("No layer table configured, set LYR_TABLE in the .env file")
+
+        with engine.connect() as connection:
+            if connection.dialect.name == "oracle":
+                connection.execute(text("SET TRANSACTION READ ONLY"))
+
+            def read_table(table):
+                if not table:
+                    return None
+                return pd.read_sql(f"SELECT * FROM {schema}.{table}", con = connection)
+
+            # Query table to get AGOL layer info (layer name, url, and layer id)
+            df_layers = read_table(lyr_table)
+
+            # Query table to get field info within tables (field names, aliases and descriptions)
+            df_fields = read_table(fld_table)
+
+            # Query feature table to get info about feature services (metadata)
+            df_features = read_table(ftr_table)
+
+            connection.rollback()
+
+        # Add a column to df_layers to capture the hosted feature service name
+        # Extract from the url
+        regex_pattern = r'.*\/services\/([^/]+)'
+        df_layers['service_name'] = df_layers['rest_url'].str.extract(regex_pattern)
+
+        return cls(schema, df_layers, df_fields, df_features)
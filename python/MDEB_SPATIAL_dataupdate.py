@@ -1,258 +1,528 @@
 ###############################################################################
 ## This script updates AGOL feature service data. It pulls data from the     ##
 ## oracle database and creates file geodatabases. It then updates the        ##
-## feature services using the zipped file geodatabases.                      ##
+## feature services using the zipped file geodatabases. Extracted tables     ##
+## are kept as local GeoParquet snapshots, so unchanged tables are not read  ##
+## from oracle again and data can be published offline (--offline). With     ##
+## --delta only the changed rows are sent instead of overwriting services.   ##
+##                                                                           ##
+## Usage: python python/MDEB_SPATIAL_dataupdate.py [--force] [--offline]     ##
+##        [--delta] [--fetch-engine pandas|arrow]                            ##
 ###############################################################################
 
 # IMPORT LIBRARIES
-from dotenv import load_dotenv
+import argparse
 import os
-import pandas as pd
-import geopandas as gpd
 import oracledb
-import zipfile
 import shutil
-from sqlalchemy import create_engine, text
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from arcgis.gis import GIS
-from arcgis.geometry import Geometry
-from shapely.wkt import loads as wkt_loads
 from arcgis.features import FeatureLayerCollection
-
-# AUTHENTICATE ARCGIS CREDENTIALS
-# Using ArcGIS Pro to authenticate, change authentication scheme if necessary
-gis = GIS("PRO")
-
-# CONNECT TO ORACLE
-# Enable thick mode, using oracle instant client and tnsnames.ora
-oracledb.init_oracle_client()
-
-# Access .env variables
-load_dotenv(dotenv_path = os.path.expandvars(r"%USERPROFILE%\.config\secrets\.env"))
-# Oracle credentials
-tns_name = os.getenv("TNS_NAME") 
-username = os.getenv("ORACLE_USERNAME")
-password = os.getenv("ORACLE_PASSWORD") 
-schema = os.getenv("SCHEMA")
-lyr_table = os.getenv("LYR_TABLE")
-fld_table = os.getenv("FLD_TABLE")
-
-# Connect to oracle database using SQL alchemy engine and TNS names alias
-connection_string = f"oracle+oracledb://{username}:{password}@{tns_name}"
-engine = create_engine(connection_string)
-connection = engine.connect()
-
-# DATA EXTRACTION FROM THE DATABASE
-# Query table to get AGOL layer info (layer name, url, and layer id)
-layers_sql_query = f"SELECT * FROM {schema}.{lyr_table}"
-df_layers = pd.read_sql(layers_sql_query, con = connection)
-
-# Add a column to df_layers to capture the hosted feature service name
-# Extract from the url
-regex_pattern = r'.*\/services\/([^/]+)'
-# Use the .str.extract() method
-df_layers['service_name'] = df_layers['rest_url'].str.extract(regex_pattern)
-
-# Query table to get field info within tables
-fields_sql_query = f"SELECT * FROM {schema}.{fld_table}"
-df_fields = pd.read_sql(fields_sql_query, con = connection)
-
-# Now extract all spatial tables from oracle
-# Create an empty dictionary to hold all dataframes
-dataframes = {}
-
-# Get the list of table names from df_fields
-table_names = df_fields['table_name'].unique()
-print("Getting tables from the database...")
-
-# Make a separate pandas dataframe for each spatial table in the database
-# Ensure that geometry column is handled correctly (convert to wkt)
-with engine.connect() as connection:
-    for table_name in table_names:
-        try:
-            print(f"--- Processing table: '{table_name}' ---")
-
-            columns = df_fields[df_fields['table_name'] == table_name]['col_name'].tolist()
-
-            # Join the known column names into a single string
-            columns_sql_str = ", ".join(columns)
-
-            # Build the final SELECT statement
-            # Manually add the SDO_GEOM conversion for the 'shape' column to every query
-            final_columns_str = f"{columns_sql_str}, TBL.SHAPE.SDO_SRID as SHAPE_SRID, SDO_UTIL.TO_WKTGEOMETRY(SHAPE) AS SHAPE_WKT"
-
-            # Construct the final SQL query
-            query = text(f'SELECT {final_columns_str} FROM {schema}.{table_name} TBL')
-
-            # Execute the query and store the resulting DataFram
-            df = pd.read_sql_query(query, con = connection)
-            if df.shape_srid.all() != True:
-                warnings.warn(f"SHAPE column in the DataFrame contains multiple SRID values.")
-
-            # Order and organize columns consistenly
-            # Convert columns to uppercase immediately for consistent processing
-            df.columns = [col.upper() for col in df.columns]
-
-            # Define the columns to be placed first
-            first_columns = ['OID', 'SURVEY_NAME']
-
-            # Get the remaining columns, excluding the first two
-            all_columns = df.columns.tolist()
-            remaining_columns = [col for col in all_columns if col not in first_columns]
-
-            # Sort the remaining columns alphabetically
-            remaining_columns.sort()
-
-            # Create the final desired column order
-            final_column_order = first_columns + remaining_columns
-
-            # Reindex the DataFrame to apply the new column order
-            df = df.reindex(columns=final_column_order)
-            dataframes[table_name] = df
-            print(f"  Successfully loaded '{table_name}'")
-
-        except Exception as e:
-            print(f" FAILED to load table '{table_name}': {e}")
-
- # Make all dataframes uppercase
- # This is how everything is named in AGOL
-upper_dataframes = {
-    key.upper(): df 
-    for key, df in dataframes.items()
-}
-print("Converted all data table names and columns to uppercase.")
-
-# CREATION OF FILE GEODATABASES
-# Loop through each row in df_layers to create a layer within a file geodatabase
-# The first layer will create the file geodatabase and any subsequent layers will be added to the 
-# file geodatabase based on matching service names
-# Make sure to correctly handle geometry (use shapely and create spatially enabled dataframe)
-
-# Create folder to hold all file geodatabases
-fgdb_folder = "gdb"
-os.mkdir(fgdb_folder)
-
-for index, layer_row in df_layers.iterrows():
-    try:
-        item_id = layer_row['file_id']
-        rest_url = layer_row['rest_url']
-        table_name = layer_row['table_name'] # The key to retrieve the data frame from the dictionary
+from MDEB_SPATIAL_catalog import Catalog, load_environment, create_oracle_engine
+from MDEB_SPATIAL_extract import DEFAULT_CHUNK_SIZE, DEFAULT_EXTRACT_WORKERS, DEFAULT_COMPACT_DTYPES, DEFAULT_FETCH_ENGINE, FETCH_ENGINES, get_table_columns, get_column_dtypes, get_generalization, table_fingerprint, start_table_extraction, write_batches_to_fgdb
+from MDEB_SPATIAL_publish import DEFAULT_QUEUE_SIZE, DEFAULT_UPLOAD_WORKERS, DEFAULT_COMPRESSION, check_compression, zip_fgdb, run_pipeline
+from MDEB_SPATIAL_agol import DEFAULT_RETRIES, DEFAULT_RETRY_DELAY, ItemCache, UpdateSummary, call_with_retry
+from MDEB_SPATIAL_state import DEFAULT_STATE_DB, StateStore
+from MDEB_SPATIAL_snapshot import DEFAULT_SNAPSHOT_FOLDER, DEFAULT_SNAPSHOT_KEEP, SnapshotStore, save_catalog, load_catalog
+from MDEB_SPATIAL_delta import DEFAULT_DELTA_CHUNK_SIZE, read_snapshot_table, diff_tables, apply_delta
+from MDEB_SPATIAL_instrument import metrics, timed, add_instrument_arguments, start_instrumentation, finish_instrumentation
+
+
+def plan_data(engine, catalog, state_store, force = False, services = None, snapshot_store = None):
+    """
+    Compares a fingerprint of every table with the one stored after the last successful
+    update. Services whose tables all match are left out, unless force is used.
+    services limits the check to these service names.
+    Without an engine (offline) the fingerprint of each table's newest snapshot is used.
+    Returns a dictionary of service name -> {table name -> fingerprint} for every
+    service that needs to be overwritten (None for a table that could not be fingerprinted).
+    """
+    schema = catalog.schema
+    df_layers = catalog.df_layers
+    df_fields = catalog.df_fields
+
+    # Fingerprints of the tables of every service that needs to be updated
+    service_fingerprints = {}
+    with engine.connect() if engine is not None else nullcontext() as connection:
+        for service_name, service_layers in df_layers.groupby('service_name'):
+            if services is not None and service_name not in services:
+                continue
+            fingerprints = {}
+            for table_name in service_layers['table_name']:
+                try:
+                    if connection is None:
+                        fingerprints[table_name] = snapshot_store.latest(table_name) if snapshot_store else None
+                        continue
+                    columns = get_table_columns(df_fields, table_name)
+                    generalization = get_generalization(df_layers, table_name)
+                    with metrics.timer("data.fingerprint"):
+                        fingerprints[table_name] = table_fingerprint(connection, schema, table_name, columns, generalization)
+                except Exception as e:
+                    print(f" - Could not fingerprint table '{table_name}': {e}")
+                    fingerprints[table_name] = None
+
+            unchanged = all(
+                fingerprint is not None and fingerprint == state_store.get_fingerprint(f"{service_name}/{table_name}")
+                for table_name, fingerprint in fingerprints.items()
+            )
+            if unchanged and not force:
+                print(f" - No changes found for service '{service_name}'. Skipping.")
+                continue
+            service_fingerprints[service_name] = fingerprints
+    return service_fingerprints
+
+
+def open_snapshot_store(state_store, df_layers):
+    """
+    Opens the local snapshot store (SNAPSHOT_FOLDER, keeping SNAPSHOT_KEEP snapshots per table).
+    The snapshots last published (recorded in the state file) are never pruned.
+    """
+    published_snapshots = {}
+    for service_name, table_name in zip(df_layers['service_name'], df_layers['table_name']):
+        fingerprint = state_store.get_fingerprint(f"{service_name}/{table_name}")
+        if fingerprint is not None:
+            published_snapshots.setdefault(table_name.upper(), set()).add(fingerprint)
+    return SnapshotStore(
+        os.getenv("SNAPSHOT_FOLDER", DEFAULT_SNAPSHOT_FOLDER),
+        int(os.getenv("SNAPSHOT_KEEP", DEFAULT_SNAPSHOT_KEEP)),
+        published = published_snapshots
+    )
+
+
+@timed("stage.data")
+def update_data(gis, engine, catalog, force = False, item_cache = None, services = None, delta = False, fetch_engine = None,
+                collection_type = FeatureLayerCollection):
+    """
+    Rebuilds the file geodatabase of every service whose oracle tables changed and
+    overwrites the AGOL hosted feature service with it.
+    engine is used to extract the tables, its pool should hold EXTRACT_WORKERS connections.
+    Without an engine (offline) every table is published from its newest local snapshot.
+    item_cache can be shared with the other stages.
+    services (e.g. from a change plan) overwrites exactly these services, without change detection.
+    With delta, a service whose published tables still have their snapshot is updated row by row
+    (only inserted, updated and deleted rows are sent) instead of being overwritten. It is
+    overwritten after all if a table's columns changed or an edit fails.
+    fetch_engine ("pandas" or "arrow", see FETCH_ENGINES) selects how tables are read from oracle,
+    defaulting to FETCH_ENGINE in the .env file.
+    collection_type is the class services are overwritten through (FeatureLayerCollection,
+    or a stand-in such as the fake AGOL server's).
+    Returns an UpdateSummary of the updated services.
+    """
+    item_cache = item_cache or ItemCache(gis)
+    schema = catalog.schema
+    df_layers = catalog.df_layers
+    df_fields = catalog.df_fields
+
+    # Zip compression ("store" or "deflate", with a deflate level from 1 to 9) can be set with
+    # PACKAGE_COMPRESSION and PACKAGE_LEVEL in the .env file
+    # (checked before any table is read, not when the first service is zipped)
+    package_compression = os.getenv("PACKAGE_COMPRESSION", DEFAULT_COMPRESSION)
+    package_level = int(os.getenv("PACKAGE_LEVEL")) if os.getenv("PACKAGE_LEVEL") else None
+    check_compression(package_compression, package_level)
+
+    # CHANGE DETECTION
+    # Compare a fingerprint of every table with the one stored after the last successful update
+    # Services whose tables all match are skipped (no rebuild, no overwrite), unless --force is used
+    # The state file location can be changed with STATE_DB in the .env file
+    state_store = StateStore(os.getenv("STATE_DB", DEFAULT_STATE_DB))
+
+    # LOCAL SNAPSHOTS
+    # Every table read from oracle is also saved as a GeoParquet snapshot keyed by its fingerprint
+    # A table that has not changed since its snapshot was saved (e.g. when re-publishing after a failed
+    # upload, or with --force) is read from the snapshot instead of oracle
+    # The folder and the number of snapshots kept per table can be changed with SNAPSHOT_FOLDER and SNAPSHOT_KEEP
+    # The snapshots last published (recorded in the state file) are never pruned, --delta compares against them
+    snapshot_store = open_snapshot_store(state_store, df_layers)
+    service_fingerprints = plan_data(
+        engine, catalog, state_store, force = force or services is not None, services = services, snapshot_store = snapshot_store
+    )
+    table_fingerprints = {
+        table_name: fingerprint
+        for fingerprints in service_fingerprints.values()
+        for table_name, fingerprint in fingerprints.items()
+    }
+
+    # DELTA PUBLISHING
+    # With --delta, a service whose tables were all published from a snapshot that is still kept is not
+    # overwritten: each changed table is compared by OID with the snapshot that was published last and
+    # only the inserted, updated and deleted rows are sent with edit_features (DELTA_CHUNK_SIZE rows per request)
+    # Delta services only need the new snapshots, their file geodatabase is built if an overwrite is needed after all
+    # Services without changes (only updated with --force) and services with a table that could not be
+    # fingerprinted (it has no snapshot to compare with) are always overwritten
+    delta_chunk_size = int(os.getenv("DELTA_CHUNK_SIZE", DEFAULT_DELTA_CHUNK_SIZE))
+    published_fingerprints = {}
+    if delta:
+        for service_name, fingerprints in service_fingerprints.items():
+            published = {table_name: state_store.get_fingerprint(f"{service_name}/{table_name}") for table_name in fingerprints}
+            if published == fingerprints:
+                # only reached with --force (or a plan): an unchanged service has no delta, it is overwritten
+                print(f" - No changes found for service '{service_name}'. The service will be overwritten (--force).")
+            elif any(fingerprint is None for fingerprint in fingerprints.values()):
+                print(f" - A table of '{service_name}' could not be fingerprinted. The service will be overwritten.")
+            elif all(fingerprint is not None and snapshot_store.has(table_name, fingerprint)
+                     for table_name, fingerprint in published.items()):
+                published_fingerprints[service_name] = published
+            else:
+                print(f" - No published snapshot of every table of '{service_name}'. The service will be overwritten.")
+
+    # CREATION OF FILE GEODATABASES
+    # Stream each spatial table from oracle in row batches and write every batch straight into
+    # its layer within a file geodatabase, so only one batch is held in memory at a time
+    # The first layer will create the file geodatabase and any subsequent layers will be added to the
+    # file geodatabase based on matching service names
+    # Batch size (rows fetched per round trip) can be tuned with CHUNK_SIZE in the .env file
+    # Several tables are extracted at the same time, each on its own pooled connection
+    # The number of workers (and database sessions) can be tuned with EXTRACT_WORKERS in the .env file
+    chunk_size = int(os.getenv("CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+    extract_workers = int(os.getenv("EXTRACT_WORKERS", DEFAULT_EXTRACT_WORKERS))
+    oracledb.defaults.arraysize = chunk_size
+
+    # FETCH ENGINE
+    # "pandas" reads each batch with pd.read_sql_query (python row tuples converted to columns)
+    # "arrow" fetches each batch as Arrow record batches with python-oracledb's fetch_df_batches
+    # (needs python-oracledb 3 and pyarrow) and converts them to pandas with little copying
+    # Can be set with FETCH_ENGINE in the .env file or --fetch-engine
+    fetch_engine = fetch_engine or os.getenv("FETCH_ENGINE", DEFAULT_FETCH_ENGINE)
+    if fetch_engine not in FETCH_ENGINES:
+        raise ValueError(f"Unknown fetch engine '{fetch_engine}', expected one of {', '.join(FETCH_ENGINES)}")
+
+    # Create folder to hold all file geodatabases
+    fgdb_folder = "gdb"
+    os.makedirs(fgdb_folder, exist_ok = True)
+
+    # Build the list of tables to extract, one per layer, grouped by service
+    extract_jobs = []
+    service_jobs = {}
+    for index, layer_row in df_layers.iterrows():
+        table_name = layer_row['table_name'] # The name of the spatial table in oracle (and of the layer in the FGDB)
         service_name = layer_row['service_name'] # Used to name the FGDB (zipped FGDB must match the rest service name exactly)
-        
-        print(f"--- Processing Layer: '{table_name}' ---")
-
-        # Get DataFrame for this layer
-        source_df = upper_dataframes.get(table_name)
-        if source_df is None or source_df.empty:
-            print(f"  - No data found for table '{table_name}'. Skipping.")
+        if service_name not in service_fingerprints:
             continue
+        columns = get_table_columns(df_fields, table_name)
+        if not columns:
+            print(f"  - No fields found for table '{table_name}'. Skipping.")
+            continue
+        fgdb_path = f"{fgdb_folder}/{service_name}.gdb"
+        if service_name in published_fingerprints:
+            # a delta only needs the new snapshot, tables that already have one are not read again
+            if snapshot_store.has(table_name, table_fingerprints[table_name]):
+                service_jobs.setdefault(service_name, [])
+                continue
+            fgdb_path = None
+        service_jobs.setdefault(service_name, []).append(len(extract_jobs))
+        extract_jobs.append((table_name, columns, fgdb_path))
+
+    # GEOMETRY GENERALIZATION
+    # Tables with a simplify_tolerance (in the units of the table's CRS) and/or a coordinate_precision
+    # (decimal places) in the layer table are generalized before they are saved and published
+    # (the run report lists the vertex counts before and after, and each service's archive size
+    # next to the size of the archive it was last overwritten with)
+    generalization = {
+        table_name: get_generalization(df_layers, table_name)
+        for table_name, _, _ in extract_jobs
+    }
+
+    # COMPACT DTYPES
+    # Text columns are held as categoricals (repeated values such as survey, region or strata names)
+    # or Arrow backed strings, and columns with a col_dtype in the field table get that dtype
+    # Can be switched off with COMPACT_DTYPES=0 in the .env file
+    column_dtypes = None
+    if int(os.getenv("COMPACT_DTYPES", DEFAULT_COMPACT_DTYPES)):
+        column_dtypes = {table_name: get_column_dtypes(df_fields, table_name) for table_name, _, _ in extract_jobs}
+
+    # Retrieve feature service file id for every service
+    service_item_ids = df_layers.drop_duplicates('service_name').set_index('service_name')['file_id']
+
+    # BUILD, ZIP AND OVERWRITE AGOL HOSTED FEATURE SERVICES
+    # The three stages run as a pipeline: as soon as every layer of a service is written,
+    # its zip and upload start while the layers of the next services are still being built
+    # Several services are overwritten at the same time (UPLOAD_WORKERS in the .env file) and
+    # transient HTTP errors are retried with exponential backoff (UPLOAD_RETRIES, UPLOAD_RETRY_DELAY)
+    upload_workers = int(os.getenv("UPLOAD_WORKERS", DEFAULT_UPLOAD_WORKERS))
+    upload_retries = int(os.getenv("UPLOAD_RETRIES", DEFAULT_RETRIES))
+    upload_retry_delay = float(os.getenv("UPLOAD_RETRY_DELAY", DEFAULT_RETRY_DELAY))
+    upload_summary = UpdateSummary()
+
+    # Several services can be zipped at the same time (PACKAGE_WORKERS), compression runs outside the GIL
+    package_workers = int(os.getenv("PACKAGE_WORKERS", 1))
+
+    # Zipped size of every service archive built in this run, and of the archive each service
+    # was last overwritten with (stored in the state file)
+    archive_sizes = {}
+    previous_archive_sizes = {service_name: state_store.get_fingerprint(f"archive/{service_name}") for service_name in service_jobs}
+
+    def build_service(service_name):
+        """
+        Waits until every table of a service has been written to its file geodatabase.
+        Services with a failed table are dropped, a partially written file geodatabase
+        must not be used to overwrite the service.
+        """
+        fgdb_path = os.path.join(fgdb_folder, f"{service_name}.gdb")
+        failed = False
+        for job_index in service_jobs[service_name]:
+            result = table_futures[job_index].result()
+            table_name = extract_jobs[job_index][0]
+            if isinstance(result, Exception):
+                failed = True
+            elif result == 0:
+                print(f"  - No data found for table '{table_name}'. Skipped.")
+
+        if failed:
+            print(f" - WARNING: Not updating service '{service_name}' because one of its tables failed to load.")
+            if os.path.exists(fgdb_path):
+                shutil.rmtree(fgdb_path)
+            return None
+        if service_name in published_fingerprints:
+            return service_name
+        if not os.path.exists(fgdb_path):
+            print(f" - WARNING: No data was written for service '{service_name}'. Skipping update.")
+            return None
+        return service_name
+
+    def package_service(service_name, fallback = False):
+        """
+        Zips the file geodatabase of a service. Delta services are only zipped
+        when they fall back to an overwrite.
+        """
+        if service_name in published_fingerprints and not fallback:
+            return service_name
+        fgdb_path = os.path.join(fgdb_folder, f"{service_name}.gdb")
+        zip_filepath = os.path.join(fgdb_folder, f"{service_name}.zip")
+        print(f" - Starting compression for: {service_name}.gdb ({package_compression})")
+        with metrics.timer("data.zip"):
+            zip_fgdb(fgdb_path, zip_filepath, package_compression, package_level)
+        archive_sizes[service_name] = os.path.getsize(zip_filepath)
+        metrics.count("data.bytes_zipped", archive_sizes[service_name])
+        print(f" - Successfully created zip file: {zip_filepath}")
+        return service_name
+
+    def overwrite_service(service_item_id, zip_filepath):
+        """
+        Overwrites the data of an AGOL hosted feature service with a zipped file geodatabase.
+        """
+        # Get the Item object for the service
+        service_item = item_cache.get_item(service_item_id)
+
+        # Get the feature layer collection from the service item
+        flc = collection_type.fromitem(service_item)
+
+        # Use the overwrite method to update the data
+        # (the service definition changes, so cached lookups of the item are dropped)
+        try:
+            metrics.count("agol.http_calls")
+            with metrics.timer("agol.overwrite"):
+                return flc.manager.overwrite(zip_filepath)
+        finally:
+            item_cache.invalidate(service_item_id)
+
+    def publish_delta(service_name, service_item_id):
+        """
+        Sends the row changes of every changed table of a delta service to its layers.
+        Returns False, before anything is sent, if a table cannot be compared row by row
+        (e.g. its columns changed) and the service has to be overwritten.
+        """
+        service_layers = df_layers[df_layers['service_name'] == service_name]
+        table_deltas = []
+        for table_name, rest_url in zip(service_layers['table_name'], service_layers['rest_url']):
+            new_fingerprint = service_fingerprints[service_name].get(table_name)
+            old_fingerprint = published_fingerprints[service_name].get(table_name)
+            if new_fingerprint == old_fingerprint:
+                continue
+            with metrics.timer("data.delta_diff"):
+                table_delta = diff_tables(
+                    read_snapshot_table(snapshot_store, table_name, old_fingerprint),
+                    read_snapshot_table(snapshot_store, table_name, new_fingerprint)
+                )
+            if table_delta is None:
+                print(f" - '{table_name}' cannot be compared row by row with the published snapshot (columns changed).")
+                return False
+            table_deltas.append((table_name, int(rest_url[len(rest_url) - 1]), table_delta))
+
+        service_item = item_cache.get_item(service_item_id)
+        try:
+            for table_name, layer_index, table_delta in table_deltas:
+                object_id_field = item_cache.get_layer_properties(service_item_id, layer_index).get('objectIdField', 'OBJECTID')
+                added, updated, deleted = apply_delta(service_item.layers[layer_index], table_delta, object_id_field, delta_chunk_size)
+                print(f"  - '{table_name}': {added} row(s) added, {updated} updated, {deleted} deleted")
+        finally:
+            # the layers changed, cached lookups of the item are dropped
+            item_cache.invalidate(service_item_id)
+        return True
+
+    def build_from_snapshots(service_name):
+        """
+        Writes the file geodatabase of a delta service from its new snapshots and zips
+        it, so the service can be overwritten after all.
+        """
+        fgdb_path = os.path.join(fgdb_folder, f"{service_name}.gdb")
+        for table_name, fingerprint in service_fingerprints[service_name].items():
+            write_batches_to_fgdb(snapshot_store.read(table_name, fingerprint), table_name, fgdb_path)
+        package_service(service_name, fallback = True)
+
+    def record_published(service_name):
+        # Remember the fingerprints so the service is skipped until its tables change
+        # (and the size of the archive it was overwritten with, for the next run's report)
+        published = {
+            f"{service_name}/{table_name}": fingerprint
+            for table_name, fingerprint in service_fingerprints[service_name].items()
+            if fingerprint is not None
+        }
+        if service_name in archive_sizes:
+            published[f"archive/{service_name}"] = str(archive_sizes[service_name])
+        state_store.set_fingerprints(published)
+
+    def upload_service(service_name):
+        """
+        Overwrites the AGOL hosted feature service with the zipped file geodatabase
+        (retrying transient errors), then cleans up the temporary files.
+        """
+        fgdb_path = os.path.join(fgdb_folder, f"{service_name}.gdb")
+        zip_filepath = os.path.join(fgdb_folder, f"{service_name}.zip")
+        try:
+            if service_name not in service_item_ids:
+                print(f" - WARNING: Could not find matching AGOL service ID for service name '{service_name}'. Skipping update.")
+                upload_summary.record(service_name, False, message = "no matching AGOL service ID")
+                return None
+            service_item_id = service_item_ids[service_name]
+
+            # Send only the changed rows of a delta service
+            # (edits are not retried: a partly applied delta is repaired by overwriting the service)
+            if service_name in published_fingerprints:
+                try:
+                    print(f" - Sending row changes for Item ID: {service_item_id}")
+                    published = publish_delta(service_name, service_item_id)
+                except Exception as e:
+                    print(f" - Row changes of '{service_name}' could not be applied: {e}")
+                    published = False
+                if published:
+                    print(f" Success: Hosted Feature Service '{service_name}' updated with row changes.")
+                    upload_summary.record(service_name, True)
+                    metrics.count("data.services_delta")
+                    record_published(service_name)
+                    return service_name
+                print(f" - Overwriting '{service_name}' instead.")
+                metrics.count("data.delta_fallbacks")
+                build_from_snapshots(service_name)
+
+            # Update the AGOL hosted feature service
+            print(f" - Uploading zip and overwriting data for Item ID: {service_item_id}")
+            update_result, attempts = call_with_retry(
+                overwrite_service,
+                service_item_id,
+                zip_filepath,
+                retries = upload_retries,
+                base_delay = upload_retry_delay,
+                description = f"overwrite of '{service_name}'"
+            )
 
-        # Create spatially enabled dataframe
-        print("  - Converting WKT to geometry using Shapely...")
-        sedf = source_df.copy()
-
-        # Get SRID from Oracle data
-        oracle_srid = sedf.SHAPE_SRID.unique()[0]
+            # Print success or failure message
+            if update_result.get('success'):
+                print(f" Success: Hosted Feature Service '{service_name}' updated successfully.")
+                upload_summary.record(service_name, True, attempts)
+                metrics.count("data.services_overwritten")
+                record_published(service_name)
+            else:
+                print(f" Failed: Update of '{service_name}' failed. Messages: {update_result.get('messages')}")
+                upload_summary.record(service_name, False, attempts, update_result.get('messages'))
+            return service_name
 
-        # For each WKT string, load it with Shapely, get its standard geo_interface,
-        # and create an arcgis.geometry.Geometry object from that
-        # Use Oracle SRID to set spatial reference
-        sedf['SHAPE'] = sedf['SHAPE_WKT'].apply(
-            lambda wkt: Geometry(
-            wkt_loads(wkt).__geo_interface__,
-            spatial_reference={'wkid': oracle_srid}
-            )
+        except Exception as e:
+            print(f" - An unhandled error occurred while overwriting '{service_name}': {e}")
+            upload_summary.record(service_name, False, message = e)
+            return None
+
+        finally:
+            # Clean up temporary files
+            print(f"- Cleaning up temporary FGDB and zip file for '{service_name}'.")
+            if os.path.exists(fgdb_path):
+                shutil.rmtree(fgdb_path) # Remove the .gdb directory
+            if os.path.exists(zip_filepath):
+                os.remove(zip_filepath)  # Remove the .zip file
+
+    # The engine pool should hold at least extract_workers connections
+    print(f"Getting tables from the database using {extract_workers} worker(s)...")
+    with ThreadPoolExecutor(max_workers = extract_workers) as executor:
+        table_futures = start_table_extraction(
+            executor, engine, schema, extract_jobs, chunk_size = chunk_size,
+            snapshot_store = snapshot_store, fingerprints = table_fingerprints, generalization = generalization,
+            column_dtypes = column_dtypes, fetch_engine = fetch_engine
         )
-        
-        # Drop well known text column
-        sedf.drop('SHAPE_WKT', axis = 1, inplace = True)
-
-        # Convert sedf to a geopandas dataframe 
-        gdf = gpd.GeoDataFrame(sedf, geometry='SHAPE', crs=f'EPSG:{oracle_srid}')
-
-        # Remove the shape_srid column that is automatically created by geopandas
-        if 'SHAPE_SRID' in gdf.columns:
-            gdf = gdf.drop(columns=['SHAPE_SRID'])
-
-        # Create a file geodatabase from geopandas dataframe
-        # Create within the gdb folder
-        gdf.to_file(
-            filename= f"{fgdb_folder}/{service_name}.gdb",
-            layer = table_name,
-            driver = "OpenFileGDB"
+        stage_timings = run_pipeline(
+            service_jobs.keys(),
+            [("build", build_service), ("zip", package_service, package_workers), ("upload", upload_service, upload_workers)],
+            queue_size = max(DEFAULT_QUEUE_SIZE, package_workers, upload_workers)
         )
 
-    except Exception as e:
-        print(f"An unhandled error occurred for layer '{layer_row.get('layer_name', 'N/A')}': {e}\n")
-
-# ZIP COMPLETED FILE GEODATABASES AND OVERWRITE AGOL HOSTED FEATURE SERVICES
-
-if not os.path.exists(fgdb_folder):
-    print(f"Error: The directory '{fgdb_folder}' was not found. Cannot proceed with update.")
-else:
-    # Iterate through all items in the 'gdb' directory
-    for item_name in os.listdir(fgdb_folder):
-        if item_name.endswith(".gdb") and os.path.isdir(os.path.join(fgdb_folder, item_name)):
-            fgdb_name = item_name                      # ex.'ServiceA.gdb'
-            service_name_base = fgdb_name.split('.')[0] # ex. 'ServiceA'
-            fgdb_path = os.path.join(fgdb_folder, fgdb_name)
-            
-            try:
-                print(f"\nProcessing File Geodatabase: {fgdb_name}")
-
-                # Get the row in df_layers that corresponds to the feature service
-                service_row = df_layers[df_layers['service_name'] == service_name_base].iloc[0]
-                # Retrieve feature service file id
-                service_item_id = service_row['file_id'] 
-                
-                # Zip the FGDB
-                zip_filename = service_name_base + '.zip'
-                zip_filepath = os.path.join(fgdb_folder, zip_filename)
-                base_dir = fgdb_folder # 'gdf'
-                
-                print(f" - Starting compression for: {fgdb_name}")
-                with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zf:
-                    # Walk the FGDB folder to add contents recursively
-                    for root, dirs, files in os.walk(fgdb_path):
-                        # Determine the relative path inside the zip file
-                        archive_root = os.path.relpath(root, base_dir)
-                        for file in files:
-                            full_path = os.path.join(root, file)
-                            archive_path = os.path.join(archive_root, file)
-                            zf.write(full_path, archive_path)
-                
-                print(f" - Successfully created zip file: {zip_filepath}")
-
-                # Update the AGOL hosted feature service 
-                # Get the Item object for the service
-                service_item = gis.content.get(service_item_id)
-
-                # Get the feature layer collection from the service item
-                flc = FeatureLayerCollection.fromitem(service_item)
-                
-                # Use the overwrite method to update the data
-                print(f" - Uploading zip and overwriting data for Item ID: {service_item_id}")
-                update_result = flc.manager.overwrite(zip_filepath)
-                
-                # Print success or failure message
-                if update_result.get('success'):
-                    print(" Success: Hosted Feature Service updated successfully.")
-                else:
-                    print(f" Failed: Update failed. Messages: {update_result.get('messages')}")
-
-                # Clean up temporary files
-                print("- Cleaning up temporary FGDB and zip file.")
-                if os.path.exists(fgdb_path):
-                    shutil.rmtree(fgdb_path) # Remove the .gdb directory
-                if os.path.exists(zip_filepath):
-                    os.remove(zip_filepath)  # Remove the .zip file
-
-            except IndexError:
-                print(f" - WARNING: Could not find matching AGOL service ID for service name '{service_name_base}'. Skipping update.")
-            except Exception as e:
-                print(f" - An unhandled error occurred for FGDB '{fgdb_name}': {e}")
-
-# Final cleanup of the parent directory if empty
-if os.path.exists(fgdb_folder) and not os.listdir(fgdb_folder):
-    os.rmdir(fgdb_folder)
-
-print("\nScript finished. All AGOL feature service data was updated.")
\ No newline at end of file
+    # Print the time spent in each stage (the overlap shows how much the stages ran in parallel)
+    print("\nStage timings:")
+    for line in stage_timings.summary():
+        print(f"  {line}")
+
+    # Print which services were updated, retried or failed
+    print("\nService overwrite summary:")
+    for line in upload_summary.summary():
+        print(f"  {line}")
+
+    # Print how much the generalized tables shrank, and the size of each archive next to
+    # the one the service was last overwritten with
+    counters = metrics.report()["counters"]
+    if counters.get("data.vertices_before"):
+        print(f"\nGeneralized geometry: {counters['data.vertices_before']:,} -> {counters['data.vertices_after']:,} vertices")
+    if archive_sizes:
+        print("\nArchive sizes (last published -> this run):")
+        for service_name, size in archive_sizes.items():
+            previous_size = previous_archive_sizes.get(service_name)
+            previous = f"{int(previous_size) / 1e6:.2f} MB" if previous_size else "unknown"
+            print(f"  {service_name}: {previous} -> {size / 1e6:.2f} MB")
+
+    # Final cleanup of the parent directory if empty
+    if os.path.exists(fgdb_folder) and not os.listdir(fgdb_folder):
+        os.rmdir(fgdb_folder)
+
+    state_store.close()
+
+    return upload_summary
+
+
+# RUN THE SCRIPT
+if __name__ == "__main__":
+    # COMMAND LINE OPTIONS
+    # --force rebuilds and overwrites every service, even if its tables have not changed
+    parser = argparse.ArgumentParser(description = "Update AGOL feature service data from the oracle database.")
+    parser.add_argument("--force", action = "store_true", help = "overwrite every service, even if its tables have not changed")
+    parser.add_argument("--offline", action = "store_true", help = "publish from the local snapshots without connecting to oracle")
+    parser.add_argument("--delta", action = "store_true", help = "send only the changed rows instead of overwriting services")
+    parser.add_argument("--fetch-engine", choices = list(FETCH_ENGINES), help = "how tables are read from oracle (default: FETCH_ENGINE or pandas)")
+    add_instrument_arguments(parser)
+    args = parser.parse_args()
+    start_instrumentation(args)
+
+    # AUTHENTICATE ARCGIS CREDENTIALS
+    # Using ArcGIS Pro to authenticate, change authentication scheme if necessary
+    gis = GIS("PRO")
+
+    # CONNECT TO ORACLE
+    # Access .env variables and connect using a pool with one connection per extraction worker
+    # (offline, the catalog and tables are read from the local snapshots instead)
+    load_environment()
+    snapshot_folder = os.getenv("SNAPSHOT_FOLDER", DEFAULT_SNAPSHOT_FOLDER)
+    if args.offline:
+        engine = None
+        catalog = load_catalog(snapshot_folder)
+    else:
+        engine = create_oracle_engine(pool_size = int(os.getenv("EXTRACT_WORKERS", DEFAULT_EXTRACT_WORKERS)))
+
+        # DATA EXTRACTION FROM THE DATABASE
+        # Query the layer and field tables once (and keep a copy for offline runs)
+        catalog = Catalog.load(engine)
+        save_catalog(catalog, snapshot_folder)
+
+    item_cache = ItemCache(gis)
+    update_data(gis, engine, catalog, force = args.force, item_cache = item_cache, delta = args.delta, fetch_engine = args.fetch_engine)
+    if engine is not None:
+        engine.dispose()
+
+    print(item_cache.summary())
+    finish_instrumentation(args)
+    print("\nScript finished. All AGOL feature service data was updated.")
@@ -0,0 +1,176 @@
+###############################################################################
+## Row level delta publishing used by MDEB_SPATIAL_dataupdate.py --delta. A  ##
+## new table snapshot is compared by OID with the snapshot that was last     ##
+## published, and only the inserted, updated and deleted rows are sent to    ##
+## the hosted feature layer with edit_features, in chunks.                   ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import json
+from collections import namedtuple
+import pandas as pd
+from arcgis.geometry import Geometry
+from MDEB_SPATIAL_instrument import metrics
+
+# Default number of features sent per edit_features request (can be changed with DELTA_CHUNK_SIZE in the .env file)
+DEFAULT_DELTA_CHUNK_SIZE = 500
+
+# Column identifying a row in every published table
+DELTA_KEY = "OID"
+
+# Rows to add and update (geopandas dataframes indexed by OID) and OIDs to delete
+TableDelta = namedtuple("TableDelta", ["adds", "updates", "deletes"])
+
+
+def read_snapshot_table(snapshot_store, table_name, fingerprint):
+    """
+    Reads every part of a table snapshot into one geopandas dataframe
+    (categorical columns keep the categories of every part).
+    Returns None if the snapshot holds no rows.
+    """
+    parts = list(snapshot_store.read(table_name, fingerprint))
+    if not parts:
+        return None
+    table = pd.concat(parts, ignore_index = True)
+    # every part has its own categories, which concat turns into object columns
+    for column in parts[0].columns:
+        if all(isinstance(part[column].dtype, pd.CategoricalDtype) for part in parts):
+            table[column] = pd.api.types.union_categoricals([part[column] for part in parts])
+    return table
+
+
+def diff_tables(old, new, key = DELTA_KEY):
+    """
+    Compares two extracts of a table row by row, matching rows on key.
+    Returns a TableDelta, or None if the tables cannot be compared row by row
+    (a table is empty, the columns or CRS differ, or key is not unique) and the
+    service has to be overwritten instead.
+    """
+    if old is None or new is None:
+        return None
+    if list(old.columns) != list(new.columns) or old.crs != new.crs or key not in new.columns:
+        return None
+    old = old.set_index(key)
+    new = new.set_index(key)
+    if not (old.index.is_unique and new.index.is_unique):
+        return None
+
+    adds = new[~new.index.isin(old.index)]
+    deletes = old.index[~old.index.isin(new.index)].tolist()
+
+    # rows found in both extracts are updated if their geometry or any attribute changed
+    common = new.index[new.index.isin(old.index)]
+    old_common = old.loc[common]
+    new_common = new.loc[common]
+    geometry = new.geometry.name
+    old_wkb = old_common[geometry].to_wkb()
+    new_wkb = new_common[geometry].to_wkb()
+    # missing geometries on both sides count as equal
+    changed = (old_wkb != new_wkb) & ~(old_wkb.isna() & new_wkb.isna())
+    for column in new.columns.drop(geometry):
+        old_values = old_common[column]
+        new_values = new_common[column]
+        if isinstance(old_values.dtype, pd.CategoricalDtype) and isinstance(new_values.dtype, pd.CategoricalDtype):
+            # categoricals are compared on the categories of both extracts
+            categories = old_values.cat.categories.union(new_values.cat.categories)
+            old_values, new_values = old_values.cat.set_categories(categories), new_values.cat.set_categories(categories)
+        if old_values.dtype != new_values.dtype:
+            old_values, new_values = old_values.astype(object), new_values.astype(object)
+        # missing values on both sides count as equal
+        differs = old_values.ne(new_values) & ~(old_values.isna() & new_values.isna())
+        changed |= differs.fillna(True).astype(bool)
+    return TableDelta(adds, new_common[changed], deletes)
+
+
+def to_features(gdf):
+    """
+    Converts rows indexed by OID into esri JSON features (attributes, including OID,
+    and geometry). Dates are sent as epoch milliseconds, missing values as null.
+    """
+    srid = gdf.crs.to_epsg() if gdf.crs is not None else None
+    attributes = pd.DataFrame(gdf.drop(columns = gdf.geometry.name)).reset_index()
+    records = json.loads(attributes.to_json(orient = "records", date_format = "epoch", date_unit = "ms"))
+    geometries = [
+        None if shape is None else dict(Geometry(shape.__geo_interface__, spatial_reference = {'wkid': srid}))
+        for shape in gdf.geometry
+    ]
+    return [{"attributes": record, "geometry": geometry} for record, geometry in zip(records, geometries)]
+
+
+def chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def check_edit_results(response, result_key):
+    """
+    Raises RuntimeError if any edit of an edit_features response failed.
+    """
+    failed = [result for result in response.get(result_key, []) if not result.get('success')]
+    if failed:
+        raise RuntimeError(f"{len(failed)} edit(s) in {result_key} were rejected: {failed[0].get('error')}")
+
+
+def sql_literal(value):
+    """
+    Returns a key value as a SQL literal for a where clause (strings quoted, with
+    embedded single quotes doubled).
+    """
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+def lookup_object_ids(layer, keys, object_id_field, chunk_size, key = DELTA_KEY):
+    """
+    Returns a dictionary of OID -> object id of the layer's features with these OIDs.
+    """
+    object_ids = {}
+    for key_chunk in chunks(keys, chunk_size):
+        values = ", ".join(sql_literal(value) for value in key_chunk)
+        metrics.count("agol.http_calls")
+        feature_set = layer.query(where = f"{key} IN ({values})", out_fields = f"{object_id_field},{key}", return_geometry = False)
+        for feature in feature_set.features:
+            object_ids[feature.attributes[key]] = feature.attributes[object_id_field]
+    return object_ids
+
+
+def apply_delta(layer, table_delta, object_id_field = "OBJECTID", chunk_size = DEFAULT_DELTA_CHUNK_SIZE):
+    """
+    Sends a TableDelta to a feature layer: deletes, then updates, then adds, at most
+    chunk_size features per edit_features request. Updated and deleted rows are matched
+    to the layer's object ids through their OID.
+    Raises RuntimeError if an updated row is missing from the layer, before anything is
+    sent, or if AGOL rejects an edit (the layer no longer matches the published snapshot
+    and should be overwritten).
+    Returns (added, updated, deleted) row counts.
+    """
+    object_ids = lookup_object_ids(layer, list(table_delta.updates.index) + table_delta.deletes, object_id_field, chunk_size)
+    missing = [oid for oid in table_delta.updates.index if oid not in object_ids]
+    if missing:
+        raise RuntimeError(f"{len(missing)} updated row(s) are missing from the layer (e.g. OID {missing[0]})")
+
+    # rows already missing from the layer do not need to be deleted
+    delete_ids = [object_ids[oid] for oid in table_delta.deletes if oid in object_ids]
+    for delete_chunk in chunks(delete_ids, chunk_size):
+        metrics.count("agol.http_calls")
+        with metrics.timer("agol.edit_features"):
+            check_edit_results(layer.edit_features(deletes = delete_chunk), "deleteResults")
+
+    updates = to_features(table_delta.updates)
+    for feature in updates:
+        feature["attributes"][object_id_field] = object_ids[feature["attributes"][DELTA_KEY]]
+    for update_chunk in chunks(updates, chunk_size):
+        metrics.count("agol.http_calls")
+        with metrics.timer("agol.edit_features"):
+            check_edit_results(layer.edit_features(updates = update_chunk), "updateResults")
+
+    for add_chunk in chunks(to_features(table_delta.adds), chunk_size):
+        metrics.count("agol.http_calls")
+        with metrics.timer("agol.edit_features"):
+            check_edit_results(layer.edit_features(adds = add_chunk), "addResults")
+
+    metrics.count("data.rows_added", len(table_delta.adds))
+    metrics.count("data.rows_updated", len(table_delta.updates))
+    metrics.count("data.rows_deleted", len(delete_ids))
+    return len(table_delta.adds), len(table_delta.updates), len(delete_ids)
@@ -0,0 +1,524 @@
+###############################################################################
+## Helper functions used by MDEB_SPATIAL_dataupdate.py to pull spatial       ##
+## tables out of the oracle database in row batches and write each batch     ##
+## straight into a file geodatabase layer (and optionally a local snapshot). ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import hashlib
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import geopandas as gpd
+import shapely
+from sqlalchemy import text, inspect, Date, DateTime, Float, Integer, Numeric
+from MDEB_SPATIAL_instrument import metrics
+
+# Columns that are always placed first in every published table
+FIRST_COLUMNS = ['OID', 'SURVEY_NAME']
+
+# Default number of rows fetched from oracle per batch
+DEFAULT_CHUNK_SIZE = 50000
+
+# Default number of tables extracted at the same time (one database session each)
+DEFAULT_EXTRACT_WORKERS = 4
+
+# Column holding the last change of each row on other dialects (the synthetic database
+# keeps it with triggers), used for fingerprints in place of oracle's ORA_ROWSCN
+STANDIN_CHANGE_COLUMN = "ROW_SCN"
+
+# Default fetch engine (can be changed with FETCH_ENGINE in the .env file or --fetch-engine)
+DEFAULT_FETCH_ENGINE = "pandas"
+
+# Compact dtypes are used unless COMPACT_DTYPES is 0 in the .env file
+DEFAULT_COMPACT_DTYPES = 1
+
+# Text columns with at most this share of distinct values in a batch become categoricals
+DEFAULT_CATEGORY_RATIO = 0.5
+
+# dtype of text columns that are not categoricals (and of col_dtype "string")
+ARROW_STRING = "string[pyarrow]"
+
+# dtype of text columns fetched by the arrow engine: pandas' own text dtype if it is
+# Arrow backed (pandas 3), so both fetch engines return the same dtypes, Arrow backed strings otherwise
+_PANDAS_TEXT_DTYPE = pd.Series(["text"]).dtype
+ARROW_TEXT_DTYPE = _PANDAS_TEXT_DTYPE if isinstance(_PANDAS_TEXT_DTYPE, pd.StringDtype) else pd.StringDtype("pyarrow")
+
+
+def get_table_columns(df_fields, table_name):
+    """
+    Returns the list of column names for a table from the field table.
+    Table names are compared in uppercase (this is how they are named in AGOL).
+    """
+    table_match = df_fields['table_name'].str.upper() == table_name.upper()
+    return df_fields.loc[table_match, 'col_name'].tolist()
+
+
+def get_column_dtypes(df_fields, table_name):
+    """
+    Returns the dtypes set for a table's columns in the optional col_dtype column of
+    the field table (uppercase column name -> dtype, e.g. "category", "string", "Int16"
+    or "float32"). Table names are compared in uppercase.
+    """
+    if 'col_dtype' not in df_fields.columns:
+        return {}
+    table_match = (df_fields['table_name'].str.upper() == table_name.upper()) & df_fields['col_dtype'].notna()
+    return {
+        col_name.upper(): ARROW_STRING if col_dtype == "string" else col_dtype
+        for col_name, col_dtype in zip(df_fields.loc[table_match, 'col_name'], df_fields.loc[table_match, 'col_dtype'])
+    }
+
+
+def get_generalization(df_layers, table_name):
+    """
+    Returns the (simplify tolerance, coordinate precision) of a table from the optional
+    simplify_tolerance and coordinate_precision columns of the layer table, None where
+    a setting is missing or empty. Table names are compared in uppercase.
+    """
+    layer_rows = df_layers[df_layers['table_name'].str.upper() == table_name.upper()]
+
+    def setting(column, convert):
+        if column not in layer_rows.columns or layer_rows.empty or pd.isna(layer_rows[column].iloc[0]):
+            return None
+        return convert(layer_rows[column].iloc[0])
+
+    return setting('simplify_tolerance', float), setting('coordinate_precision', int)
+
+
+def get_source_dtypes(connection, schema, table_name):
+    """
+    Returns the pandas dtype of every numeric and date column of a table, from the
+    database's column metadata (ALL_TAB_COLUMNS on oracle), as uppercase column name -> dtype.
+    Whole number columns (INTEGER, NUMBER(p, 0)) become nullable Int64, other numeric
+    columns float64 and DATE/TIMESTAMP columns datetime64. Text and other columns are left out.
+    """
+    source_dtypes = {}
+    for column in inspect(connection).get_columns(table_name, schema = schema):
+        column_type = column['type']
+        scale = getattr(column_type, "scale", None)
+        if isinstance(column_type, (Numeric, Float)) and scale != 0:
+            source_dtypes[column['name'].upper()] = "float64"
+        elif isinstance(column_type, (Integer, Numeric)):
+            source_dtypes[column['name'].upper()] = "Int64"
+        elif isinstance(column_type, (Date, DateTime)):
+            source_dtypes[column['name'].upper()] = "datetime64[ns]"
+    return source_dtypes
+
+
+def build_table_query(schema, table_name, columns, dialect = "oracle"):
+    """
+    Builds the SELECT statement for a spatial table.
+    The SDO_GEOM conversion for the 'shape' column is added to every query.
+    Geometry is fetched as well known binary, which is smaller than WKT and
+    can be decoded for a whole batch at once.
+    Other dialects (the SQLite benchmark database) store the geometry as
+    SHAPE_WKB and SHAPE_SRID columns, which are selected as they are.
+    """
+    # Join the known column names into a single string
+    columns_sql_str = ", ".join(columns)
+    if dialect == "oracle":
+        final_columns_str = f"{columns_sql_str}, TBL.SHAPE.SDO_SRID as SHAPE_SRID, SDO_UTIL.TO_WKBGEOMETRY(SHAPE) AS SHAPE_WKB"
+    else:
+        final_columns_str = f"{columns_sql_str}, TBL.SHAPE_SRID, TBL.SHAPE_WKB"
+    return text(f'SELECT {final_columns_str} FROM {schema}.{table_name} TBL')
+
+
+def table_fingerprint(connection, schema, table_name, columns, generalization = (None, None)):
+    """
+    Returns a content fingerprint for a spatial table: a hash of its row count, the
+    highest ORA_ROWSCN (changes with every committed insert, update or delete) and the
+    published column list (so catalog changes are picked up as well).
+    Generalization settings (tolerance, precision), if any, are part of the fingerprint
+    so changing them publishes the table again.
+    Other dialects use the highest STANDIN_CHANGE_COLUMN instead of ORA_ROWSCN.
+    """
+    change_column = "ORA_ROWSCN" if connection.dialect.name == "oracle" else STANDIN_CHANGE_COLUMN
+    query = text(f'SELECT COUNT(*) AS row_count, MAX({change_column}) AS max_scn FROM {schema}.{table_name}')
+    row_count, max_scn = connection.execute(query).one()
+    fingerprint_source = f"{row_count}|{max_scn}|{','.join(columns)}"
+    if any(setting is not None for setting in generalization):
+        fingerprint_source += f"|{generalization[0]}|{generalization[1]}"
+    return hashlib.sha256(fingerprint_source.encode("utf-8")).hexdigest()
+
+
+def order_columns(df):
+    """
+    Converts column names to uppercase and orders them consistently
+    (OID and SURVEY_NAME first, every other column alphabetically).
+    """
+    df.columns = [col.upper() for col in df.columns]
+    remaining_columns = sorted(col for col in df.columns if col not in FIRST_COLUMNS)
+    return df.reindex(columns = FIRST_COLUMNS + remaining_columns)
+
+
+def decode_wkb(wkb_values, srid):
+    """
+    Decodes a column of well known binary geometries into a GeoSeries in one
+    vectorized call.
+    """
+    return gpd.GeoSeries.from_wkb(wkb_values, crs = f'EPSG:{srid}')
+
+
+def to_geodataframe(df):
+    """
+    Converts a batch with SHAPE_WKB and SHAPE_SRID columns into a geopandas
+    dataframe with a SHAPE geometry column, using the oracle SRID as the CRS.
+    """
+    srids = df['SHAPE_SRID'].dropna().unique()
+    if len(srids) > 1:
+        warnings.warn("SHAPE column in the DataFrame contains multiple SRID values.")
+    # the arrow fetch returns SDO_SRID (an unconstrained NUMBER) as a float
+    oracle_srid = int(srids[0])
+
+    shape = decode_wkb(df['SHAPE_WKB'].values, oracle_srid)
+    shape.index = df.index
+
+    # Drop well known binary and srid columns (the SRID is carried by the CRS)
+    df = df.drop(columns = ['SHAPE_WKB', 'SHAPE_SRID'])
+    return gpd.GeoDataFrame(df, geometry = shape.rename('SHAPE'))
+
+
+def generalize_geometry(gdf, tolerance = None, precision = None):
+    """
+    Simplifies the geometry of a batch with tolerance (in CRS units, topology preserving
+    so every polygon stays valid) and rounds its coordinates to precision decimal places,
+    vectorized over the whole batch. Vertex counts before and after are added to the
+    run metrics.
+    """
+    if tolerance is None and precision is None:
+        return gdf
+    with metrics.timer("data.generalize"):
+        geometries = gdf.geometry.to_numpy()
+        metrics.count("data.vertices_before", int(shapely.get_num_coordinates(geometries).sum()))
+        if tolerance:
+            geometries = shapely.simplify(geometries, tolerance, preserve_topology = True)
+        if precision is not None:
+            geometries = shapely.set_precision(geometries, 10.0 ** -precision)
+        metrics.count("data.vertices_after", int(shapely.get_num_coordinates(geometries).sum()))
+        gdf[gdf.geometry.name] = gpd.GeoSeries(geometries, index = gdf.index, crs = gdf.crs)
+    return gdf
+
+
+def fits_integer_dtype(values, dtype):
+    """
+    Returns True if every value of a column can be stored in an integer dtype
+    without changing it (whole numbers in range, missing values only for nullable dtypes).
+    """
+    present = values.dropna()
+    if len(present) < len(values) and not isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        return False
+    if present.empty:
+        return True
+    if not pd.api.types.is_numeric_dtype(present) or not (present % 1 == 0).all():
+        return False
+    limits = np.iinfo(getattr(dtype, "numpy_dtype", dtype))
+    return limits.min <= present.min() and present.max() <= limits.max
+
+
+def is_text_column(values):
+    """
+    Returns True for string dtype columns and object columns holding only strings.
+    """
+    if isinstance(values.dtype, pd.StringDtype):
+        return True
+    return values.dtype == object and pd.api.types.infer_dtype(values, skipna = True) == "string"
+
+
+def plan_dtypes(gdf, declared_dtypes = None, category_ratio = DEFAULT_CATEGORY_RATIO):
+    """
+    Chooses the compact dtype of every attribute column of a table from its first batch,
+    so every batch (and snapshot part) of the table gets the same dtypes.
+    Columns with a declared dtype (see get_column_dtypes) get that dtype. Other text
+    columns become categoricals if at most category_ratio of their values are distinct,
+    Arrow backed strings otherwise. Other numeric columns are left as they are (an
+    integer type picked from the data could change the layer's field type).
+    Returns a dictionary of column -> dtype.
+    """
+    declared_dtypes = declared_dtypes or {}
+    dtypes = {}
+    for column in gdf.columns:
+        if column == gdf.geometry.name:
+            continue
+        values = gdf[column]
+        if column in declared_dtypes:
+            dtypes[column] = pd.api.types.pandas_dtype(declared_dtypes[column])
+        elif is_text_column(values):
+            dtypes[column] = "category" if values.nunique() <= category_ratio * len(values) else ARROW_STRING
+    return dtypes
+
+
+def compact_dtypes(gdf, dtypes):
+    """
+    Converts the attribute columns of a batch to the dtypes chosen by plan_dtypes, in place.
+    Integer dtypes are only applied if every value fits.
+    Returns the memory used by the attribute columns before and after, in bytes.
+    """
+    attribute_columns = [column for column in gdf.columns if column != gdf.geometry.name]
+    memory_before = int(gdf[attribute_columns].memory_usage(deep = True, index = False).sum())
+    for column, dtype in dtypes.items():
+        values = gdf[column]
+        if values.dtype == dtype:
+            continue
+        if pd.api.types.is_integer_dtype(dtype) and not fits_integer_dtype(values, dtype):
+            warnings.warn(f"Column '{column}' does not fit col_dtype {dtype}, keeping {values.dtype}.")
+            continue
+        gdf[column] = values.astype(dtype)
+    memory_after = int(gdf[attribute_columns].memory_usage(deep = True, index = False).sum())
+    return memory_before, memory_after
+
+
+def cast_batches(batches, source_dtypes):
+    """
+    Converts the columns of every batch of a table to the dtypes of its source columns
+    (see get_source_dtypes). Without it a column the first batch holds only NULLs in
+    (read as python None) would create a text field in the file geodatabase.
+    """
+    for gdf in batches:
+        for column, dtype in source_dtypes.items():
+            if column in gdf.columns and gdf[column].dtype != dtype:
+                gdf[column] = gdf[column].astype(dtype)
+        yield gdf
+
+
+def compact_batches(batches, table_name, declared_dtypes = None):
+    """
+    Converts every batch of a table to compact dtypes, chosen once from the first batch
+    (see plan_dtypes), and reports the table's attribute memory before and after.
+    """
+    dtypes = None
+    memory_before = memory_after = 0
+    for gdf in batches:
+        with metrics.timer("data.compact_dtypes"):
+            if dtypes is None:
+                dtypes = plan_dtypes(gdf, declared_dtypes)
+            batch_before, batch_after = compact_dtypes(gdf, dtypes)
+        memory_before += batch_before
+        memory_after += batch_after
+        yield gdf
+    metrics.count("data.memory_bytes_before", memory_before)
+    metrics.count("data.memory_bytes_after", memory_after)
+    print(f"  - Attribute memory of '{table_name}': {memory_before / 1e6:.1f} MB -> {memory_after / 1e6:.1f} MB")
+
+
+def read_table_chunks(connection, query, chunk_size = DEFAULT_CHUNK_SIZE):
+    """
+    Yields the rows returned by query as geopandas dataframes of at most
+    chunk_size rows. Rows are streamed from a server side cursor so only one
+    batch is held in memory at a time.
+    """
+    stream_connection = connection.execution_options(stream_results = True, max_row_buffer = chunk_size)
+    chunks = pd.read_sql_query(query, con = stream_connection, chunksize = chunk_size)
+    while True:
+        # time spent waiting on oracle and time spent decoding geometry are recorded separately
+        with metrics.timer("data.oracle_read"):
+            df = next(chunks, None)
+        if df is None:
+            return
+        if df.empty:
+            continue
+        with metrics.timer("data.geometry_decode"):
+            gdf = to_geodataframe(order_columns(df))
+        metrics.count("data.rows_read", len(gdf))
+        yield gdf
+
+
+def arrow_batches_from_cursor(driver_connection, sql, chunk_size = DEFAULT_CHUNK_SIZE):
+    """
+    Yields the rows returned by sql as Arrow tables of at most chunk_size rows, built from
+    DBAPI cursor rows. Stands in for fetch_df_batches on databases without an Arrow
+    fetch (the SQLite benchmark database).
+    """
+    cursor = driver_connection.cursor()
+    try:
+        cursor.execute(sql)
+        names = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield pa.table({name: list(values) for name, values in zip(names, zip(*rows))})
+    finally:
+        cursor.close()
+
+
+def arrow_to_pandas(table):
+    """
+    Converts an Arrow table to a pandas dataframe with as little copying as possible:
+    text columns stay in Arrow memory (ARROW_TEXT_DTYPE) instead of becoming python
+    strings, and every column is converted on its own while the table's buffers are released.
+    The table must not be used afterwards.
+    """
+    return table.to_pandas(
+        types_mapper = {pa.string(): ARROW_TEXT_DTYPE, pa.large_string(): ARROW_TEXT_DTYPE}.get,
+        split_blocks = True,
+        self_destruct = True
+    )
+
+
+def read_table_arrow(connection, query, chunk_size = DEFAULT_CHUNK_SIZE):
+    """
+    Same as read_table_chunks, but the rows are fetched as Arrow record batches with
+    python-oracledb's fetch_df_batches instead of being built into python row tuples
+    by pd.read_sql_query, and each batch is converted with arrow_to_pandas.
+    Other dialects (the SQLite benchmark database) use arrow_batches_from_cursor.
+    """
+    driver_connection = connection.connection.driver_connection
+    if connection.dialect.name == "oracle":
+        arrow_batches = (pa.table(odf) for odf in driver_connection.fetch_df_batches(statement = str(query), size = chunk_size))
+    else:
+        arrow_batches = arrow_batches_from_cursor(driver_connection, str(query), chunk_size)
+    while True:
+        with metrics.timer("data.oracle_read"):
+            table = next(arrow_batches, None)
+        if table is None:
+            return
+        if table.num_rows == 0:
+            continue
+        with metrics.timer("data.arrow_to_pandas"):
+            df = arrow_to_pandas(table)
+        del table
+        with metrics.timer("data.geometry_decode"):
+            gdf = to_geodataframe(order_columns(df))
+        metrics.count("data.rows_read", len(gdf))
+        yield gdf
+
+
+# Table readers by fetch engine
+FETCH_ENGINES = {"pandas": read_table_chunks, "arrow": read_table_arrow}
+
+
+def write_batches_to_fgdb(batches, table_name, fgdb_path, write_lock = None):
+    """
+    Writes batches of a table (geopandas dataframes) into a layer of a file geodatabase.
+    The first batch creates the layer and every following batch is appended to it.
+    If write_lock is given it is held while a batch is written, so several tables
+    can be streamed into the same file geodatabase from different threads.
+    Without an fgdb_path the batches are only consumed (e.g. to save a snapshot).
+    Returns the number of rows written.
+    """
+    rows_written = 0
+    for gdf in batches:
+        if fgdb_path is None:
+            rows_written += len(gdf)
+            continue
+        with write_lock or nullcontext(), metrics.timer("data.to_file"):
+            gdf.to_file(
+                filename = fgdb_path,
+                layer = table_name,
+                driver = "OpenFileGDB",
+                mode = "a" if rows_written else "w"
+            )
+        rows_written += len(gdf)
+        print(f"  - Wrote {rows_written} rows to '{table_name}'")
+    return rows_written
+
+
+def write_table_to_fgdb(connection, schema, table_name, columns, fgdb_path, chunk_size = DEFAULT_CHUNK_SIZE,
+                        write_lock = None, snapshot_store = None, fingerprint = None, generalization = (None, None),
+                        column_dtypes = None, fetch_engine = DEFAULT_FETCH_ENGINE):
+    """
+    Streams a spatial table from oracle into a layer of a file geodatabase
+    (see write_batches_to_fgdb), reading it with the fetch_engine's reader
+    (see FETCH_ENGINES). The dtypes of numeric and date columns are taken from
+    the table's column metadata before the first batch is written, so every batch
+    (and the layer created by the first one) gets the same types. With column_dtypes (declared dtypes, see
+    get_column_dtypes) every batch is converted to compact dtypes. The geometry of
+    every batch is generalized with the table's (tolerance, precision), if set.
+    If a snapshot_store and the table's fingerprint are given, every batch is saved
+    to a snapshot as well.
+    Returns the number of rows written.
+    """
+    query = build_table_query(schema, table_name, columns, connection.dialect.name)
+    source_dtypes = get_source_dtypes(connection, schema, table_name)
+    batches = cast_batches(FETCH_ENGINES[fetch_engine](connection, query, chunk_size), source_dtypes)
+    if column_dtypes is not None:
+        batches = compact_batches(batches, table_name, column_dtypes)
+    if any(setting is not None for setting in generalization):
+        batches = (generalize_geometry(gdf, *generalization) for gdf in batches)
+    if snapshot_store is not None and fingerprint is not None:
+        batches = snapshot_store.save(table_name, fingerprint, batches)
+    return write_batches_to_fgdb(batches, table_name, fgdb_path, write_lock)
+
+
+def start_table_extraction(executor, engine, schema, jobs, chunk_size = DEFAULT_CHUNK_SIZE, snapshot_store = None, fingerprints = None,
+                           generalization = None, column_dtypes = None, fetch_engine = DEFAULT_FETCH_ENGINE):
+    """
+    Submits every table to an executor and returns one future per job.
+    jobs is a list of (table_name, columns, fgdb_path) tuples. Each table is loaded by
+    one worker on its own pooled connection, so the engine pool should hold at least
+    as many connections as the executor has workers. Writes to the same file
+    geodatabase are serialized.
+    With a snapshot_store, a table whose fingerprint (fingerprints: table name ->
+    fingerprint) has a snapshot is read from it instead of oracle, other tables are
+    saved to a snapshot while they are loaded. Without an engine (offline) every
+    table must have a snapshot.
+    generalization (table name -> (tolerance, precision)) generalizes the geometry of
+    the tables read from oracle, snapshots already hold generalized geometry.
+    column_dtypes (table name -> declared dtypes) converts the tables read from oracle
+    to compact dtypes, None leaves pandas' default dtypes.
+    fetch_engine selects how tables are read from oracle (see FETCH_ENGINES).
+    Each future holds the number of rows written, or the exception raised while
+    loading that table (a failed table does not stop the others).
+    """
+    fgdb_locks = {fgdb_path: threading.Lock() for _, _, fgdb_path in jobs}
+    fingerprints = fingerprints or {}
+    generalization = generalization or {}
+
+    def load_table(table_name, columns, fgdb_path):
+        try:
+            print(f"--- Processing table: '{table_name}' ---")
+            fingerprint = fingerprints.get(table_name)
+            with metrics.profile(f"table {table_name}"):
+                if snapshot_store is not None and snapshot_store.has(table_name, fingerprint):
+                    # the table has not changed since the snapshot was saved
+                    print(f"  Reading '{table_name}' from snapshot {fingerprint[:12]}")
+                    metrics.count("data.snapshot_hits")
+                    rows_written = write_batches_to_fgdb(
+                        snapshot_store.read(table_name, fingerprint),
+                        table_name,
+                        fgdb_path,
+                        write_lock = fgdb_locks[fgdb_path]
+                    )
+                elif engine is None:
+                    raise FileNotFoundError(f"No snapshot of '{table_name}' to publish offline")
+                else:
+                    with engine.connect() as connection:
+                        rows_written = write_table_to_fgdb(
+                            connection,
+                            schema,
+                            table_name,
+                            columns,
+                            fgdb_path,
+                            chunk_size = chunk_size,
+                            write_lock = fgdb_locks[fgdb_path],
+                            snapshot_store = snapshot_store,
+                            fingerprint = fingerprint,
+                            generalization = generalization.get(table_name, (None, None)),
+                            column_dtypes = None if column_dtypes is None else column_dtypes.get(table_name, {}),
+                            fetch_engine = fetch_engine
+                        )
+            print(f"  Successfully loaded '{table_name}' ({rows_written} rows)")
+            metrics.count("data.tables_loaded")
+            return rows_written
+        except Exception as e:
+            print(f" FAILED to load table '{table_name}': {e}")
+            metrics.count("data.tables_failed")
+            return e
+
+    return [executor.submit(load_table, *job) for job in jobs]
+
+
+def extract_tables(engine, schema, jobs, chunk_size = DEFAULT_CHUNK_SIZE, max_workers = DEFAULT_EXTRACT_WORKERS):
+    """
+    Streams several spatial tables into file geodatabases at the same time and waits
+    for all of them (see start_table_extraction).
+    Returns a list with, for each job in order, the number of rows written or the
+    exception raised while loading that table.
+    """
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = start_table_extraction(executor, engine, schema, jobs, chunk_size)
+    return [future.result() for future in futures]
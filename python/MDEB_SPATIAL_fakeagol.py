@@ -0,0 +1,482 @@
+###############################################################################
+## Local stand-in for the ArcGIS Online endpoints used by the MDEB_SPATIAL   ##
+## update stages, for offline benchmarks. A threaded HTTP server keeps the   ##
+## items, service and layer definitions in memory, answers after a set       ##
+## latency and counts every request. Overwrites load the features of the     ##
+## uploaded file geodatabase, which can then be queried and edited. Routes   ##
+## can be made to fail with a transient HTTP status at a set rate. FakeGIS,  ##
+## FakeItem, FakeFeatureLayer and FakeFeatureLayerCollection call it the     ##
+## way the stages call arcgis.                                               ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import base64
+import copy
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import requests
+import geopandas as gpd
+import shapely
+
+# Routes that fail at the server's failure_rate by default (the large uploads, where AGOL returns 503s and 429s)
+FLAKY_ROUTES = {"overwrite_service"}
+
+# Request routes: (method, path pattern, handler method of FakeAGOLServer)
+ROUTES = [
+    ("GET", re.compile(r"^/items/(\w+)$"), "get_item"),
+    ("GET", re.compile(r"^/items/(\w+)/data$"), "get_item_data"),
+    ("POST", re.compile(r"^/items/(\w+)/update$"), "update_item"),
+    ("GET", re.compile(r"^/services/([^/]+)/FeatureServer$"), "get_service"),
+    ("GET", re.compile(r"^/services/([^/]+)/FeatureServer/layers$"), "get_service_layers"),
+    ("GET", re.compile(r"^/services/([^/]+)/FeatureServer/(\d+)$"), "get_layer"),
+    ("POST", re.compile(r"^/services/([^/]+)/FeatureServer/updateDefinition$"), "update_service_definition"),
+    ("POST", re.compile(r"^/services/([^/]+)/FeatureServer/(\d+)/updateDefinition$"), "update_layer_definition"),
+    ("POST", re.compile(r"^/services/([^/]+)/FeatureServer/overwrite$"), "overwrite_service"),
+    ("POST", re.compile(r"^/services/([^/]+)/FeatureServer/(\d+)/query$"), "query_layer"),
+    ("POST", re.compile(r"^/services/([^/]+)/FeatureServer/(\d+)/applyEdits$"), "apply_edits"),
+]
+
+# Where clauses understood by query_layer: <field> IN (<literal>, ...)
+_IN_CLAUSE = re.compile(r"^(\w+) IN \((.*)\)$")
+_SQL_LITERAL = re.compile(r"'((?:[^']|'')*)'|([^,\s]+)")
+
+
+def layer_fields(field_names):
+    """
+    Field definitions of a freshly published layer: an OBJECTID field followed by
+    the table's columns, every alias set to the column name and no descriptions.
+    """
+    fields = [{"name": "OBJECTID", "type": "esriFieldTypeOID", "alias": "OBJECTID", "description": None}]
+    fields += [{"name": name, "type": "esriFieldTypeString", "alias": name, "description": None} for name in field_names]
+    return fields
+
+
+def parse_in_clause(where):
+    """
+    Returns (field, values) of a "<field> IN (<literal>, ...)" where clause, or None for
+    any other clause (which matches every feature). Quoted literals are strings, others numbers.
+    """
+    match = _IN_CLAUSE.match(where.strip())
+    if match is None:
+        return None
+    values = [
+        literal.group(1).replace("''", "'") if literal.group(1) is not None else json.loads(literal.group(2))
+        for literal in _SQL_LITERAL.finditer(match.group(2))
+    ]
+    return match.group(1), values
+
+
+def read_uploaded_features(data, layer_names):
+    """
+    Reads the layers of an uploaded zipped file geodatabase as features (attributes
+    and GeoJSON geometry without object ids). Returns layer name -> features for the
+    layers found, an empty dictionary if data is not a zip file.
+    """
+    if not zipfile.is_zipfile(io.BytesIO(data)):
+        return {}
+    layer_features = {}
+    with tempfile.TemporaryDirectory() as folder:
+        zipfile.ZipFile(io.BytesIO(data)).extractall(folder)
+        for fgdb_name in os.listdir(folder):
+            fgdb_path = os.path.join(folder, fgdb_name)
+            for layer_name in set(layer_names) & set(gpd.list_layers(fgdb_path)["name"]):
+                gdf = gpd.read_file(fgdb_path, layer = layer_name)
+                records = json.loads(gdf.drop(columns = gdf.geometry.name).to_json(orient = "records"))
+                geometries = [None if shape is None else json.loads(shapely.to_geojson(shape)) for shape in gdf.geometry]
+                layer_features[layer_name] = [{"attributes": record, "geometry": geometry} for record, geometry in zip(records, geometries)]
+    return layer_features
+
+
+class FakeAGOLHandler(BaseHTTPRequestHandler):
+    """
+    Routes each request to the server, after server.latency seconds.
+    Bodies are JSON, except overwrite which receives the zip file as is.
+    """
+
+    def _handle(self, method):
+        time.sleep(self.server.latency)
+        path = urlparse(self.path).path
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        for route_method, pattern, handler_name in ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                self.server.count_request(handler_name, len(body))
+                if self.server.should_fail(handler_name):
+                    status = self.server.failure_status
+                    response = {"error": {"code": status, "message": f"Simulated failure of {handler_name}"}}
+                    break
+                try:
+                    status, response = 200, getattr(self.server, handler_name)(*match.groups(), body = body)
+                except (KeyError, IndexError) as e:
+                    status, response = 404, {"error": {"code": 404, "message": f"Not found: {e}"}}
+                break
+        else:
+            self.server.count_request("unknown", len(body))
+            status, response = 404, {"error": {"code": 404, "message": f"No route for {method} {path}"}}
+        payload = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeAGOLServer(ThreadingHTTPServer):
+    """
+    In-memory hosted feature services. Each service has an item (properties, item
+    data holding the popups, metadata and thumbnail), a service definition, one
+    definition per layer and the features of every layer (object id -> feature).
+    Requests and uploaded bytes are counted per endpoint.
+    A failure_rate share of the requests to flaky_routes (handler names, FLAKY_ROUTES by
+    default) is answered with failure_status (e.g. 503 or 429) instead, drawn from a
+    generator seeded with seed.
+    """
+
+    def __init__(self, latency = 0.0, failure_rate = 0.0, failure_status = 503, seed = 0, flaky_routes = FLAKY_ROUTES):
+        super().__init__(("127.0.0.1", 0), FakeAGOLHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.flaky_routes = set(flaky_routes)
+        self.failures = Counter()
+        self._random = random.Random(seed)
+        self.base_url = f"http://127.0.0.1:{self.server_port}"
+        self.requests = Counter()
+        self.bytes_received = 0
+        self.items = {}
+        self.services = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+        return self
+
+    def count_request(self, handler_name, size):
+        with self._lock:
+            self.requests[handler_name] += 1
+            self.bytes_received += size
+
+    def should_fail(self, handler_name):
+        """
+        Returns True (and counts a failure) if this request to handler_name should fail.
+        """
+        if handler_name not in self.flaky_routes or not self.failure_rate:
+            return False
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+            if failed:
+                self.failures[handler_name] += 1
+        return failed
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests.clear()
+            self.failures.clear()
+            self.bytes_received = 0
+
+    def add_service(self, item_id, service_name, layers):
+        """
+        Publishes a service. layers is a list of (layer name, column names) in layer order.
+        """
+        url = f"{self.base_url}/services/{service_name}/FeatureServer"
+        self.items[item_id] = {
+            "properties": {
+                "id": item_id, "title": service_name, "type": "Feature Service", "url": url,
+                "tags": [], "snippet": None, "description": None, "licenseInfo": None, "accessInformation": None,
+            },
+            "data": {"layers": [{"id": index, "name": name} for index, (name, _) in enumerate(layers)]},
+            "metadata": None,
+            "thumbnail": None,
+        }
+        self.services[service_name] = {
+            "definition": {"serviceDescription": "", "copyrightText": ""},
+            "layers": [
+                {"id": index, "name": name, "description": "", "copyrightText": "", "objectIdField": "OBJECTID", "fields": layer_fields(columns)}
+                for index, (name, columns) in enumerate(layers)
+            ],
+            "features": [{} for _ in layers],
+        }
+
+    def layer_features(self, service_name, layer_index):
+        """
+        Returns a copy of the features of a layer, ordered by object id.
+        """
+        with self._lock:
+            features = self.services[service_name]["features"][int(layer_index)]
+            return [copy.deepcopy(features[object_id]) for object_id in sorted(features)]
+
+    def delete_features(self, service_name, layer_index, object_ids):
+        """
+        Removes features from a layer behind the client's back (e.g. edited in AGOL).
+        """
+        with self._lock:
+            for object_id in object_ids:
+                self.services[service_name]["features"][int(layer_index)].pop(object_id, None)
+
+    # ITEM ENDPOINTS
+    def get_item(self, item_id, body):
+        with self._lock:
+            item = self.items[item_id]
+            return dict(item["properties"], layer_count = len(item["data"]["layers"]))
+
+    def get_item_data(self, item_id, body):
+        with self._lock:
+            return copy.deepcopy(self.items[item_id]["data"])
+
+    def update_item(self, item_id, body):
+        update = json.loads(body)
+        with self._lock:
+            item = self.items[item_id]
+            item_properties = dict(update.get("item_properties") or {})
+            text = item_properties.pop("text", None)
+            if text is not None:
+                item["data"] = json.loads(text) if isinstance(text, str) else text
+            item["properties"].update(item_properties)
+            for part in ("metadata", "thumbnail"):
+                if update.get(part) is not None:
+                    item[part] = base64.b64decode(update[part])
+        return {"success": True}
+
+    # SERVICE ENDPOINTS
+    def get_service(self, service_name, body):
+        with self._lock:
+            service = self.services[service_name]
+            return dict(service["definition"], layers = [{"id": layer["id"], "name": layer["name"]} for layer in service["layers"]])
+
+    def get_service_layers(self, service_name, body):
+        with self._lock:
+            return {"layers": copy.deepcopy(self.services[service_name]["layers"])}
+
+    def get_layer(self, service_name, layer_index, body):
+        with self._lock:
+            return copy.deepcopy(self.services[service_name]["layers"][int(layer_index)])
+
+    def update_service_definition(self, service_name, body):
+        with self._lock:
+            self.services[service_name]["definition"].update(json.loads(body))
+        return {"success": True}
+
+    def update_layer_definition(self, service_name, layer_index, body):
+        """
+        Sets the given layer properties. Fields are merged by name, like the admin endpoint.
+        """
+        update = json.loads(body)
+        with self._lock:
+            layer = self.services[service_name]["layers"][int(layer_index)]
+            fields = {field["name"]: field for field in layer["fields"]}
+            for field in update.pop("fields", []):
+                if field["name"] in fields:
+                    fields[field["name"]].update(field)
+            layer.update(update)
+        return {"success": True}
+
+    def overwrite_service(self, service_name, body):
+        """
+        Replaces the service data with the layers of the uploaded zipped file geodatabase
+        (matched by layer name, an upload that is not a zip file keeps the features).
+        As in AGOL, the field aliases and descriptions are reset.
+        """
+        with self._lock:
+            layer_names = [layer["name"] for layer in self.services[service_name]["layers"]]
+        uploaded = read_uploaded_features(body, layer_names)
+        with self._lock:
+            service = self.services[service_name]
+            for layer, layer_name in zip(service["layers"], layer_names):
+                layer["fields"] = layer_fields([field["name"] for field in layer["fields"][1:]])
+                if layer_name in uploaded:
+                    service["features"][layer["id"]] = {
+                        object_id: {"attributes": dict(feature["attributes"], OBJECTID = object_id), "geometry": feature["geometry"]}
+                        for object_id, feature in enumerate(uploaded[layer_name], start = 1)
+                    }
+        return {"success": True}
+
+    # FEATURE ENDPOINTS
+    def query_layer(self, service_name, layer_index, body):
+        """
+        Returns the features matching a "<field> IN (...)" where clause (any other clause
+        matches every feature), with the requested fields.
+        """
+        query = json.loads(body)
+        in_clause = parse_in_clause(query.get("where", "1=1"))
+        out_fields = query.get("outFields", "*")
+        features = []
+        for feature in self.layer_features(service_name, layer_index):
+            attributes = feature["attributes"]
+            if in_clause is not None and attributes.get(in_clause[0]) not in in_clause[1]:
+                continue
+            if out_fields != "*":
+                attributes = {field: attributes.get(field) for field in out_fields.split(",")}
+            features.append({"attributes": attributes, "geometry": feature["geometry"] if query.get("returnGeometry", True) else None})
+        return {"features": features}
+
+    def apply_edits(self, service_name, layer_index, body):
+        """
+        Adds, updates (matched on OBJECTID) and deletes (by object id) features, like applyEdits.
+        Edits of object ids the layer does not have fail.
+        """
+        edits = json.loads(body)
+        results = {"addResults": [], "updateResults": [], "deleteResults": []}
+        with self._lock:
+            features = self.services[service_name]["features"][int(layer_index)]
+            for feature in edits.get("adds") or []:
+                object_id = max(features, default = 0) + 1
+                features[object_id] = {"attributes": dict(feature["attributes"], OBJECTID = object_id), "geometry": feature.get("geometry")}
+                results["addResults"].append({"objectId": object_id, "success": True})
+            for feature in edits.get("updates") or []:
+                object_id = feature["attributes"].get("OBJECTID")
+                if object_id not in features:
+                    results["updateResults"].append({"objectId": object_id, "success": False, "error": {"code": 1019, "description": "Object is missing."}})
+                    continue
+                features[object_id]["attributes"].update(feature["attributes"])
+                if "geometry" in feature:
+                    features[object_id]["geometry"] = feature["geometry"]
+                results["updateResults"].append({"objectId": object_id, "success": True})
+            for object_id in edits.get("deletes") or []:
+                success = features.pop(object_id, None) is not None
+                results["deleteResults"].append({"objectId": object_id, "success": success})
+        return results
+
+
+# CLIENT SHIMS (the parts of the arcgis API used by the update stages)
+def _get(url, params = None):
+    response = requests.get(url, params = params)
+    response.raise_for_status()
+    return response.json()
+
+
+def _post(url, payload):
+    response = requests.post(url, data = payload)
+    response.raise_for_status()
+    return response.json()
+
+
+class FakeSession:
+    def get(self, url, params = None):
+        return requests.get(url, params = params)
+
+
+class FakeContentManager:
+    def __init__(self, gis):
+        self.gis = gis
+
+    def get(self, item_id):
+        return FakeItem(self.gis, _get(f"{self.gis.base_url}/items/{item_id}"))
+
+
+class FakeGIS:
+    """
+    Stands in for arcgis.gis.GIS: content.get(item_id) and session.get(url, params).
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.content = FakeContentManager(self)
+        self.session = FakeSession()
+
+
+class FakeItem:
+    """
+    Stands in for arcgis.gis.Item of a hosted feature service.
+    """
+
+    def __init__(self, gis, properties):
+        self.gis = gis
+        self.id = properties["id"]
+        self.title = properties["title"]
+        self.type = properties["type"]
+        self.url = properties["url"]
+        self.tags = properties["tags"]
+        self.snippet = properties["snippet"]
+        self.description = properties["description"]
+        self.licenseInfo = properties["licenseInfo"]
+        self.accessInformation = properties["accessInformation"]
+        self.layers = [FakeFeatureLayer(f"{self.url}/{index}", gis) for index in range(properties["layer_count"])]
+
+    def get_data(self):
+        return _get(f"{self.gis.base_url}/items/{self.id}/data")
+
+    def update(self, item_properties = None, data = None, thumbnail = None, metadata = None):
+        """
+        Uploads item properties and the metadata and thumbnail files in one request.
+        """
+        update = {"item_properties": item_properties}
+        for part, path in (("metadata", metadata), ("thumbnail", thumbnail)):
+            if path is not None:
+                with open(path, "rb") as file:
+                    update[part] = base64.b64encode(file.read()).decode("ascii")
+        return _post(f"{self.gis.base_url}/items/{self.id}/update", json.dumps(update)).get("success", False)
+
+
+class FakeLayerManager:
+    def __init__(self, url):
+        self.url = url
+
+    def update_definition(self, properties):
+        return _post(f"{self.url}/updateDefinition", json.dumps(properties))
+
+    def overwrite(self, data_file):
+        with open(data_file, "rb") as file:
+            return _post(f"{self.url}/overwrite", file.read())
+
+
+# Feature query results, shaped like arcgis.features.FeatureSet and Feature
+FakeFeature = namedtuple("FakeFeature", ["attributes", "geometry"])
+FakeFeatureSet = namedtuple("FakeFeatureSet", ["features"])
+
+
+class FakeFeatureLayer:
+    """
+    Stands in for arcgis.features.FeatureLayer: properties, query, edit_features and
+    manager.update_definition.
+    """
+
+    def __init__(self, url, gis = None):
+        self.url = url
+        self.gis = gis
+        self.manager = FakeLayerManager(url)
+
+    @property
+    def properties(self):
+        return _get(self.url)
+
+    def query(self, where = "1=1", out_fields = "*", return_geometry = True):
+        query = {"where": where, "outFields": out_fields, "returnGeometry": return_geometry}
+        response = _post(f"{self.url}/query", json.dumps(query))
+        return FakeFeatureSet([FakeFeature(feature["attributes"], feature["geometry"]) for feature in response["features"]])
+
+    def edit_features(self, adds = None, updates = None, deletes = None):
+        return _post(f"{self.url}/applyEdits", json.dumps({"adds": adds, "updates": updates, "deletes": deletes}))
+
+
+class FakeFeatureLayerCollection:
+    """
+    Stands in for arcgis.features.FeatureLayerCollection: manager.overwrite and manager.update_definition.
+    """
+
+    def __init__(self, url, gis = None):
+        self.url = url
+        self.gis = gis
+        self.manager = FakeLayerManager(url)
+
+    @classmethod
+    def fromitem(cls, item):
+        return cls(item.url, item.gis)
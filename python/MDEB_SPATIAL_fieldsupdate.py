@@ -6,115 +6,216 @@
 ###############################################################################
 
 # IMPORT LIBRARIES
-from dotenv import load_dotenv
-import os
+import argparse
 import json
-import pandas as pd
-import oracledb
-from sqlalchemy.engine import create_engine 
 from arcgis.gis import GIS
-
-# AUTHENTICATE ARCGIS CREDENTIALS
-# using ArcGIS Pro to authenticate, change authentication scheme if necessary
-gis = GIS("PRO")
-
-# CONNECT TO ORACLE
-# Enable thick mode, using oracle instant client and tnsnames.ora
-oracledb.init_oracle_client()
-
-# Access .env variables
-load_dotenv(dotenv_path = os.path.expandvars(r"%USERPROFILE%\.config\secrets\.env"))
-tns_name = os.getenv("TNS_NAME") 
-username = os.getenv("ORACLE_USERNAME")
-password = os.getenv("ORACLE_PASSWORD") 
-schema = os.getenv("SCHEMA")
-lyr_table = os.getenv("LYR_TABLE")
-fld_table = os.getenv("FLD_TABLE")
-
-# Connect to oracle database using SQL alchemy engine and TNS names alias
-connection_string = f"oracle+oracledb://{username}:{password}@{tns_name}"
-engine = create_engine(connection_string)
-connection = engine.connect()
-
-# EXTRACT DATA
-# query field table for field names, field aliases, and field descriptions
-fields_sql_query = f"SELECT * FROM {schema}.{fld_table}"
-df_fields = pd.read_sql(fields_sql_query, con = connection)
-
-# query layer table to get layer info (layer name, url, and layer id)
-layers_sql_query = f"SELECT * FROM {schema}.{lyr_table}"
-df_layers = pd.read_sql(layers_sql_query, con = connection)
-
-# close database connection
-connection.close()
-
-# UPDATE FIELDS
-# loop through each layer in layers dataframe
-for index, layer_row in df_layers.iterrows():
-    try:
-        # get layer information
-        item_id = layer_row['file_id']
-        layer_name = layer_row['table_name']
-        rest_url = layer_row['rest_url']
-        # layer_index = int(rest_url.strip('/').split('/')[-1])
-        layer_index = int(rest_url[len(rest_url) - 1])
-
-        print(f"Processing Layer: '{layer_name}' (Item ID: {item_id})")
-
-        # Get the FeatureLayer object from its item ID and layer index
-        feature_layer_item = gis.content.get(item_id)
-        target_layer = feature_layer_item.layers[layer_index]
-
-        # Get the layer's current definition (as JSON dictionary)
-        current_definition = target_layer.properties
-
-        # Filter the df_fields dataframe for the current layer, create df of field names, aliases, and descriptions
-        relevant_fields_df = df_fields[df_fields['table_name'] == layer_name]
-
-        # Build the JSON dictionary with the correctly formatted description string
-        # description string needs to be formated a certain way to enable AGOL pop-ups are configured correctly
-        field_updates = {}
-        for _, row in relevant_fields_df.iterrows():
-            simple_desc = row['col_description']
-
-            # Handle potential null/empty descriptions
-            if pd.isna(simple_desc):
-                simple_desc = ""
-            
-            #create a dictionary with the required structure
-            structured_desc_dict = {
-              "value": simple_desc,
-              "fieldValueType": ""
-            }
-            
-            # Convert the dictionary to a JSON formatted string using json.dumps()
-            # This automatically handles special characters and formatting.
-            final_description_string = json.dumps(structured_desc_dict)
-
-            # Add the complete field info to the JSON dictionary
-            field_updates[row['col_name']] = {
-              'alias': row['col_alias'],
-              'description': final_description_string # Use the newly formatted string
-            }
-        # Loop through and update the field definitions (current_definition) using the field_updates dataframe
-        for field in current_definition['fields']:
-            if field['name'] in field_updates:
-                field['alias'] = field_updates[field['name']]['alias']
-                field['description'] = field_updates[field['name']]['description']
-
-        # create the final updated JSON dictionary (only change the fields info)
-        update_dictionary = {'fields': current_definition['fields']}
-
-        # apply the update to the target AGOL layer
-        result = target_layer.manager.update_definition(update_dictionary)
-
-        # check results 
-        if result.get('success', False):
-            print(f"Successfully updated definition for '{layer_name}'.\n")
-        else:
-            print(f"Failed to update '{layer_name}': {result}\n")
-
-    except Exception as e:
-        print(f"An error occurred while processing '{layer_row.get('layer_name', 'N/A')}': {e}\n")
-
-print("Script finished. Completed update of all fields.")
+from MDEB_SPATIAL_catalog import Catalog, load_environment, create_oracle_engine
+from MDEB_SPATIAL_agol import ItemCache
+from MDEB_SPATIAL_instrument import metrics, timed, add_instrument_arguments, start_instrumentation, finish_instrumentation
+
+# Description of a field without one in the field table
+EMPTY_DESCRIPTION = json.dumps({"value": "", "fieldValueType": ""})
+
+
+def index_field_catalog(df_fields):
+    """
+    Groups the field table once by table name.
+    Returns a dictionary of table_name -> {field name -> {'alias', 'description'}}.
+    A NULL alias becomes None (the layer's alias is kept).
+    """
+    # Build the description strings for the whole table at once
+    # description string needs to be formated a certain way to enable AGOL pop-ups are configured correctly
+    # (json.dumps handles special characters and formatting, null/empty descriptions become "")
+    descriptions = df_fields['col_description'].astype(object).where(df_fields['col_description'].notna(), "")
+    description_strings = [json.dumps({"value": desc, "fieldValueType": ""}) for desc in descriptions]
+    # NULL aliases arrive as NaN, which never equals the live alias
+    aliases = df_fields['col_alias'].astype(object).where(df_fields['col_alias'].notna(), None)
+
+    field_catalog = {}
+    for table_name, col_name, alias, description in zip(
+        df_fields['table_name'], df_fields['col_name'], aliases, description_strings
+    ):
+        field_catalog.setdefault(table_name, {})[col_name] = {'alias': alias, 'description': description}
+    return field_catalog
+
+
+def diff_fields(current_fields, field_updates):
+    """
+    Compares the layer's live field definitions with the field table.
+    Returns a list of (updated field definition, old alias, old description) for
+    the fields whose alias or description differ. Unchanged fields are left out.
+    A field without alias in the field table keeps its alias, and a layer field
+    without description matches an empty description.
+    The current definition is not modified (it may be cached).
+    """
+    changed_fields = []
+    for field in current_fields:
+        update = field_updates.get(field['name'])
+        if update is None:
+            continue
+        alias = field.get('alias') if update['alias'] is None else update['alias']
+        description = field.get('description') or EMPTY_DESCRIPTION
+        if field.get('alias') != alias or description != update['description']:
+            updated_field = dict(field)
+            updated_field['alias'] = alias
+            updated_field['description'] = update['description']
+            changed_fields.append((updated_field, field.get('alias'), field.get('description')))
+    return changed_fields
+
+
+def print_field_diff(layer_name, changed_fields):
+    """
+    Prints the pending alias and description changes for a layer.
+    """
+    print(f"  '{layer_name}': {len(changed_fields)} field(s) to update")
+    for updated_field, old_alias, old_description in changed_fields:
+        if updated_field['alias'] != old_alias:
+            print(f"    {updated_field['name']}: alias '{old_alias}' -> '{updated_field['alias']}'")
+        if updated_field['description'] != old_description:
+            print(f"    {updated_field['name']}: description {old_description} -> {updated_field['description']}")
+
+
+def plan_fields(item_cache, catalog):
+    """
+    Computes the field alias and description diffs of every layer in the layer table,
+    without writing anything. Layers are grouped by service, so each service's
+    layer definitions are read together.
+    Returns a list of (item_id, layer_name, layer_index, changed_fields) for every layer with pending changes.
+    """
+    df_layers = catalog.df_layers
+
+    # Group the field table once by table name
+    field_catalog = index_field_catalog(catalog.df_fields)
+
+    # loop through each service (item) in layers dataframe
+    field_diffs = []
+    for item_id, service_layers in df_layers.groupby('file_id', sort = False):
+        print(f"Processing Item ID: {item_id}")
+        try:
+            item_cache.get_item(item_id)
+        except Exception as e:
+            print(f"An error occurred while retrieving item '{item_id}': {e}\n")
+            continue
+
+        # COMPUTE FIELD DIFFS FOR EVERY LAYER OF THE SERVICE
+        for layer_name, rest_url in zip(service_layers['table_name'], service_layers['rest_url']):
+            try:
+                # get layer information
+                # layer_index = int(rest_url.strip('/').split('/')[-1])
+                layer_index = int(rest_url[len(rest_url) - 1])
+
+                # Get the layer's current definition (as JSON dictionary)
+                current_definition = item_cache.get_layer_properties(item_id, layer_index)
+
+                # Compare with the field table entries of the current layer
+                changed_fields = diff_fields(current_definition['fields'], field_catalog.get(layer_name, {}))
+                metrics.count("fields.layers_checked")
+                if not changed_fields:
+                    print(f"  Fields of '{layer_name}' already match oracle. Skipping.")
+                    continue
+                print_field_diff(layer_name, changed_fields)
+                field_diffs.append((item_id, layer_name, layer_index, changed_fields))
+
+            except Exception as e:
+                print(f"An error occurred while processing '{layer_name}': {e}\n")
+
+    return field_diffs
+
+
+def apply_field_updates(item_cache, layer_updates):
+    """
+    Writes field definitions to their layers. layer_updates is a list of
+    (item_id, layer_name, layer_index, updated_fields), updated_fields holding only
+    the fields to change. Every changed service is dropped from the cache once.
+    Returns the number of layers updated successfully.
+    """
+    updated_layers = 0
+    changed_items = []
+    # layer fields can only be changed through each layer's updateDefinition endpoint,
+    # so this is one call per changed layer (unchanged layers cost no write)
+    for item_id, layer_name, layer_index, updated_fields in layer_updates:
+        try:
+            # create the final updated JSON dictionary (only the changed fields)
+            update_dictionary = {'fields': updated_fields}
+
+            # apply the update to the target AGOL layer
+            target_layer = item_cache.get_item(item_id).layers[layer_index]
+            metrics.count("agol.http_calls")
+            with metrics.timer("agol.layer_update"):
+                result = target_layer.manager.update_definition(update_dictionary)
+
+            # check results
+            if result.get('success', False):
+                print(f"Successfully updated definition for '{layer_name}'.\n")
+                updated_layers += 1
+                metrics.count("fields.fields_updated", len(updated_fields))
+            else:
+                print(f"Failed to update '{layer_name}': {result}\n")
+
+        except Exception as e:
+            print(f"An error occurred while updating '{layer_name}': {e}\n")
+
+        if item_id not in changed_items:
+            changed_items.append(item_id)
+
+    # the layer definitions of these services changed, drop them from the cache
+    for item_id in changed_items:
+        item_cache.invalidate(item_id)
+    return updated_layers
+
+
+@timed("stage.fields")
+def update_fields(gis, catalog, item_cache = None, dry_run = False):
+    """
+    Updates the field aliases and descriptions of every layer in the layer table
+    using the field table. item_cache can be shared with the other stages.
+    The diffs for every layer are computed first (plan_fields), then only the
+    fields that differ from oracle are written.
+    With dry_run the pending diff is reported and nothing is written.
+    Returns a list of (item_id, layer_name, layer_index, changed_fields) for every layer with pending changes.
+    """
+    item_cache = item_cache or ItemCache(gis)
+
+    # UPDATE FIELDS
+    field_diffs = plan_fields(item_cache, catalog)
+
+    # APPLY THE UPDATES
+    if not dry_run:
+        apply_field_updates(item_cache, [
+            (item_id, layer_name, layer_index, [updated_field for updated_field, _, _ in changed_fields])
+            for item_id, layer_name, layer_index, changed_fields in field_diffs
+        ])
+
+    changed_count = sum(len(changed_fields) for _, _, _, changed_fields in field_diffs)
+    action = "pending (dry run, nothing written)" if dry_run else "updated"
+    print(f"{changed_count} field(s) in {len(field_diffs)} layer(s) {action}.")
+    return field_diffs
+
+
+# RUN THE SCRIPT
+if __name__ == "__main__":
+    # COMMAND LINE OPTIONS
+    # --dry-run reports the pending alias/description changes without writing them
+    parser = argparse.ArgumentParser(description = "Update AGOL field aliases and descriptions from the oracle field table.")
+    parser.add_argument("--dry-run", action = "store_true", help = "report the pending field changes without writing them")
+    add_instrument_arguments(parser)
+    args = parser.parse_args()
+    start_instrumentation(args)
+
+    # AUTHENTICATE ARCGIS CREDENTIALS
+    # using ArcGIS Pro to authenticate, change authentication scheme if necessary
+    gis = GIS("PRO")
+
+    # CONNECT TO ORACLE AND EXTRACT DATA
+    # query field table (field names, field aliases, and field descriptions) and layer table (layer name, url, and layer id)
+    load_environment()
+    engine = create_oracle_engine()
+    catalog = Catalog.load(engine)
+    engine.dispose()
+
+    item_cache = ItemCache(gis)
+    update_fields(gis, catalog, item_cache, dry_run = args.dry_run)
+
+    print(item_cache.summary())
+    finish_instrumentation(args)
+    print("Script finished. Completed update of all fields.")
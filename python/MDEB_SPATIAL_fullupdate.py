@@ -0,0 +1,92 @@
+###############################################################################
+## This script runs the full MDEB_SPATIAL refresh: data, fields, metadata    ##
+## and popups. It opens one pooled oracle connection and loads the layer,    ##
+## field and feature tables once, then runs every stage against them.        ##
+##                                                                           ##
+## Usage: python python/MDEB_SPATIAL_fullupdate.py [--force] [--offline]     ##
+##        [--delta] [--fetch-engine pandas|arrow]                            ##
+##        [--stages data fields metadata popup]                              ##
+##        [--report report.json] [--profile]                                 ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import argparse
+import os
+from arcgis.gis import GIS
+from MDEB_SPATIAL_catalog import Catalog, load_environment, create_oracle_engine
+from MDEB_SPATIAL_agol import ItemCache
+from MDEB_SPATIAL_extract import DEFAULT_EXTRACT_WORKERS, FETCH_ENGINES
+from MDEB_SPATIAL_dataupdate import update_data
+from MDEB_SPATIAL_fieldsupdate import update_fields
+from MDEB_SPATIAL_metadataupdate import update_metadata
+from MDEB_SPATIAL_popupupdate import update_popups
+from MDEB_SPATIAL_snapshot import DEFAULT_SNAPSHOT_FOLDER, save_catalog, load_catalog
+from MDEB_SPATIAL_instrument import add_instrument_arguments, start_instrumentation, finish_instrumentation
+
+# Stages in the order they run (fields, metadata and popups are applied to the overwritten services)
+STAGES = ["data", "fields", "metadata", "popup"]
+
+# COMMAND LINE OPTIONS
+parser = argparse.ArgumentParser(description = "Run the full MDEB_SPATIAL refresh against one oracle catalog.")
+parser.add_argument("--force", action = "store_true", help = "overwrite every service and upload all metadata, even if unchanged")
+parser.add_argument("--offline", action = "store_true", help = "use the local catalog and table snapshots without connecting to oracle")
+parser.add_argument("--delta", action = "store_true", help = "send only the changed rows instead of overwriting services")
+parser.add_argument("--fetch-engine", choices = list(FETCH_ENGINES), help = "how tables are read from oracle (default: FETCH_ENGINE or pandas)")
+parser.add_argument("--stages", nargs = "+", choices = STAGES, default = STAGES, help = "stages to run (default: all)")
+add_instrument_arguments(parser)
+args = parser.parse_args()
+start_instrumentation(args)
+
+# AUTHENTICATE ARCGIS CREDENTIALS
+# Using ArcGIS Pro to authenticate, change authentication scheme if necessary
+gis = GIS("PRO")
+
+# CONNECT TO ORACLE
+# One pool shared by every stage, with one connection per extraction worker
+# (offline, the catalog and tables are read from the local snapshots instead)
+load_environment()
+snapshot_folder = os.getenv("SNAPSHOT_FOLDER", DEFAULT_SNAPSHOT_FOLDER)
+if args.offline:
+    engine = None
+    catalog = load_catalog(snapshot_folder)
+else:
+    engine = create_oracle_engine(pool_size = int(os.getenv("EXTRACT_WORKERS", DEFAULT_EXTRACT_WORKERS)))
+
+    # DATA EXTRACTION FROM THE DATABASE
+    # Load the layer, field and feature tables once for all stages (and keep a copy for offline runs)
+    catalog = Catalog.load(engine)
+    save_catalog(catalog, snapshot_folder)
+# A catalog table that is not configured (e.g. no FTR_TABLE) is left as None
+table_counts = [
+    f"{len(df)} {name}" if df is not None else f"no {name} table"
+    for name, df in (("layers", catalog.df_layers), ("fields", catalog.df_fields), ("feature services", catalog.df_features))
+]
+print(f"Loaded catalog: {', '.join(table_counts)}.")
+
+# RUN THE STAGES
+# Every stage shares one AGOL item cache, writes invalidate the cached item
+item_cache = ItemCache(gis)
+
+if "data" in args.stages:
+    print("\n=== Updating feature service data ===")
+    update_data(gis, engine, catalog, force = args.force, item_cache = item_cache, delta = args.delta, fetch_engine = args.fetch_engine)
+
+if "fields" in args.stages:
+    print("\n=== Updating field aliases and descriptions ===")
+    update_fields(gis, catalog, item_cache)
+
+if "metadata" in args.stages and catalog.df_features is None:
+    print("\n=== Skipping metadata: FTR_TABLE is not configured ===")
+elif "metadata" in args.stages:
+    print("\n=== Updating feature service and layer metadata ===")
+    update_metadata(gis, catalog, item_cache, force = args.force)
+
+if "popup" in args.stages:
+    print("\n=== Updating popups ===")
+    update_popups(gis, catalog, item_cache)
+
+if engine is not None:
+    engine.dispose()
+print(f"\n{item_cache.summary()}")
+finish_instrumentation(args)
+print("\nFull update finished.")
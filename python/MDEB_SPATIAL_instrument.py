@@ -0,0 +1,200 @@
+###############################################################################
+## Lightweight instrumentation shared by the MDEB_SPATIAL scripts. Stages    ##
+## record timers (time spent in oracle, geometry decoding, writing, zipping  ##
+## and AGOL calls) and counters (rows, bytes, HTTP calls, retries) in one    ##
+## process wide Metrics object, which is written as a JSON report at the     ##
+## end of a run. Profiling (cProfile hot spots and tracemalloc peak memory   ##
+## per table) can be switched on with --profile.                             ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import cProfile
+import functools
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Number of functions listed per profiled section
+DEFAULT_PROFILE_TOP = 15
+
+
+class Metrics:
+    """
+    Thread safe timers and counters for one run.
+    Timers add up the seconds and number of calls of a named section,
+    counters add up any value (rows, bytes, calls).
+    """
+
+    def __init__(self):
+        self.profiling = False
+        self.profile_top = DEFAULT_PROFILE_TOP
+        self._lock = threading.Lock()
+        # only one section is profiled at a time (cProfile and tracemalloc are process wide)
+        self._profile_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clears every timer, counter and profile and restarts the run clock.
+        """
+        with self._lock:
+            self.started_at = datetime.now(timezone.utc)
+            self._start = time.perf_counter()
+            self.timers = {}
+            self.counters = {}
+            self.profiles = {}
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Times the block and adds it to the named timer.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                timer = self.timers.setdefault(name, {"seconds": 0.0, "calls": 0})
+                timer["seconds"] += seconds
+                timer["calls"] += 1
+
+    def count(self, name, value = 1):
+        """
+        Adds value to the named counter.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def enable_profiling(self, top = DEFAULT_PROFILE_TOP):
+        """
+        Turns on profile(): every profiled section records its hot spots and peak memory.
+        Profiled sections run one at a time, so parallel work is serialized while profiling.
+        """
+        self.profiling = True
+        self.profile_top = top
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def profile(self, section):
+        """
+        Profiles the block (CPU hot spots with cProfile, peak memory with tracemalloc)
+        if profiling is enabled, otherwise does nothing.
+        """
+        if not self.profiling:
+            yield
+            return
+        with self._profile_lock:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                seconds = time.perf_counter() - start
+                peak_memory = tracemalloc.get_traced_memory()[1] - start_memory
+                with self._lock:
+                    self.profiles[section] = {
+                        "seconds": seconds,
+                        "peak_memory_bytes": peak_memory,
+                        "hot_spots": hot_spots(profiler, self.profile_top),
+                    }
+
+    def report(self):
+        """
+        Returns the run report as a JSON serializable dictionary.
+        """
+        with self._lock:
+            return {
+                "started_at": self.started_at.isoformat(),
+                "seconds": time.perf_counter() - self._start,
+                "timers": {name: dict(timer) for name, timer in sorted(self.timers.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "profiles": dict(self.profiles),
+            }
+
+    def write_report(self, path):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent = 2)
+
+    def summary(self):
+        """
+        Returns the timers and counters as printable lines.
+        """
+        report = self.report()
+        lines = [f"Run time: {report['seconds']:.1f} s"]
+        lines += [f"  {name:<28} {timer['seconds']:9.2f} s  {timer['calls']:7} call(s)" for name, timer in report["timers"].items()]
+        lines += [f"  {name:<28} {value:>12,}" for name, value in report["counters"].items()]
+        for section, profile in report["profiles"].items():
+            lines.append(f"  profile {section}: {profile['seconds']:.2f} s, peak memory {profile['peak_memory_bytes'] / 1e6:.1f} MB")
+        return lines
+
+
+def hot_spots(profiler, top = DEFAULT_PROFILE_TOP):
+    """
+    Returns the top functions of a cProfile run by time spent in the function itself.
+    """
+    stats = pstats.Stats(profiler).stats
+    functions = sorted(stats.items(), key = lambda entry: entry[1][2], reverse = True)[:top]
+    return [
+        {
+            "function": f"{file}:{line}({name})",
+            "calls": calls,
+            "total_seconds": total_time,
+            "cumulative_seconds": cumulative_time,
+        }
+        for (file, line, name), (_, calls, total_time, cumulative_time, _) in functions
+    ]
+
+
+# Metrics of the current run, shared by every stage
+metrics = Metrics()
+
+
+def timed(name):
+    """
+    Decorator recording every call of a function in the named timer.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with metrics.timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_instrument_arguments(parser):
+    """
+    Adds the --report and --profile options to a script's argument parser.
+    """
+    parser.add_argument("--report", metavar = "REPORT_JSON", help = "write the run's timers and counters to this file")
+    parser.add_argument("--profile", action = "store_true", help = "record CPU hot spots and peak memory per table")
+
+
+def start_instrumentation(args):
+    """
+    Turns on profiling if --profile was given.
+    """
+    if args.profile:
+        metrics.enable_profiling()
+
+
+def finish_instrumentation(args):
+    """
+    Prints the run's metrics and writes the JSON report if --report was given.
+    """
+    print("\nRun metrics:")
+    for line in metrics.summary():
+        print(line)
+    if args.report:
+        metrics.write_report(args.report)
+        print(f"Metrics report written to {args.report}")
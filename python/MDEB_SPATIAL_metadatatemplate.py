@@ -0,0 +1,129 @@
+###############################################################################
+## Compiled version of ARCGIS_METADATA_TEMPLATE.xml used by                  ##
+## MDEB_SPATIAL_metadataupdate.py. The template is parsed once and the       ##
+## position of every element filled from oracle is worked out up front, so   ##
+## each survey's XML is a cheap copy plus direct assignments. Which oracle   ##
+## column fills which element is set in METADATA_FIELD_MAP.json.             ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import base64
+import copy
+import json
+import os
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+# Metadata template (already has correct parent and child elements to fulfill metadata requirements)
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ARCGIS_METADATA_TEMPLATE.xml")
+
+# Feature table column -> template element mapping
+# Each entry has an element name, the element's XPath in the template and either
+#   "column" plus "format" (one of FORMATTERS), or
+#   "template", a format string filled with the row's columns (empty columns become "")
+# "list" entries also give "item_tag", the tag of the child element created for each item
+FIELD_MAP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "METADATA_FIELD_MAP.json")
+
+# How a column value is turned into element text
+FORMATTERS = {
+    "text": lambda value: value,
+    "str": str,
+    # (databases without a date type return dates as ISO strings)
+    "date": lambda value: (datetime.fromisoformat(value) if isinstance(value, str) else value).strftime('%Y-%m-%d %H:%M:%S'),
+    "list": lambda value: value.split(', '),
+    "base64": lambda value: base64.b64encode(value).decode("utf-8"),
+}
+
+
+class _BlankMissing(dict):
+    """
+    Row values for "template" entries, None and missing columns are formatted as "".
+    """
+
+    def __missing__(self, key):
+        return ""
+
+
+def load_field_map(path = FIELD_MAP_PATH):
+    """
+    Reads and checks the column -> element mapping.
+    """
+    with open(path) as file:
+        field_map = json.load(file)
+    for entry in field_map:
+        if "element" not in entry or "xpath" not in entry:
+            raise ValueError(f"Metadata field map entry {entry} needs an 'element' and an 'xpath'")
+        if "template" in entry:
+            continue
+        if "column" not in entry:
+            raise ValueError(f"Metadata field map entry '{entry['element']}' needs a 'column' or a 'template'")
+        if entry.get("format", "text") not in FORMATTERS:
+            raise ValueError(f"Metadata field map entry '{entry['element']}' has unknown format '{entry['format']}'")
+        if entry.get("format") == "list" and "item_tag" not in entry:
+            raise ValueError(f"Metadata field map entry '{entry['element']}' is a list and needs an 'item_tag'")
+    return field_map
+
+
+class MetadataTemplate:
+    """
+    Parses the metadata template once and renders one XML document per survey.
+    Element handles are stored as child index paths from the root, which stay valid
+    in every deep copy of the template.
+    """
+
+    def __init__(self, path = TEMPLATE_PATH, field_map = None):
+        self.field_map = field_map if field_map is not None else load_field_map()
+        self.root = ET.parse(path).getroot()
+        parents = {child: parent for parent in self.root.iter() for child in parent}
+        self.paths = {}
+        self.item_tags = {}
+        for entry in self.field_map:
+            name = entry["element"]
+            element = self.root.find(entry["xpath"])
+            if element is None:
+                raise ValueError(f"Metadata template element '{entry['xpath']}' ({name}) was not found in {path}")
+            # Walk up to the root, recording the position of each element within its parent
+            index_path = []
+            while element is not self.root:
+                parent = parents[element]
+                index_path.append(list(parent).index(element))
+                element = parent
+            self.paths[name] = tuple(reversed(index_path))
+            if "item_tag" in entry:
+                self.item_tags[name] = entry["item_tag"]
+
+    def values_from_row(self, row):
+        """
+        Applies every mapping to one feature table row (a dictionary or a namedtuple
+        from itertuples). Returns element name -> text, or a list for list elements.
+        """
+        if not isinstance(row, dict):
+            row = row._asdict()
+        values = {}
+        for entry in self.field_map:
+            if "template" in entry:
+                columns = _BlankMissing({column: value for column, value in row.items() if value is not None})
+                values[entry["element"]] = entry["template"].format_map(columns)
+            else:
+                values[entry["element"]] = FORMATTERS[entry.get("format", "text")](row[entry["column"]])
+        return values
+
+    def render(self, values):
+        """
+        Fills a copy of the template with values (element name -> text, or a list for
+        list elements) and returns the XML document as UTF-8 bytes.
+        """
+        root = copy.deepcopy(self.root)
+        for name, value in values.items():
+            element = root
+            for index in self.paths[name]:
+                element = element[index]
+            if name in self.item_tags:
+                # replace old items with the new list
+                for child in list(element):
+                    element.remove(child)
+                for item in value:
+                    ET.SubElement(element, self.item_tags[name]).text = item
+            else:
+                element.text = value
+        return ET.tostring(root, encoding = "utf-8", xml_declaration = True)
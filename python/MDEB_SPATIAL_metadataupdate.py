@@ -5,228 +5,297 @@
 ###############################################################################
 
 # IMPORT LIBRARIES
-from dotenv import load_dotenv
+import argparse
 import os
-import base64
 import tempfile
-import pandas as pd
-import xml.etree.ElementTree as ET
-import oracledb
-from sqlalchemy.engine import create_engine 
 from arcgis.gis import GIS
 from arcgis.features import FeatureLayerCollection, FeatureLayer
+from MDEB_SPATIAL_catalog import Catalog, load_environment, create_oracle_engine
+from MDEB_SPATIAL_agol import ItemCache, HostRateLimiter, update_layers, DEFAULT_LAYER_WORKERS, DEFAULT_RATE_LIMIT
+from MDEB_SPATIAL_metadatatemplate import MetadataTemplate
+from MDEB_SPATIAL_state import DEFAULT_STATE_DB, StateStore, content_fingerprint
+from MDEB_SPATIAL_instrument import metrics, timed, add_instrument_arguments, start_instrumentation, finish_instrumentation
 
-# AUTHENTICATE ARCGIS CREDENTIALS
-# using ArcGIS Pro to authenticate, change authentication scheme if necessary
-gis = GIS("PRO")
-
-# CONNECT TO ORACLE
-# Enable thick mode, using oracle instant client and tnsnames.ora
-oracledb.init_oracle_client()
-
-# Access .env variables
-load_dotenv(dotenv_path = os.path.expandvars(r"%USERPROFILE%\.config\secrets\.env"))
-tns_name = os.getenv("TNS_NAME") 
-username = os.getenv("ORACLE_USERNAME")
-password = os.getenv("ORACLE_PASSWORD") 
-schema = os.getenv("SCHEMA")
-ftr_table = os.getenv("FTR_TABLE")
-lyr_table = os.getenv("LYR_TABLE")
-
-# Connect to oracle database using SQL alchemy engine and TNS names alias
-connection_string = f"oracle+oracledb://{username}:{password}@{tns_name}"
-engine = create_engine(connection_string)
-connection = engine.connect()
-
-# DATA EXTRACT FROM DATABASE
-# query feature table to get info about feature services
-sql_query_features = f"SELECT * FROM {schema}.{ftr_table}"
-df_features = pd.read_sql(sql_query_features, con = connection)
-
-# query layers table to get layer info
-sql_query_layers = f"SELECT * from {schema}.{lyr_table}"
-df_layers = pd.read_sql(sql_query_layers, con = connection)
-
-# close database connection
-connection.close()
-
-# UPDATE FEATURE LEVEL METADATA
-# make a temporary xml file from template (ARCGIS_METADATA_TEMPLATE.xml) by pulling data from oracle metadata table
-# for each survey, then push to arcgis online to update survey metadata
-
-# extract shortened survey names
-survey_names = [survey for survey in df_features.strata_short]
-
-# build xml file and push to AGOL
-with tempfile.NamedTemporaryFile(mode = "w+", delete = False, suffix = ".xml") as temp_file:
-  
-  for survey_short in survey_names:
-  
-    # use metadata template (already has correct parent and child elements to fulfill metadata requirements)
-    metadata_xml = "python/ARCGIS_METADATA_TEMPLATE.xml"
-    
-    # import xml and get xml roots
-    tree = ET.parse(metadata_xml)
-    root = tree.getroot()
-
-    # filter df_features for survey
-    result = df_features.query("strata_short == @survey_short")
-  
-    # extract metadata values
-    if not result.empty:
-      title = result.survey_name.iloc[0]
-      abstract = result.abstract.iloc[0]
-      purpose = result.purpose.iloc[0]
-      tags = result.tags.iloc[0].split(', ')
-      credits = result.useterms.iloc[0]
-      pub_date = result.publish_date.iloc[0]
-      poc_name = result.contact_name.iloc[0]
-      poc_title = result.contact_title.iloc[0]
-      poc_email = result.contact_email.iloc[0]
-      meta_name = result.meta_contact_name.iloc[0]
-      meta_title = result.meta_contact_title.iloc[0]
-      meta_email = result.meta_contact_email.iloc[0]
-      source = result.source.iloc[0]
-      useterms = result.useterms.iloc[0]
-      link = result.link.iloc[0]
-      extent_n = result.geoextent_n.iloc[0]
-      extent_s = result.geoextent_s.iloc[0]
-      extent_e = result.geoextent_e.iloc[0]
-      extent_w = result.geoextent_w.iloc[0]
-      rest_url = result.rest_url.iloc[0]
-      file_ID = result.file_id.iloc[0]
-      thumbnail = result.thumbnail.iloc[0]
-      # convert thumbnail to base 64 encoded
-      encoded_thumbnail = base64.b64encode(thumbnail).decode("utf-8")
-    else:
-      raise ValueError("No metadata found in SQL Table")
-    
-    print(f"Finished extracting metadata for {survey_short} from oracle db.")  
-  
-    # edit xml template file using metadata from oracle
-    # update thumbnail
-    thumbnail_element = root.find(".//Binary/Thumbnail/Data")
-    thumbnail_element.text = encoded_thumbnail
-    # update abstract
-    abs_element = root.find(".//dataIdInfo/idAbs")
-    abs_element.text = f'<p>{link if link else ""}<br>{abstract}</p>'
-    # update title
-    title_element = root.find(".//dataIdInfo/idCitation/resTitle")
-    title_element.text = title
-    # update publish date
-    date_element = root.find(".//dataIdInfo/idCitation/date/pubDate")
-    # change datetime to string
-    datetime_string = pub_date.strftime('%Y-%m-%d %H:%M:%S')
-    date_element.text = datetime_string
-    # update geographic extent
-    geowest_element = root.find(".//dataIdInfo/dataExt/geoEle/GeoBndBox/westBL")
-    geowest_element.text = str(extent_w)
-    geoeast_element = root.find(".//dataIdInfo/dataExt/geoEle/GeoBndBox/eastBL")
-    geoeast_element.text = str(extent_e)
-    geonorth_element = root.find(".//dataIdInfo/dataExt/geoEle/GeoBndBox/northBL")
-    geonorth_element.text = str(extent_n)
-    geosouth_element = root.find(".//dataIdInfo/dataExt/geoEle/GeoBndBox/southBL")
-    geosouth_element.text = str(extent_s)
-    # update tags by itearting through list of tags
-    tags_element = root.find(".//dataIdInfo/searchKeys")
-    # delete old tags
-    for tag in list(tags_element):
-      tags_element.remove(tag)
-    # iterate through tags list
-    for tag in tags:
-      tag_element = ET.SubElement(tags_element, "keyword")
-      tag_element.text = tag 
-    # update purpose statement
-    purp_element = root.find(".//dataIdInfo/idPurp")
-    purp_element.text = purpose
-    # update credits
-    credit_element = root.find(".//dataIdInfo/idCredit")
-    credit_element.text = source
-    # update use terms
-    constraint_element = root.find(".//dataIdInfo/resConst/Consts/useLimit")
-    constraint_element.text = useterms
-    # update POC contact info
-    poc_email_element = root.find(".//dataIdInfo/idPoC/rpCntInfo/cntAddress/eMailAdd")
-    poc_email_element.text = poc_email
-    poc_contact_element = root.find(".//dataIdInfo/idPoC/rpIndName")
-    poc_contact_element.text = poc_name
-    poc_title_element = root.find(".//dataIdInfo/idPoC/rpPosName")
-    poc_title_element.text = poc_title 
-    # update metadata contact info
-    meta_email_element = root.find(".//mdContact/rpCntInfo/cntAddress/eMailAdd")
-    meta_email_element.text = meta_email
-    meta_contact_element = root.find(".//mdContact/rpIndName")
-    meta_contact_element.text = meta_name
-    meta_title_element = root.find(".//mdContact/rpPosName")
-    meta_title_element.text = meta_title 
-  
-    # write xml to temp file
-    ET.ElementTree(root).write(temp_file.name)
-    print('Metadata converted to temp XML file.')
-    
-    # get name of temp file
-    xml_metadata = temp_file.name
-
-    # get arcgis online item using file id
-    item = gis.content.get(file_ID)
-    # update metadata for feature service item 
-    item.update(metadata = xml_metadata)
-    
-    # create a feature layer collection item (to update metadata on REST Service page)
-    item = gis.content.get(file_ID)
-    flc = FeatureLayerCollection.fromitem(item)
-    
-    # create json dictionary to update feature layer collection (metadata on the REST Service page)
-    item_properties = {
-      "title" : item.title,
-      "tags" : item.tags,
-      "snippet" : item.snippet,
-      "description" : item.description,
-      "serviceDescription":item.description,
-      "licenseInfo" : item.licenseInfo,
-      "accessInformation" : item.accessInformation,
-      "copyrightText": item.licenseInfo
-    }
-    flc.manager.update_definition(item_properties)
-
-    # update the thumbnail on the feature service landing page
-    # for some reason the landing page thumbnail doesn't update when the metadata thumbnail is updated
-    with tempfile.NamedTemporaryFile(delete = False, suffix = ".jpg") as tmp_file:
-      tmp_file.write(thumbnail)
-      tmp_file_path = tmp_file.name
-    
-    item.update(thumbnail= tmp_file_path) #calling the thumbnail item specifically updates the thumbnail
-    print(f"Thumbnail on landing page updated for {item.title}.")
-    
-    print(f"Metadata for {item.title} updated successfully.")
-
-print("All feature service metadata updated!")    
-
-# UPDATE LAYER LEVEL METADATA 
-# layer level metadata cannot be updated with XML, need to use a json dictionary
-# create json dictionary using item properties from hosted feature service
-
-# loop through surveys
-for survey_short in survey_names:
-  
-  # grab file_id, rest_url by survey
-  layerID = df_features.query("strata_short == @survey_short").file_id.iloc[0]
-  
-  item = gis.content.get(layerID)
-  
-  survey_layer = df_layers.query("strata_short == @survey_short")
-  for index, row in survey_layer.iterrows():
-    try:
-      description = row['abstract'] if row['abstract'] is not None else ''
+
+def survey_rows(df_features):
+  """
+  Yields the feature table row of every survey (the first row if a survey is listed twice).
+  """
+  seen = set()
+  for row in df_features.itertuples(index = False):
+    if row.strata_short not in seen:
+      seen.add(row.strata_short)
+      yield row
+
+
+def rest_properties(item):
+  """
+  Creates json dictionary to update feature layer collection (metadata on the REST Service page)
+  from the item properties.
+  """
+  return {
+    "title" : item.title,
+    "tags" : item.tags,
+    "snippet" : item.snippet,
+    "description" : item.description,
+    "serviceDescription":item.description,
+    "licenseInfo" : item.licenseInfo,
+    "accessInformation" : item.accessInformation,
+    "copyrightText": item.licenseInfo
+  }
+
+
+def layer_metadata_jobs(item_cache, df_layers, survey_file_ids):
+  """
+  Creates the layer level metadata of every layer of the given surveys (survey -> file id).
+  Returns a list of (table_name, rest_url, file_id, layer_properties).
+  """
+  # layer level metadata cannot be updated with XML, need to use a json dictionary
+  # create json dictionary using item properties from hosted feature service
+  layer_jobs = []
+  # layer table grouped once by survey
+  for survey_short, survey_layer in df_layers.groupby('strata_short', sort = False):
+    if survey_short not in survey_file_ids:
+      continue
+
+    # grab file_id by survey
+    layerID = survey_file_ids[survey_short]
+
+    item = item_cache.get_item(layerID)
+
+    for row in survey_layer.itertuples(index = False):
+      description = row.abstract if row.abstract is not None else ''
       layer_properties = {
         "description" : description,
         "copyrightText": item.accessInformation
       } 
-      feature_layer = FeatureLayer(row['rest_url'])
-      print(f"{row['table_name']} layer exists, proceeding with update...")
-      feature_layer.manager.update_definition(layer_properties)
-      print(f"{row['rest_url']} layer updated successfully!")
+      layer_jobs.append((row.table_name, row.rest_url, layerID, layer_properties))
+  return layer_jobs
+
+
+def plan_metadata(item_cache, catalog, state_store, force = False):
+  """
+  Works out which metadata update_metadata would upload, without writing anything.
+  Returns a dictionary with
+    "surveys": {"survey", "item_id", "parts"} for every survey with parts to upload
+      ("xml", "rest" and "thumbnail"; the REST page is derived from the item, so it is
+      listed whenever the xml changes)
+    "layers": {"name", "url", "item_id", "properties"} for every layer whose description
+      or copyright text differs from oracle
+  """
+  template = MetadataTemplate()
+  survey_plans = []
+  survey_file_ids = {}
+  for row in survey_rows(catalog.df_features):
+    survey_file_ids[row.strata_short] = row.file_id
+    state_key = f"metadata/{row.file_id}"
+    parts = []
+    metadata_hash = content_fingerprint(template.render(template.values_from_row(row)))
+    if force or state_store.get_fingerprint(f"{state_key}/xml") != metadata_hash:
+      parts += ["xml", "rest"]
+    else:
+      properties_hash = content_fingerprint(rest_properties(item_cache.get_item(row.file_id)))
+      if state_store.get_fingerprint(f"{state_key}/rest") != properties_hash:
+        parts.append("rest")
+    if force or state_store.get_fingerprint(f"{state_key}/thumbnail") != content_fingerprint(row.thumbnail):
+      parts.append("thumbnail")
+    if parts:
+      survey_plans.append({"survey": row.strata_short, "item_id": row.file_id, "parts": parts})
+
+  layer_plans = []
+  for table_name, rest_url, file_id, layer_properties in layer_metadata_jobs(item_cache, catalog.df_layers, survey_file_ids):
+    try:
+      layer_index = int(rest_url[len(rest_url) - 1])
+      current = item_cache.get_layer_properties(file_id, layer_index)
+      unchanged = all(current.get(setting) == value for setting, value in layer_properties.items())
     except Exception:
-      print(f"layer {row['rest_url']} does not exist or could not be retrieved.") 
-      
-print("All layer level metadata updated!")
+      unchanged = False
+    if force or not unchanged:
+      layer_plans.append({"name": table_name, "url": rest_url, "item_id": file_id, "properties": layer_properties})
+
+  return {"surveys": survey_plans, "layers": layer_plans}
+
+
+@timed("stage.metadata")
+def update_metadata(gis, catalog, item_cache = None, force = False, state_store = None, surveys = None, layer_urls = None,
+                    collection_type = FeatureLayerCollection, layer_type = FeatureLayer):
+  """
+  Updates feature service metadata (item XML metadata, REST service page and thumbnail)
+  and layer level metadata for every survey in the feature table.
+  item_cache can be shared with the other stages.
+  The XML, REST properties and thumbnail are fingerprinted, and each part is only
+  uploaded when it differs from the last successful upload (or with force).
+  Layer descriptions are updated in parallel, rate limited per host.
+  surveys and layer_urls (e.g. from a change plan) limit the update to these surveys and layers.
+  collection_type and layer_type are the classes the REST pages and layers are updated through
+  (FeatureLayerCollection and FeatureLayer, or stand-ins such as the fake AGOL server's).
+  Returns a list of LayerUpdateResult, one per layer.
+  """
+  item_cache = item_cache or ItemCache(gis)
+  # The state file location can be changed with STATE_DB in the .env file
+  own_state_store = state_store is None
+  if own_state_store:
+    state_store = StateStore(os.getenv("STATE_DB", DEFAULT_STATE_DB))
+  df_features = catalog.df_features
+  df_layers = catalog.df_layers
+
+  # UPDATE FEATURE LEVEL METADATA
+  # make a temporary xml file from template (ARCGIS_METADATA_TEMPLATE.xml) by pulling data from oracle metadata table
+  # for each survey, then push to arcgis online to update survey metadata
+
+  # use metadata template (already has correct parent and child elements to fulfill metadata requirements)
+  # the template is parsed once, every survey renders its own copy
+  # the oracle column -> xml element mapping is read from METADATA_FIELD_MAP.json
+  template = MetadataTemplate()
+
+  # file id of each survey, used again for the layer level metadata
+  survey_file_ids = {}
+  uploads = {"xml": 0, "rest": 0, "thumbnail": 0}
+  skipped = {"xml": 0, "rest": 0, "thumbnail": 0}
+
+  # build xml file and push to AGOL
+  # (item.update uploads the metadata and thumbnail from file paths, the files are
+  # written to a temporary folder that is removed after the last survey)
+  with tempfile.TemporaryDirectory() as temp_folder:
+    xml_metadata = os.path.join(temp_folder, "metadata.xml")
+    tmp_file_path = os.path.join(temp_folder, "thumbnail.jpg")
+
+    # one pass over the feature table, one row per survey
+    for row in survey_rows(df_features):
+      survey_short = row.strata_short
+      file_ID = row.file_id
+      thumbnail = row.thumbnail
+      survey_file_ids[survey_short] = file_ID
+      if surveys is not None and survey_short not in surveys:
+        continue
+
+      # extract metadata values and fill a copy of the xml template
+      with metrics.timer("metadata.render"):
+        metadata_bytes = template.render(template.values_from_row(row))
+      print(f"Finished extracting metadata for {survey_short} from oracle db.")  
+
+      # fingerprints of the last successful upload of each part of this survey's metadata
+      # (only the parts that changed since then are uploaded)
+      state_key = f"metadata/{file_ID}"
+      metadata_hash = content_fingerprint(metadata_bytes)
+      thumbnail_hash = content_fingerprint(thumbnail)
+
+      # update metadata for feature service item
+      if force or state_store.get_fingerprint(f"{state_key}/xml") != metadata_hash:
+        # write xml to temp file
+        with open(xml_metadata, "wb") as temp_file:
+          temp_file.write(metadata_bytes)
+        print('Metadata converted to temp XML file.')
+
+        # get arcgis online item using file id
+        item = item_cache.get_item(file_ID)
+        metrics.count("agol.http_calls")
+        metrics.count("metadata.bytes_uploaded", len(metadata_bytes))
+        if item.update(metadata = xml_metadata):
+          state_store.set_fingerprints({f"{state_key}/xml": metadata_hash})
+        item_cache.invalidate(file_ID)
+        uploads["xml"] += 1
+      else:
+        skipped["xml"] += 1
+
+      # create a feature layer collection item (to update metadata on REST Service page)
+      # (fetched again so the item properties reflect the new metadata)
+      item = item_cache.get_item(file_ID)
+
+      # create json dictionary to update feature layer collection (metadata on the REST Service page)
+      item_properties = rest_properties(item)
+      properties_hash = content_fingerprint(item_properties)
+      if force or state_store.get_fingerprint(f"{state_key}/rest") != properties_hash:
+        flc = collection_type.fromitem(item)
+        metrics.count("agol.http_calls")
+        result = flc.manager.update_definition(item_properties)
+        if result.get('success', False):
+          state_store.set_fingerprints({f"{state_key}/rest": properties_hash})
+        item_cache.invalidate(file_ID)
+        uploads["rest"] += 1
+      else:
+        skipped["rest"] += 1
+
+      # update the thumbnail on the feature service landing page
+      # for some reason the landing page thumbnail doesn't update when the metadata thumbnail is updated
+      if force or state_store.get_fingerprint(f"{state_key}/thumbnail") != thumbnail_hash:
+        with open(tmp_file_path, "wb") as tmp_file:
+          tmp_file.write(thumbnail)
+
+        metrics.count("agol.http_calls")
+        metrics.count("metadata.bytes_uploaded", len(thumbnail))
+        if item.update(thumbnail= tmp_file_path): #calling the thumbnail item specifically updates the thumbnail
+          state_store.set_fingerprints({f"{state_key}/thumbnail": thumbnail_hash})
+        item_cache.invalidate(file_ID)
+        uploads["thumbnail"] += 1
+        print(f"Thumbnail on landing page updated for {item.title}.")
+      else:
+        skipped["thumbnail"] += 1
+
+      print(f"Metadata for {item.title} updated successfully.")
+
+  if own_state_store:
+    state_store.close()
+  for part in uploads:
+    metrics.count(f"metadata.{part}_uploaded", uploads[part])
+    metrics.count(f"metadata.{part}_skipped", skipped[part])
+  print(f"Metadata parts uploaded: {uploads['xml']} xml, {uploads['rest']} REST, {uploads['thumbnail']} thumbnail; "
+        f"unchanged and skipped: {skipped['xml']} xml, {skipped['rest']} REST, {skipped['thumbnail']} thumbnail.")
+  print("All feature service metadata updated!")    
+
+  # UPDATE LAYER LEVEL METADATA 
+  # collect one job per layer
+  layer_jobs = [
+    (table_name, rest_url, layer_properties)
+    for table_name, rest_url, _, layer_properties in layer_metadata_jobs(item_cache, df_layers, survey_file_ids)
+    if layer_urls is None or rest_url in layer_urls
+  ]
+
+  # push the layer updates in parallel
+  # the number of parallel updates and the requests per second sent to each host
+  # can be changed with LAYER_WORKERS and AGOL_RATE_LIMIT in the .env file
+  layer_workers = int(os.getenv("LAYER_WORKERS", DEFAULT_LAYER_WORKERS))
+  rate_limiter = HostRateLimiter(float(os.getenv("AGOL_RATE_LIMIT", DEFAULT_RATE_LIMIT)))
+
+  def update_layer(rest_url, layer_properties):
+    feature_layer = layer_type(rest_url, gis = gis)
+    return feature_layer.manager.update_definition(layer_properties)
+
+  layer_results = update_layers(layer_jobs, update_layer, workers = layer_workers, rate_limiter = rate_limiter)
+  for result in layer_results:
+    if result.success:
+      print(f"{result.url} layer updated successfully!")
+    else:
+      print(f"layer {result.url} does not exist or could not be updated: {result.message}")
+  failed = sum(not result.success for result in layer_results)
+  print(f"{len(layer_results) - failed} of {len(layer_results)} layers updated ({layer_workers} workers).")
+  return layer_results
+
+
+# RUN THE SCRIPT
+if __name__ == "__main__":
+  # COMMAND LINE OPTIONS
+  # --force uploads every metadata part, even if it has not changed since the last run
+  parser = argparse.ArgumentParser(description = "Update AGOL feature service and layer metadata from the oracle feature table.")
+  parser.add_argument("--force", action = "store_true", help = "upload all metadata, even if it has not changed")
+  add_instrument_arguments(parser)
+  args = parser.parse_args()
+  start_instrumentation(args)
+
+  # AUTHENTICATE ARCGIS CREDENTIALS
+  # using ArcGIS Pro to authenticate, change authentication scheme if necessary
+  gis = GIS("PRO")
+
+  # CONNECT TO ORACLE AND EXTRACT DATA
+  # query feature table (info about feature services) and layers table (layer info)
+  load_environment()
+  engine = create_oracle_engine()
+  catalog = Catalog.load(engine)
+  engine.dispose()
+
+  item_cache = ItemCache(gis)
+  update_metadata(gis, catalog, item_cache, force = args.force)
+
+  print("All layer level metadata updated!")
+  print(item_cache.summary())
+  finish_instrumentation(args)
@@ -0,0 +1,197 @@
+###############################################################################
+## This script plans the MDEB_SPATIAL refresh without writing to AGOL. It    ##
+## reads the oracle catalog and the current AGOL state once and saves every  ##
+## pending change (data overwrites, field, metadata and popup diffs) to a    ##
+## JSON plan. The plan can be reviewed and applied later, which only runs    ##
+## the writes listed in it.                                                  ##
+##                                                                           ##
+## Usage: python python/MDEB_SPATIAL_plan.py --plan plan.json [--force]      ##
+##        [--delta] [--fetch-engine pandas|arrow] [--offline]                ##
+##        python python/MDEB_SPATIAL_plan.py --apply plan.json [--offline]   ##
+##        [--stages data fields metadata popup]                              ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+from arcgis.gis import GIS
+from arcgis.features import FeatureLayerCollection, FeatureLayer
+from MDEB_SPATIAL_catalog import Catalog, load_environment, create_oracle_engine
+from MDEB_SPATIAL_agol import ItemCache
+from MDEB_SPATIAL_extract import DEFAULT_EXTRACT_WORKERS, FETCH_ENGINES
+from MDEB_SPATIAL_state import DEFAULT_STATE_DB, StateStore
+from MDEB_SPATIAL_snapshot import DEFAULT_SNAPSHOT_FOLDER, load_catalog
+from MDEB_SPATIAL_dataupdate import open_snapshot_store, plan_data, update_data
+from MDEB_SPATIAL_fieldsupdate import plan_fields, apply_field_updates
+from MDEB_SPATIAL_metadataupdate import plan_metadata, update_metadata
+from MDEB_SPATIAL_popupupdate import update_popups
+
+# Stages in the order they are applied
+STAGES = ["data", "fields", "metadata", "popup"]
+
+
+def build_plan(gis, engine, catalog, item_cache, stages = STAGES, force = False, delta = False, fetch_engine = None):
+    """
+    Computes the pending changes of every stage without writing to AGOL.
+    Field and popup diffs are computed against the current service definitions,
+    if the plan overwrites data, plan again after applying it to catch the
+    definitions the overwrite resets.
+    delta and fetch_engine (see update_data) are saved in the plan and used when
+    its data stage is applied. Without an engine (offline) the data stage is
+    planned from the local snapshots.
+    Returns the plan as a JSON serializable dictionary.
+    """
+    plan = {"created_at": datetime.now(timezone.utc).isoformat(), "stages": list(stages)}
+    # The state file location can be changed with STATE_DB in the .env file
+    state_store = StateStore(os.getenv("STATE_DB", DEFAULT_STATE_DB))
+
+    if "data" in stages:
+        print("\n=== Planning feature service data ===")
+        service_item_ids = catalog.df_layers.drop_duplicates('service_name').set_index('service_name')['file_id']
+        snapshot_store = open_snapshot_store(state_store, catalog.df_layers)
+        plan["data_options"] = {"delta": delta, "fetch_engine": fetch_engine}
+        plan["data"] = [
+            {"service": service_name, "item_id": service_item_ids.get(service_name), "tables": fingerprints}
+            for service_name, fingerprints in plan_data(engine, catalog, state_store, force = force, snapshot_store = snapshot_store).items()
+        ]
+
+    if "fields" in stages:
+        print("\n=== Planning field aliases and descriptions ===")
+        plan["fields"] = [
+            {
+                "item_id": item_id,
+                "layer_name": layer_name,
+                "layer_index": layer_index,
+                "fields": [updated_field for updated_field, _, _ in changed_fields],
+                "changes": [
+                    {
+                        "name": updated_field['name'],
+                        "alias": [old_alias, updated_field['alias']],
+                        "description": [old_description, updated_field['description']],
+                    }
+                    for updated_field, old_alias, old_description in changed_fields
+                ],
+            }
+            for item_id, layer_name, layer_index, changed_fields in plan_fields(item_cache, catalog)
+        ]
+
+    if "metadata" in stages:
+        print("\n=== Planning feature service and layer metadata ===")
+        plan["metadata"] = plan_metadata(item_cache, catalog, state_store, force = force)
+
+    if "popup" in stages:
+        print("\n=== Planning popups ===")
+        plan["popup"] = [
+            {"item_id": item_id, "layers": layer_changes}
+            for item_id, layer_changes in update_popups(gis, catalog, item_cache, dry_run = True).items()
+        ]
+
+    state_store.close()
+    return plan
+
+
+def summarize_plan(plan):
+    """
+    Returns the number of planned changes of each stage as printable lines.
+    """
+    lines = []
+    if "data" in plan:
+        action = "to update (delta)" if plan.get("data_options", {}).get("delta") else "to overwrite"
+        lines.append(f"data: {len(plan['data'])} service(s) {action}")
+    if "fields" in plan:
+        field_count = sum(len(layer['fields']) for layer in plan['fields'])
+        lines.append(f"fields: {field_count} field(s) in {len(plan['fields'])} layer(s)")
+    if "metadata" in plan:
+        part_count = sum(len(survey['parts']) for survey in plan['metadata']['surveys'])
+        lines.append(f"metadata: {part_count} part(s) in {len(plan['metadata']['surveys'])} survey(s), "
+                     f"{len(plan['metadata']['layers'])} layer(s)")
+    if "popup" in plan:
+        lines.append(f"popup: {len(plan['popup'])} service(s)")
+    return lines
+
+
+def apply_plan(gis, engine, catalog, item_cache, plan, collection_type = FeatureLayerCollection, layer_type = FeatureLayer):
+    """
+    Runs only the writes listed in a plan, stage by stage. Stages with nothing
+    planned are skipped. The data stage runs with the plan's data options.
+    Without an engine (offline) the data is published from the local snapshots.
+    collection_type and layer_type are passed on to update_data and update_metadata.
+    """
+    if plan.get("data"):
+        print("\n=== Updating feature service data ===")
+        update_data(gis, engine, catalog, item_cache = item_cache, services = {entry['service'] for entry in plan['data']},
+                    collection_type = collection_type, **plan.get("data_options", {}))
+
+    if plan.get("fields"):
+        print("\n=== Updating field aliases and descriptions ===")
+        apply_field_updates(item_cache, [
+            (entry['item_id'], entry['layer_name'], entry['layer_index'], entry['fields'])
+            for entry in plan['fields']
+        ])
+
+    metadata_plan = plan.get("metadata") or {}
+    if metadata_plan.get("surveys") or metadata_plan.get("layers"):
+        print("\n=== Updating feature service and layer metadata ===")
+        update_metadata(
+            gis, catalog, item_cache,
+            surveys = {entry['survey'] for entry in metadata_plan.get('surveys', [])},
+            layer_urls = {entry['url'] for entry in metadata_plan.get('layers', [])},
+            collection_type = collection_type, layer_type = layer_type
+        )
+
+    if plan.get("popup"):
+        print("\n=== Updating popups ===")
+        update_popups(gis, catalog, item_cache, item_ids = {entry['item_id'] for entry in plan['popup']})
+
+
+# RUN THE SCRIPT
+if __name__ == "__main__":
+    # COMMAND LINE OPTIONS
+    parser = argparse.ArgumentParser(description = "Plan the MDEB_SPATIAL refresh as a JSON change plan, or apply a saved plan.")
+    mode = parser.add_mutually_exclusive_group(required = True)
+    mode.add_argument("--plan", metavar = "PLAN_JSON", help = "write the pending changes to this file")
+    mode.add_argument("--apply", metavar = "PLAN_JSON", help = "apply the changes listed in this file")
+    parser.add_argument("--force", action = "store_true", help = "plan every service and all metadata, even if unchanged")
+    parser.add_argument("--stages", nargs = "+", choices = STAGES, default = STAGES, help = "stages to plan (default: all)")
+    parser.add_argument("--delta", action = "store_true", help = "plan to send only the changed rows instead of overwriting services")
+    parser.add_argument("--fetch-engine", choices = list(FETCH_ENGINES), help = "how tables are read from oracle (default: FETCH_ENGINE or pandas)")
+    parser.add_argument("--offline", action = "store_true", help = "plan or apply from the local snapshots without connecting to oracle")
+    args = parser.parse_args()
+
+    # AUTHENTICATE ARCGIS CREDENTIALS
+    # Using ArcGIS Pro to authenticate, change authentication scheme if necessary
+    gis = GIS("PRO")
+
+    # CONNECT TO ORACLE AND LOAD THE CATALOG
+    # (offline, the catalog and tables are read from the local snapshots instead)
+    load_environment()
+    if args.offline:
+        engine = None
+        catalog = load_catalog(os.getenv("SNAPSHOT_FOLDER", DEFAULT_SNAPSHOT_FOLDER))
+    else:
+        engine = create_oracle_engine(pool_size = int(os.getenv("EXTRACT_WORKERS", DEFAULT_EXTRACT_WORKERS)))
+        catalog = Catalog.load(engine)
+    item_cache = ItemCache(gis)
+
+    if args.plan:
+        plan = build_plan(gis, engine, catalog, item_cache, stages = args.stages, force = args.force,
+                          delta = args.delta, fetch_engine = args.fetch_engine)
+        with open(args.plan, "w") as file:
+            json.dump(plan, file, indent = 2, default = str)
+        print(f"\nPlan written to {args.plan}:")
+    else:
+        with open(args.apply) as file:
+            plan = json.load(file)
+        print(f"Applying plan {args.apply} (created {plan.get('created_at')}):")
+        for line in summarize_plan(plan):
+            print(f"  {line}")
+        apply_plan(gis, engine, catalog, item_cache, plan)
+        print("\nPlan applied:")
+
+    for line in summarize_plan(plan):
+        print(f"  {line}")
+    if engine is not None:
+        engine.dispose()
+    print(item_cache.summary())
@@ -0,0 +1,175 @@
+###############################################################################
+## Popup model used by MDEB_SPATIAL_popupupdate.py. A layer's popupInfo is   ##
+## indexed once (field name -> fieldInfos for the main fieldInfos list and   ##
+## every 'fields' popup element), so adding missing fields and applying the  ##
+## field rules in POPUP_FIELD_RULES.json are dictionary lookups.             ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import json
+import os
+import re
+
+# Field rules (which popup settings are forced on which fields)
+# Each rule has a "config" merged into the matching fieldInfos and matches fields by
+#   "names" (exact field names), "pattern" (regular expression on the field name)
+#   and/or "field_types" (esri field types from the layer schema, e.g. esriFieldTypeOID)
+# The first matching rule wins
+FIELD_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "POPUP_FIELD_RULES.json")
+
+# Default configuration for any NEW field that needs to be added to the popup.
+default_new_field_config = {
+    "isEditable": True,
+    "visible": True,
+    "format": None      # Use default formatting for simplicity
+}
+
+
+def create_field_info(field_name, field_alias, config):
+    """
+    Creates a standard fieldInfo dictionary for the popup.
+    """
+    info = {
+        "fieldName": field_name,
+        "isEditable": config.get("isEditable", True),
+        "visible": config.get("visible", True),
+        "label": field_alias,
+    }
+    # Add format if it exists in the configuration
+    if config and config.get("format") is not None:
+        info["format"] = config["format"]
+
+    return info
+
+
+class FieldRule:
+    """
+    Popup settings applied to every field matching the rule's names, name pattern or field types.
+    """
+
+    def __init__(self, config, names = None, pattern = None, field_types = None):
+        if not (names or pattern or field_types):
+            raise ValueError(f"Popup field rule {config} needs 'names', 'pattern' or 'field_types'")
+        self.config = config
+        self.names = set(names or [])
+        self.pattern = re.compile(pattern) if pattern else None
+        self.field_types = set(field_types or [])
+
+    def matches(self, field_name, field_type = None):
+        return (
+            field_name in self.names
+            or (self.pattern is not None and self.pattern.fullmatch(field_name) is not None)
+            or (field_type is not None and field_type in self.field_types)
+        )
+
+
+class FieldRuleSet:
+    """
+    Ordered list of field rules. The rule found for a field name and type is remembered,
+    survey tables share most column names so each name is only matched once.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._matches = {}
+
+    def rule_for(self, field_name, field_type = None):
+        """
+        Returns the first rule matching the field, or None.
+        """
+        key = (field_name, field_type)
+        if key not in self._matches:
+            self._matches[key] = next((rule for rule in self.rules if rule.matches(field_name, field_type)), None)
+        return self._matches[key]
+
+
+def load_field_rules(path = FIELD_RULES_PATH):
+    """
+    Reads the popup field rules.
+    """
+    with open(path) as file:
+        return FieldRuleSet(
+            FieldRule(rule["config"], rule.get("names"), rule.get("pattern"), rule.get("field_types"))
+            for rule in json.load(file)
+        )
+
+
+class PopupModel:
+    """
+    Index over a layer's popupInfo: one name -> fieldInfos dictionary for the main
+    fieldInfos list and one for each 'fields' popup element. A name listed more than
+    once keeps every entry, so rules are applied to duplicates as well. Changes are
+    made in place, so the popupInfo can be pushed as is afterwards.
+    """
+
+    def __init__(self, popupInfo):
+        self.popupInfo = popupInfo
+        popupInfo.setdefault('fieldInfos', [])
+        self.elements = [element for element in popupInfo.get('popupElements', []) if element.get('type') == 'fields']
+        self.main_index = self._index(popupInfo['fieldInfos'])
+        self.element_indexes = [self._index(element.get('fieldInfos', [])) for element in self.elements]
+
+    @staticmethod
+    def _index(field_infos):
+        # field names are compared case insensitively, duplicate entries of a name are all kept
+        index = {}
+        for field_info in field_infos:
+            index.setdefault(field_info.get('fieldName', '').lower(), []).append(field_info)
+        return index
+
+    def parts(self):
+        """
+        Yields the name -> fieldInfos index of every popup part (main list first).
+        """
+        yield self.main_index
+        yield from self.element_indexes
+
+    def add_missing_fields(self, layer_fields_schema, config = default_new_field_config):
+        """
+        Adds a default fieldInfo for every layer field missing from the main fieldInfos,
+        to the main list and to each 'fields' popup element that lacks it.
+        Returns the number of fields added.
+        """
+        added_count = 0
+        for field_schema in layer_fields_schema:
+            field_name = field_schema['name']
+            key = field_name.lower()
+            if key in self.main_index:
+                continue
+
+            # Create the default fieldInfo structure for the missing field
+            new_field_info = create_field_info(field_name, field_schema.get('alias', field_name), config = config)
+            self.popupInfo['fieldInfos'].append(new_field_info)
+            self.main_index[key] = [new_field_info]
+
+            # Add to the 'fields' popupElements lists
+            for element, element_index in zip(self.elements, self.element_indexes):
+                if key not in element_index:
+                    element.setdefault('fieldInfos', []).append(new_field_info)
+                    element_index[key] = [new_field_info]
+            added_count += 1
+        return added_count
+
+    def apply_rules(self, rules, layer_fields_schema = ()):
+        """
+        Merges the config of the first matching rule (a FieldRuleSet) into every fieldInfo
+        of every popup part. Field types are taken from the layer schema. Returns the number
+        of fieldInfos that actually changed (fieldInfos already matching their rule are not counted).
+        """
+        field_types = {field['name'].lower(): field.get('type') for field in layer_fields_schema}
+        updated_count = 0
+        checked = set()
+        for index in self.parts():
+            for key, field_infos in index.items():
+                for field_info in field_infos:
+                    # fieldInfos added by add_missing_fields are shared with the main list, check them once
+                    if id(field_info) in checked:
+                        continue
+                    checked.add(id(field_info))
+                    rule = rules.rule_for(field_info.get('fieldName', ''), field_types.get(key))
+                    if rule is None:
+                        continue
+                    if any(field_info.get(setting) != value for setting, value in rule.config.items()):
+                        field_info.update(rule.config)
+                        updated_count += 1
+        return updated_count
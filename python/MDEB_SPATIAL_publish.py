@@ -0,0 +1,162 @@
+###############################################################################
+## Helper functions used by MDEB_SPATIAL_dataupdate.py to package file       ##
+## geodatabases and publish them to AGOL. The build, zip and upload stages   ##
+## run as a pipeline so one service uploads while the next one is built.     ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import os
+import queue
+import threading
+import time
+import zipfile
+
+# Default number of services waiting between two pipeline stages
+DEFAULT_QUEUE_SIZE = 2
+
+# Default number of services overwritten at the same time
+DEFAULT_UPLOAD_WORKERS = 3
+
+# Zip compression settings (can be changed with PACKAGE_COMPRESSION and PACKAGE_LEVEL in the .env file)
+# FGDB tables compress poorly, "store" or a low deflate level is usually much faster for a similar upload size
+COMPRESSION_TYPES = {"store": zipfile.ZIP_STORED, "deflate": zipfile.ZIP_DEFLATED}
+DEFAULT_COMPRESSION = "deflate"
+COMPRESSION_LEVELS = range(1, 10)
+
+# Marks the end of the items flowing through a pipeline
+_DONE = object()
+
+
+def check_compression(compression, level = None):
+    """
+    Raises a ValueError for an unknown compression or a deflate level outside 1-9,
+    so bad settings are caught before any table is extracted.
+    """
+    if compression not in COMPRESSION_TYPES:
+        raise ValueError(f"Unknown compression '{compression}', expected one of {sorted(COMPRESSION_TYPES)}")
+    if level is not None and level not in COMPRESSION_LEVELS:
+        raise ValueError(f"Compression level {level} is out of range, expected 1 (fastest) to 9 (smallest)")
+
+
+def zip_fgdb(fgdb_path, output, compression = DEFAULT_COMPRESSION, level = None):
+    """
+    Zips a file geodatabase folder. Paths inside the zip file start with the
+    .gdb folder name (this is what AGOL expects when overwriting a service).
+    output can be a file path or a writable file object (e.g. io.BytesIO or a
+    tempfile.SpooledTemporaryFile, to build the archive in memory).
+    compression is "store" (no compression) or "deflate", with an optional level
+    from 1 (fastest) to 9 (smallest).
+    """
+    check_compression(compression, level)
+    compress_type = COMPRESSION_TYPES[compression]
+    compress_level = level if compress_type == zipfile.ZIP_DEFLATED else None
+
+    base_dir = os.path.dirname(fgdb_path)
+    with zipfile.ZipFile(output, 'w', compress_type, compresslevel = compress_level) as zf:
+        # Walk the FGDB folder to add contents recursively
+        for root, dirs, files in os.walk(fgdb_path):
+            # Determine the relative path inside the zip file
+            archive_root = os.path.relpath(root, base_dir)
+            for file in files:
+                full_path = os.path.join(root, file)
+                archive_path = os.path.join(archive_root, file)
+                zf.write(full_path, archive_path)
+    return output
+
+
+class StageTimings:
+    """
+    Collects how long each pipeline stage spent working on items, and when it was active.
+    """
+
+    def __init__(self, stage_names):
+        self.stage_names = list(stage_names)
+        self.items = {name: 0 for name in self.stage_names}
+        self.busy = {name: 0.0 for name in self.stage_names}
+        self.first_start = {}
+        self.last_end = {}
+        self.wall = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, stage_name, start, end):
+        with self._lock:
+            self.items[stage_name] += 1
+            self.busy[stage_name] += end - start
+            self.first_start[stage_name] = min(start, self.first_start.get(stage_name, start))
+            self.last_end[stage_name] = max(end, self.last_end.get(stage_name, end))
+
+    def summary(self):
+        """
+        Returns the timing summary as printable lines.
+        The overlap is the stage time that ran at the same time as another stage.
+        """
+        origin = min(self.first_start.values(), default = 0.0)
+        lines = [f"{'stage':<10}{'items':>7}{'busy (s)':>11}{'active from-to (s)':>22}"]
+        for name in self.stage_names:
+            if name in self.first_start:
+                window = f"{self.first_start[name] - origin:9.1f} -{self.last_end[name] - origin:9.1f}"
+            else:
+                window = f"{'-':>20}"
+            lines.append(f"{name:<10}{self.items[name]:>7}{self.busy[name]:>11.1f}{window:>22}")
+        total_busy = sum(self.busy.values())
+        lines.append(f"wall time {self.wall:.1f} s, stage time {total_busy:.1f} s, overlap {max(total_busy - self.wall, 0.0):.1f} s")
+        return lines
+
+
+def run_pipeline(items, stages, queue_size = DEFAULT_QUEUE_SIZE):
+    """
+    Passes every item through a list of (stage_name, function) or
+    (stage_name, function, workers) stages.
+    Each stage runs in its own thread(s) and hands its result to the next stage through
+    a bounded queue, so different items can be in different stages at the same time.
+    A stage function returning None (or raising) drops the item from the rest of the pipeline.
+    Returns a StageTimings object with the time spent in each stage.
+    """
+    stages = [stage if len(stage) == 3 else (*stage, 1) for stage in stages]
+    timings = StageTimings(name for name, _, _ in stages)
+    queues = [queue.Queue(maxsize = queue_size) for _ in stages]
+
+    def run_stage(index, stage_name, function, running_workers):
+        input_queue = queues[index]
+        output_queue = queues[index + 1] if index + 1 < len(queues) else None
+        while True:
+            item = input_queue.get()
+            if item is _DONE:
+                # Let the other workers of this stage see the end marker too,
+                # the last worker to stop passes it on to the next stage
+                input_queue.put(_DONE)
+                with running_workers['lock']:
+                    running_workers['count'] -= 1
+                    last_worker = running_workers['count'] == 0
+                if last_worker and output_queue is not None:
+                    output_queue.put(_DONE)
+                return
+            start = time.perf_counter()
+            try:
+                result = function(item)
+            except Exception as e:
+                print(f" - An unhandled error occurred in the {stage_name} stage for '{item}': {e}")
+                result = None
+            timings.record(stage_name, start, time.perf_counter())
+            if output_queue is not None and result is not None:
+                output_queue.put(result)
+
+    threads = []
+    for index, (stage_name, function, workers) in enumerate(stages):
+        running_workers = {'lock': threading.Lock(), 'count': workers}
+        for worker in range(workers):
+            threads.append(threading.Thread(
+                target = run_stage,
+                args = (index, stage_name, function, running_workers),
+                name = f"pipeline-{stage_name}-{worker}"
+            ))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for item in items:
+        queues[0].put(item)
+    queues[0].put(_DONE)
+    for thread in threads:
+        thread.join()
+    timings.wall = time.perf_counter() - start
+    return timings
@@ -0,0 +1,163 @@
+###############################################################################
+## Local GeoParquet snapshots of the oracle extracts, used by                ##
+## MDEB_SPATIAL_dataupdate.py. Every extracted table is also saved as        ##
+## snapshots/<TABLE>/<fingerprint>/part-NNNNN.parquet (geometry already      ##
+## decoded), so re-runs read the snapshot instead of querying oracle. The    ##
+## catalog tables are saved as well, so data can be published offline.       ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+import pandas as pd
+import geopandas as gpd
+from MDEB_SPATIAL_catalog import Catalog
+from MDEB_SPATIAL_instrument import metrics
+
+# Default snapshot folder (can be changed with SNAPSHOT_FOLDER in the .env file)
+DEFAULT_SNAPSHOT_FOLDER = "snapshots"
+
+# Default number of snapshots kept per table (can be changed with SNAPSHOT_KEEP in the .env file)
+DEFAULT_SNAPSHOT_KEEP = 2
+
+# Parquet compression of the snapshot files
+SNAPSHOT_COMPRESSION = "zstd"
+
+# Folder (inside the snapshot folder) holding the catalog tables
+CATALOG_FOLDER = "_catalog"
+
+# Suffix of a snapshot that is still being written
+PARTIAL_SUFFIX = ".partial"
+
+
+class SnapshotStore:
+    """
+    Table snapshots on local disk, keyed by table name and table fingerprint.
+    A snapshot is written to its own .partial folder and renamed once the whole table
+    has been saved, so an interrupted extract never leaves a snapshot behind and
+    several jobs can save the same table at the same time.
+    published (table name -> fingerprints) lists the snapshots last published to AGOL,
+    which are never pruned (delta updates are computed against them).
+    """
+
+    def __init__(self, folder = DEFAULT_SNAPSHOT_FOLDER, keep = DEFAULT_SNAPSHOT_KEEP, published = None):
+        self.folder = folder
+        self.keep = keep
+        self.published = published or {}
+
+    def path(self, table_name, fingerprint):
+        return os.path.join(self.folder, table_name.upper(), fingerprint)
+
+    def has(self, table_name, fingerprint):
+        """
+        Returns True if a complete snapshot of the table with this fingerprint exists.
+        """
+        return fingerprint is not None and os.path.isdir(self.path(table_name, fingerprint))
+
+    def fingerprints(self, table_name):
+        """
+        Returns the fingerprints of the complete snapshots of a table, newest first.
+        """
+        table_folder = os.path.join(self.folder, table_name.upper())
+        if not os.path.isdir(table_folder):
+            return []
+        snapshots = [
+            entry for entry in os.scandir(table_folder)
+            if entry.is_dir() and not entry.name.endswith(PARTIAL_SUFFIX)
+        ]
+        snapshots.sort(key = lambda entry: entry.stat().st_mtime, reverse = True)
+        return [entry.name for entry in snapshots]
+
+    def latest(self, table_name):
+        """
+        Returns the fingerprint of the newest snapshot of a table, or None.
+        """
+        fingerprints = self.fingerprints(table_name)
+        return fingerprints[0] if fingerprints else None
+
+    def read(self, table_name, fingerprint):
+        """
+        Yields the parts of a snapshot as geopandas dataframes, in the order they were written.
+        """
+        snapshot_path = self.path(table_name, fingerprint)
+        for part in sorted(os.listdir(snapshot_path)):
+            with metrics.timer("data.snapshot_read"):
+                gdf = gpd.read_parquet(os.path.join(snapshot_path, part))
+            metrics.count("data.rows_read", len(gdf))
+            yield gdf
+
+    def save(self, table_name, fingerprint, batches):
+        """
+        Writes every batch of a table to a snapshot part while passing it on, so the
+        snapshot is saved as the table is being published. The snapshot is only kept
+        if every batch was consumed, older snapshots beyond keep are then removed.
+        If another job (e.g. the same table in another service) saved the snapshot
+        first, that one is kept.
+        """
+        snapshot_path = self.path(table_name, fingerprint)
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok = True)
+        # every job writes to its own partial folder
+        partial_path = tempfile.mkdtemp(prefix = f"{fingerprint}-", suffix = PARTIAL_SUFFIX, dir = os.path.dirname(snapshot_path))
+        complete = False
+        try:
+            for part_number, gdf in enumerate(batches):
+                part_path = os.path.join(partial_path, f"part-{part_number:05d}.parquet")
+                with metrics.timer("data.snapshot_write"):
+                    gdf.to_parquet(part_path, compression = SNAPSHOT_COMPRESSION, index = False)
+                metrics.count("data.bytes_snapshot", os.path.getsize(part_path))
+                yield gdf
+            complete = True
+        finally:
+            if complete:
+                try:
+                    os.rename(partial_path, snapshot_path)
+                except OSError:
+                    # saved by another job first (same fingerprint, same rows)
+                    if not os.path.isdir(snapshot_path):
+                        raise
+                    shutil.rmtree(partial_path, ignore_errors = True)
+                self.prune(table_name, self.published.get(table_name.upper(), ()))
+            else:
+                shutil.rmtree(partial_path, ignore_errors = True)
+
+    def prune(self, table_name, published = ()):
+        """
+        Removes all but the keep newest snapshots of a table. Snapshots whose fingerprint
+        is in published are kept as well.
+        """
+        for fingerprint in self.fingerprints(table_name)[self.keep:]:
+            if fingerprint not in published:
+                shutil.rmtree(self.path(table_name, fingerprint), ignore_errors = True)
+
+
+def save_catalog(catalog, folder = DEFAULT_SNAPSHOT_FOLDER):
+    """
+    Saves the layer, field and feature tables of a catalog next to the table snapshots.
+    """
+    catalog_folder = os.path.join(folder, CATALOG_FOLDER)
+    os.makedirs(catalog_folder, exist_ok = True)
+    for name in ("df_layers", "df_fields", "df_features"):
+        df = getattr(catalog, name)
+        if df is not None:
+            df.to_parquet(os.path.join(catalog_folder, f"{name}.parquet"), compression = SNAPSHOT_COMPRESSION, index = False)
+    with open(os.path.join(catalog_folder, "catalog.json"), "w") as file:
+        json.dump({"schema": catalog.schema, "saved_at": datetime.now(timezone.utc).isoformat()}, file)
+
+
+def load_catalog(folder = DEFAULT_SNAPSHOT_FOLDER):
+    """
+    Loads the catalog saved by save_catalog. Raises FileNotFoundError if no catalog was saved.
+    """
+    catalog_folder = os.path.join(folder, CATALOG_FOLDER)
+    with open(os.path.join(catalog_folder, "catalog.json")) as file:
+        catalog_info = json.load(file)
+
+    def read_table(name):
+        path = os.path.join(catalog_folder, f"{name}.parquet")
+        return pd.read_parquet(path) if os.path.exists(path) else None
+
+    print(f"Loaded catalog snapshot saved at {catalog_info['saved_at']}.")
+    return Catalog(catalog_info["schema"], read_table("df_layers"), read_table("df_fields"), read_table("df_features"))
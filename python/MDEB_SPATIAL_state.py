@@ -0,0 +1,72 @@
+###############################################################################
+## Local state store for the MDEB_SPATIAL scripts. Keeps a content           ##
+## fingerprint for everything published to AGOL in a SQLite file, so items   ##
+## that have not changed since the last successful update can be skipped.    ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+# Default location of the state file (can be changed with STATE_DB in the .env file)
+DEFAULT_STATE_DB = "mdeb_spatial_state.sqlite"
+
+
+def content_fingerprint(content):
+    """
+    Returns a sha256 fingerprint of bytes, a string or a JSON serializable dictionary
+    (dictionary keys are sorted so the fingerprint does not depend on their order).
+    """
+    if isinstance(content, dict):
+        content = json.dumps(content, sort_keys = True, default = str)
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+class StateStore:
+    """
+    SQLite backed store of content fingerprints, keyed by a string such as
+    "<service name>/<table name>". Fingerprints should only be saved after the
+    matching AGOL update succeeded.
+    """
+
+    def __init__(self, path = DEFAULT_STATE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread = False)
+        with self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS fingerprints (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )"""
+            )
+
+    def get_fingerprint(self, key):
+        """
+        Returns the stored fingerprint for a key, or None if it was never published.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fingerprint FROM fingerprints WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_fingerprints(self, fingerprints):
+        """
+        Saves a dictionary of key -> fingerprint.
+        """
+        updated_at = datetime.now(timezone.utc).isoformat()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO fingerprints (key, fingerprint, updated_at) VALUES (?, ?, ?)",
+                [(key, fingerprint, updated_at) for key, fingerprint in fingerprints.items()]
+            )
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,159 @@
+###############################################################################
+## Synthetic survey data for the MDEB_SPATIAL benchmarks. Builds a SQLite    ##
+## stand-in for the oracle schema: spatial survey tables (geometry stored    ##
+## as WKB, a ROW_SCN change column kept by triggers) plus the layer, field   ##
+## and feature catalog tables, with configurable table, row, vertex and      ##
+## column counts.                                                            ##
+###############################################################################
+
+# IMPORT LIBRARIES
+import sqlite3
+from datetime import datetime
+import numpy as np
+import shapely
+from sqlalchemy import create_engine
+from MDEB_SPATIAL_extract import STANDIN_CHANGE_COLUMN
+
+# Spatial reference used for all synthetic geometries
+SYNTHETIC_SRID = 4269
+
+# Schema name of the SQLite database (the main database)
+SYNTHETIC_SCHEMA = "main"
+
+# Catalog table names, used in place of LYR_TABLE, FLD_TABLE and FTR_TABLE
+SYNTHETIC_TABLES = {"lyr_table": "MDEB_LAYERS", "fld_table": "MDEB_FIELDS", "ftr_table": "MDEB_FEATURES"}
+
+
+def make_polygons(rows, vertices, seed = 0):
+    """
+    Creates an array of star shaped strata polygons with the given number of vertices
+    scattered over the northeast shelf.
+    """
+    rng = np.random.default_rng(seed)
+    centers_x = rng.uniform(-76, -65, rows)
+    centers_y = rng.uniform(35, 45, rows)
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint = False)
+    radii = rng.uniform(0.05, 0.25, (rows, vertices))
+    xs = centers_x[:, None] + radii * np.cos(angles)
+    ys = centers_y[:, None] + radii * np.sin(angles)
+    rings = np.stack([xs, ys], axis = -1)
+    # Close each ring by repeating its first vertex
+    rings = np.concatenate([rings, rings[:, :1, :]], axis = 1)
+    return shapely.polygons(rings)
+
+
+def table_columns(columns):
+    """
+    Returns the attribute columns of a synthetic survey table (after OID and SURVEY_NAME):
+    alternating numeric VALUE_n and repeated text LABEL_n columns.
+    """
+    return [f"VALUE_{column}" if column % 2 else f"LABEL_{column}" for column in range(columns)]
+
+
+def write_survey_table(connection, table_name, rows, vertices, columns, seed):
+    """
+    Writes one synthetic survey table with geometry stored as SHAPE_WKB and SHAPE_SRID.
+    Like ORA_ROWSCN in oracle, the ROW_SCN column of a row is raised above every other
+    row's by triggers whenever the row is inserted or updated.
+    """
+    rng = np.random.default_rng(seed)
+    attribute_columns = table_columns(columns)
+    column_types = ", ".join(f"{column} REAL" if column.startswith("VALUE") else f"{column} TEXT" for column in attribute_columns)
+    connection.execute(
+        f"CREATE TABLE {table_name} (OID INTEGER PRIMARY KEY, SURVEY_NAME TEXT, {column_types}, SHAPE_SRID INTEGER, SHAPE_WKB BLOB, "
+        f"{STANDIN_CHANGE_COLUMN} INTEGER NOT NULL DEFAULT 0)"
+    )
+    values = [np.arange(rows).tolist(), ["Synthetic Survey"] * rows]
+    for column in attribute_columns:
+        if column.startswith("VALUE"):
+            values.append(rng.normal(size = rows).tolist())
+        else:
+            values.append(rng.choice(["STRATUM A", "STRATUM B", "STRATUM C"], rows).tolist())
+    values.append([SYNTHETIC_SRID] * rows)
+    values.append(shapely.to_wkb(make_polygons(rows, vertices, seed)).tolist())
+    values.append([1] * rows)
+    placeholders = ", ".join("?" * len(values))
+    connection.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})", zip(*values))
+
+    # rows inserted or updated later get the next change number
+    next_change = f"UPDATE {table_name} SET {STANDIN_CHANGE_COLUMN} = (SELECT MAX({STANDIN_CHANGE_COLUMN}) FROM {table_name}) + 1 WHERE rowid = NEW.rowid"
+    connection.execute(f"CREATE INDEX {table_name}_{STANDIN_CHANGE_COLUMN} ON {table_name} ({STANDIN_CHANGE_COLUMN})")
+    connection.execute(f"CREATE TRIGGER {table_name}_INSERTED AFTER INSERT ON {table_name} BEGIN {next_change}; END")
+    connection.execute(
+        f"CREATE TRIGGER {table_name}_UPDATED AFTER UPDATE ON {table_name} "
+        f"WHEN NEW.{STANDIN_CHANGE_COLUMN} = OLD.{STANDIN_CHANGE_COLUMN} BEGIN {next_change}; END"
+    )
+
+
+def update_survey_rows(path, table_name, rows, seed = 0):
+    """
+    Changes the LABEL_0 value of rows random rows of a survey table in place.
+    Returns the OIDs of the changed rows.
+    """
+    connection = sqlite3.connect(path)
+    row_count = connection.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    oids = np.random.default_rng(seed).choice(row_count, min(rows, row_count), replace = False).tolist()
+    connection.executemany(f"UPDATE {table_name} SET LABEL_0 = 'STRATUM UPDATED' WHERE OID = ?", [(oid,) for oid in oids])
+    connection.commit()
+    connection.close()
+    return oids
+
+
+def build_synthetic_database(path, base_url, services = 2, tables_per_service = 2, rows = 5000, vertices = 100, columns = 20):
+    """
+    Creates a SQLite database with services * tables_per_service survey tables and
+    the catalog tables describing them. Layer urls point at base_url (the fake AGOL server).
+    Returns a list of services, each {"service", "item_id", "tables", "strata_short"}.
+    """
+    connection = sqlite3.connect(path)
+    services_info = []
+    layer_rows, field_rows, feature_rows = [], [], []
+    rng = np.random.default_rng(7)
+    for service in range(services):
+        service_name = f"Synthetic_Survey_{service}"
+        item_id = f"{service:032x}"
+        strata_short = f"SYN{service}"
+        service_url = f"{base_url}/services/{service_name}/FeatureServer"
+        tables = []
+        for layer_index in range(tables_per_service):
+            table_name = f"SYN_{service}_{layer_index}"
+            write_survey_table(connection, table_name, rows, vertices, columns, seed = service * 100 + layer_index)
+            tables.append(table_name)
+            layer_rows.append((table_name, f"{service_url}/{layer_index}", item_id, strata_short, f"Layer {table_name} of {service_name}"))
+            for column in ["OID", "SURVEY_NAME"] + table_columns(columns):
+                field_rows.append((table_name, column, column.replace("_", " ").title(), f"Description of {column}"))
+        feature_rows.append((
+            strata_short, f"Synthetic survey {service}", f"Abstract of synthetic survey {service}", "Benchmarking",
+            "synthetic, benchmark, survey", "No restrictions", datetime(2024, 1, 1).isoformat(),
+            "Contact Name", "Contact Title", "contact@example.com", "Metadata Name", "Metadata Title", "metadata@example.com",
+            "Synthetic source", "https://example.com", 45.0, 35.0, -65.0, -76.0, service_url, item_id,
+            rng.integers(0, 256, 20000, dtype = np.uint8).tobytes(),
+        ))
+        services_info.append({"service": service_name, "item_id": item_id, "tables": tables, "strata_short": strata_short})
+
+    connection.execute(f"CREATE TABLE {SYNTHETIC_TABLES['lyr_table']} (table_name TEXT, rest_url TEXT, file_id TEXT, strata_short TEXT, abstract TEXT)")
+    connection.executemany(f"INSERT INTO {SYNTHETIC_TABLES['lyr_table']} VALUES (?, ?, ?, ?, ?)", layer_rows)
+    connection.execute(f"CREATE TABLE {SYNTHETIC_TABLES['fld_table']} (table_name TEXT, col_name TEXT, col_alias TEXT, col_description TEXT)")
+    connection.executemany(f"INSERT INTO {SYNTHETIC_TABLES['fld_table']} VALUES (?, ?, ?, ?)", field_rows)
+    connection.execute(
+        f"""CREATE TABLE {SYNTHETIC_TABLES['ftr_table']} (
+            strata_short TEXT, survey_name TEXT, abstract TEXT, purpose TEXT, tags TEXT, useterms TEXT, publish_date TEXT,
+            contact_name TEXT, contact_title TEXT, contact_email TEXT, meta_contact_name TEXT, meta_contact_title TEXT,
+            meta_contact_email TEXT, source TEXT, link TEXT, geoextent_n REAL, geoextent_s REAL, geoextent_e REAL,
+            geoextent_w REAL, rest_url TEXT, file_id TEXT, thumbnail BLOB
+        )"""
+    )
+    connection.executemany(f"INSERT INTO {SYNTHETIC_TABLES['ftr_table']} VALUES ({', '.join('?' * 22)})", feature_rows)
+    connection.commit()
+    connection.close()
+    return services_info
+
+
+def create_synthetic_engine(path, pool_size = 1):
+    """
+    Creates a SQL alchemy engine for the synthetic database, usable from several threads.
+    """
+    return create_engine(
+        f"sqlite:///{path}", pool_size = pool_size, max_overflow = 0,
+        connect_args = {"check_same_thread": False}
+    )
@@ -0,0 +1,34 @@
+# The MDEB_SPATIAL scripts are flat modules in python/, imported by name
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from MDEB_SPATIAL_catalog import Catalog
+from MDEB_SPATIAL_fakeagol import FakeAGOLServer, FakeGIS
+from MDEB_SPATIAL_synthetic import SYNTHETIC_SCHEMA, SYNTHETIC_TABLES, table_columns, build_synthetic_database, create_synthetic_engine
+
+SYNTHETIC_COLUMNS = 4
+
+
+@pytest.fixture
+def synthetic_agol(tmp_path):
+    """
+    A small synthetic catalog (2 services of 2 tables) with its services published
+    on a fake AGOL server.
+    """
+    server = FakeAGOLServer().start()
+    database_path = str(tmp_path / "synthetic.sqlite")
+    services = build_synthetic_database(database_path, server.base_url, services = 2, tables_per_service = 2, rows = 10, vertices = 5, columns = SYNTHETIC_COLUMNS)
+    for service in services:
+        server.add_service(service["item_id"], service["service"], [
+            (table_name, ["OID", "SURVEY_NAME"] + table_columns(SYNTHETIC_COLUMNS)) for table_name in service["tables"]
+        ])
+    engine = create_synthetic_engine(database_path)
+    catalog = Catalog.load(engine, schema = SYNTHETIC_SCHEMA, **SYNTHETIC_TABLES)
+    yield SimpleNamespace(server = server, gis = FakeGIS(server.base_url), engine = engine, catalog = catalog,
+                          services = services, database_path = database_path)
+    engine.dispose()
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,263 @@
+import random
+import time
+import pytest
+import requests
+import MDEB_SPATIAL_agol as agol
+from MDEB_SPATIAL_agol import MAX_RETRY_DELAY, HostRateLimiter, ItemCache, call_with_retry, is_transient_error, update_layers
+from MDEB_SPATIAL_fakeagol import FakeAGOLServer, FakeFeatureLayer, FakeFeatureLayerCollection
+from MDEB_SPATIAL_instrument import metrics
+
+
+@pytest.fixture
+def fake_agol():
+    server = FakeAGOLServer().start()
+    server.add_service("0" * 32, "Synthetic_Survey_0", [("SYN_0_0", ["OID", "SURVEY_NAME"])])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def zip_file(tmp_path):
+    path = tmp_path / "Synthetic_Survey_0.zip"
+    path.write_bytes(b"zipped file geodatabase")
+    return str(path)
+
+
+class RecordingTime:
+    """
+    Stands in for the time module in MDEB_SPATIAL_agol, recording waits instead of sleeping.
+    """
+
+    def __init__(self):
+        self.waits = []
+
+    def sleep(self, seconds):
+        self.waits.append(seconds)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class NoJitter:
+    def uniform(self, low, high):
+        return 1.0
+
+    def __getattr__(self, name):
+        return getattr(random, name)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Records the retry waits instead of sleeping, without jitter.
+    """
+    recording_time = RecordingTime()
+    monkeypatch.setattr(agol, "time", recording_time)
+    monkeypatch.setattr(agol, "random", NoJitter())
+    return recording_time.waits
+
+
+def overwrite(server, service_name, zip_file):
+    flc = FakeFeatureLayerCollection(f"{server.base_url}/services/{service_name}/FeatureServer")
+    return flc.manager.overwrite(zip_file)
+
+
+@pytest.mark.parametrize("status", [503, 429])
+def test_transient_overwrite_failures_are_retried(fake_agol, zip_file, sleeps, status):
+    fake_agol.failure_rate = 0.5
+    fake_agol.failure_status = status
+    metrics.reset()
+    attempts = []
+    for _ in range(20):
+        result, attempt = call_with_retry(overwrite, fake_agol, "Synthetic_Survey_0", zip_file, retries = 10, base_delay = 1)
+        assert result == {"success": True}
+        attempts.append(attempt)
+
+    assert fake_agol.failures["overwrite_service"] > 0
+    assert fake_agol.requests["overwrite_service"] == sum(attempts)
+    assert metrics.counters["agol.retries"] == sum(attempts) - len(attempts) == fake_agol.failures["overwrite_service"]
+    assert len(sleeps) == fake_agol.failures["overwrite_service"]
+    metrics.reset()
+
+
+def test_retries_back_off_up_to_the_limit(fake_agol, zip_file, sleeps):
+    fake_agol.failure_rate = 1.0
+    base_delay = MAX_RETRY_DELAY / 3
+    with pytest.raises(requests.exceptions.HTTPError) as error:
+        call_with_retry(overwrite, fake_agol, "Synthetic_Survey_0", zip_file, retries = 4, base_delay = base_delay)
+
+    assert error.value.response.status_code == 503
+    assert fake_agol.requests["overwrite_service"] == 5
+    # the wait doubles after every attempt and never exceeds MAX_RETRY_DELAY
+    assert sleeps == pytest.approx([base_delay, 2 * base_delay, MAX_RETRY_DELAY, MAX_RETRY_DELAY])
+
+
+def test_retry_jitter_stays_within_twenty_percent(monkeypatch):
+    recording_time = RecordingTime()
+    monkeypatch.setattr(agol, "time", recording_time)
+    waits = recording_time.waits
+
+    def always_fails():
+        raise requests.exceptions.ConnectionError("connection reset")
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        call_with_retry(always_fails, retries = 20, base_delay = 10)
+    assert len(waits) == 20
+    assert all(8 <= wait <= 1.2 * MAX_RETRY_DELAY for wait in waits)
+    assert max(waits) >= 0.8 * MAX_RETRY_DELAY
+
+
+def test_non_transient_errors_are_not_retried(fake_agol, zip_file, sleeps):
+    # an unknown service answers 404
+    with pytest.raises(requests.exceptions.HTTPError) as error:
+        call_with_retry(overwrite, fake_agol, "Unknown_Service", zip_file, retries = 3, base_delay = 1)
+    assert error.value.response.status_code == 404
+    assert fake_agol.requests["overwrite_service"] == 1
+
+    # a missing zip file fails before any request is sent
+    with pytest.raises(FileNotFoundError):
+        call_with_retry(overwrite, fake_agol, "Synthetic_Survey_0", zip_file + ".missing", retries = 3, base_delay = 1)
+    assert fake_agol.requests["overwrite_service"] == 1
+    assert sleeps == []
+
+
+@pytest.mark.parametrize("message, transient", [
+    ("Error Code: 503", True),
+    ("429 Client Error: Too Many Requests", True),
+    ("The read operation timed out", True),
+    ("Error Code: 400 Invalid parameters", False),
+    ("Item does not exist or is inaccessible", False),
+])
+def test_transient_messages(message, transient):
+    assert is_transient_error(Exception(message)) is transient
+
+
+@pytest.fixture
+def fake_layers():
+    server = FakeAGOLServer(failure_rate = 0.3, seed = 1, flaky_routes = {"update_layer_definition"}).start()
+    server.add_service("0" * 32, "Synthetic_Survey_0", [(f"SYN_0_{layer}", ["OID"]) for layer in range(8)])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def layer_jobs(server, layers):
+    base_url = f"{server.base_url}/services/Synthetic_Survey_0/FeatureServer"
+    return [(f"SYN_0_{layer}", f"{base_url}/{layer}", {"description": f"Layer {layer}"}) for layer in layers]
+
+
+def test_layer_updates_respect_the_rate_limit(fake_layers):
+    fake_layers.failure_rate = 0
+    rate = 40
+    started = []
+
+    def update_layer(url, properties):
+        started.append(time.monotonic())
+        return FakeFeatureLayer(url).manager.update_definition(properties)
+
+    results = update_layers(layer_jobs(fake_layers, range(8)) * 2, update_layer, workers = 8, rate_limiter = HostRateLimiter(rate))
+    assert all(result.success for result in results)
+    assert fake_layers.requests["update_layer_definition"] == 16
+    # 8 workers, but the 16 requests to the host start at most rate per second
+    assert max(started) - min(started) >= 14 / rate
+
+
+def test_failed_layers_do_not_stop_the_others(fake_layers):
+    def update_layer(url, properties):
+        if url.endswith("/3"):
+            return {"success": False, "error": "rejected"}
+        return FakeFeatureLayer(url).manager.update_definition(properties)
+
+    # layer 9 does not exist (404, not retried), 503s of the other layers are retried
+    results = update_layers(layer_jobs(fake_layers, [0, 1, 2, 3, 4, 5, 6, 7, 9]), update_layer, workers = 4, retries = 10, base_delay = 0.001)
+    assert [result.name for result in results] == [f"SYN_0_{layer}" for layer in [0, 1, 2, 3, 4, 5, 6, 7, 9]]
+    failed = {result.name: result for result in results if not result.success}
+    assert set(failed) == {"SYN_0_3", "SYN_0_9"}
+    assert "rejected" in failed["SYN_0_3"].message
+    # the 404 ends the retries of layer 9 early
+    assert "404" in failed["SYN_0_9"].message and failed["SYN_0_9"].attempts < 11
+    assert fake_layers.failures["update_layer_definition"] > 0
+    assert sum(result.attempts for result in results if result.name != "SYN_0_3") == fake_layers.requests["update_layer_definition"]
+    assert any(result.attempts > 1 for result in results)
+    layer_definitions = [FakeFeatureLayer(url).properties for _, url, _ in layer_jobs(fake_layers, range(8))]
+    assert [definition["description"] for definition in layer_definitions] == [f"Layer {layer}" if layer != 3 else "" for layer in range(8)]
+
+
+def test_item_cache_counts_hits_and_misses(synthetic_agol):
+    server = synthetic_agol.server
+    item_id = synthetic_agol.services[0]["item_id"]
+    item_cache = ItemCache(synthetic_agol.gis)
+
+    assert item_cache.get_item(item_id).title == "Synthetic_Survey_0"
+    assert item_cache.get_item(item_id).title == "Synthetic_Survey_0"
+    assert (item_cache.hits, item_cache.misses) == (1, 1)
+    assert server.requests["get_item"] == 1
+
+    # the first layer lookup (a miss, reusing the cached item) fetches the definitions of
+    # both layers, the second one is a hit
+    assert item_cache.get_layer_properties(item_id, 0)["name"] == "SYN_0_0"
+    assert item_cache.get_layer_properties(item_id, 1)["name"] == "SYN_0_1"
+    assert server.requests["get_item"] == 1
+    assert "3 hits, 2 misses" in item_cache.summary()
+
+
+def test_item_cache_invalidate_fetches_the_item_again(synthetic_agol):
+    server = synthetic_agol.server
+    first_item, second_item = (service["item_id"] for service in synthetic_agol.services)
+    item_cache = ItemCache(synthetic_agol.gis)
+    for item_id in (first_item, second_item):
+        item_cache.get_layer_properties(item_id, 0)
+    server.reset_counts()
+
+    FakeFeatureLayer(f"{server.base_url}/services/Synthetic_Survey_0/FeatureServer/0").manager.update_definition({"description": "Changed"})
+    assert item_cache.get_layer_properties(first_item, 0)["description"] == ""
+    item_cache.invalidate(first_item)
+    assert item_cache.get_layer_properties(first_item, 0)["description"] == "Changed"
+    assert server.requests["get_item"] == 1 and server.requests["get_service_layers"] == 1
+
+    # the other item is still cached
+    item_cache.get_item(second_item)
+    item_cache.get_layer_properties(second_item, 1)
+    assert server.requests["get_item"] == 1 and server.requests["get_service_layers"] == 1
+
+
+def test_one_layers_request_replaces_the_layer_requests(synthetic_agol):
+    server = synthetic_agol.server
+    item_id = synthetic_agol.services[0]["item_id"]
+    item_cache = ItemCache(synthetic_agol.gis)
+    layers = [item_cache.get_layer_properties(item_id, layer_index) for layer_index in range(2)]
+    assert [layer["name"] for layer in layers] == ["SYN_0_0", "SYN_0_1"]
+    assert server.requests["get_service_layers"] == 1 and server.requests["get_layer"] == 0
+
+
+class FailingSession:
+    def __init__(self, response = None):
+        self.response = response
+
+    def get(self, url, params = None):
+        if self.response is None:
+            raise requests.exceptions.ConnectionError("connection reset")
+        return self.response
+
+
+class ErrorResponse:
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"error": {"code": 400, "message": "Invalid URL"}}
+
+
+@pytest.mark.parametrize("session", [FailingSession(), FailingSession(ErrorResponse())])
+def test_unreadable_layers_are_fetched_one_by_one(synthetic_agol, session):
+    server = synthetic_agol.server
+    item_id = synthetic_agol.services[0]["item_id"]
+    synthetic_agol.gis.session = session
+    item_cache = ItemCache(synthetic_agol.gis)
+    layers = [item_cache.get_layer_properties(item_id, layer_index) for layer_index in range(2)]
+    assert [layer["name"] for layer in layers] == ["SYN_0_0", "SYN_0_1"]
+    assert server.requests["get_layer"] == 2
+    # the failed /layers lookup is not repeated
+    item_cache.get_layer_properties(item_id, 1)
+    assert server.requests["get_layer"] == 2
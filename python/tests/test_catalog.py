@@ -0,0 +1,31 @@
+import pytest
+from MDEB_SPATIAL_catalog import Catalog
+from MDEB_SPATIAL_synthetic import SYNTHETIC_SCHEMA, SYNTHETIC_TABLES, build_synthetic_database, create_synthetic_engine
+
+
+@pytest.fixture
+def synthetic_engine(tmp_path, monkeypatch):
+    for name in ("SCHEMA", "LYR_TABLE", "FLD_TABLE", "FTR_TABLE"):
+        monkeypatch.delenv(name, raising = False)
+    database_path = str(tmp_path / "synthetic.sqlite")
+    build_synthetic_database(database_path, "http://127.0.0.1", services = 2, tables_per_service = 2, rows = 10, vertices = 5, columns = 2)
+    engine = create_synthetic_engine(database_path)
+    yield engine
+    engine.dispose()
+
+
+def test_catalog_adds_service_names(synthetic_engine):
+    catalog = Catalog.load(synthetic_engine, SYNTHETIC_SCHEMA, **SYNTHETIC_TABLES)
+    assert catalog.df_layers['service_name'].tolist() == ["Synthetic_Survey_0"] * 2 + ["Synthetic_Survey_1"] * 2
+    assert len(catalog.df_fields) == 16 and len(catalog.df_features) == 2
+
+
+def test_catalog_without_feature_table(synthetic_engine):
+    catalog = Catalog.load(synthetic_engine, SYNTHETIC_SCHEMA, SYNTHETIC_TABLES["lyr_table"], SYNTHETIC_TABLES["fld_table"])
+    assert catalog.df_features is None
+    assert len(catalog.df_layers) == 4
+
+
+def test_catalog_requires_a_layer_table(synthetic_engine):
+    with pytest.raises(ValueError, match = "LYR_TABLE"):
+        Catalog.load(synthetic_engine, SYNTHETIC_SCHEMA, fld_table = SYNTHETIC_TABLES["fld_table"])
@@ -0,0 +1,150 @@
+import sqlite3
+import pytest
+import shapely
+from shapely.geometry import Point
+import MDEB_SPATIAL_dataupdate as dataupdate
+from MDEB_SPATIAL_agol import ItemCache
+from MDEB_SPATIAL_catalog import Catalog
+from MDEB_SPATIAL_dataupdate import update_data
+from MDEB_SPATIAL_fakeagol import FakeAGOLServer, FakeGIS, FakeFeatureLayerCollection
+from MDEB_SPATIAL_state import StateStore
+from MDEB_SPATIAL_synthetic import SYNTHETIC_SCHEMA, SYNTHETIC_TABLES, table_columns, build_synthetic_database, update_survey_rows, create_synthetic_engine
+
+ROWS = 300
+COLUMNS = 4
+
+
+@pytest.fixture
+def publishing(tmp_path, monkeypatch):
+    """
+    A synthetic database with one service of two tables, published once to a fake AGOL server.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("STATE_DB", str(tmp_path / "state.sqlite"))
+    monkeypatch.setenv("SNAPSHOT_FOLDER", str(tmp_path / "snapshots"))
+    monkeypatch.setenv("UPLOAD_RETRY_DELAY", "0")
+    server = FakeAGOLServer().start()
+    database_path = str(tmp_path / "synthetic.sqlite")
+    services = build_synthetic_database(database_path, server.base_url, services = 1, tables_per_service = 2, rows = ROWS, vertices = 8, columns = COLUMNS)
+    service = services[0]
+    server.add_service(service["item_id"], service["service"], [
+        (table_name, ["OID", "SURVEY_NAME"] + table_columns(COLUMNS)) for table_name in service["tables"]
+    ])
+    engine = create_synthetic_engine(database_path, pool_size = 2)
+    catalog = Catalog.load(engine, schema = SYNTHETIC_SCHEMA, **SYNTHETIC_TABLES)
+    gis = FakeGIS(server.base_url)
+
+    def publish(delta = True):
+        summary = update_data(gis, engine, catalog, item_cache = ItemCache(gis), delta = delta, collection_type = FakeFeatureLayerCollection)
+        assert summary.failed == []
+        return summary
+
+    publish(delta = False)
+    yield server, database_path, service, publish
+    engine.dispose()
+    server.shutdown()
+    server.server_close()
+
+
+def layer_rows(server, service_name, layer_index):
+    """
+    Returns OID -> (LABEL_0, has geometry) of every feature of a layer.
+    """
+    return {
+        int(feature["attributes"]["OID"]): (feature["attributes"]["LABEL_0"], feature["geometry"] is not None)
+        for feature in server.layer_features(service_name, layer_index)
+    }
+
+
+def table_rows(database_path, table_name):
+    with sqlite3.connect(database_path) as connection:
+        rows = connection.execute(f"SELECT OID, LABEL_0, SHAPE_WKB IS NOT NULL FROM {table_name}").fetchall()
+    return {oid: (label, bool(has_geometry)) for oid, label, has_geometry in rows}
+
+
+def test_overwrite_loads_every_row(publishing):
+    server, database_path, service, publish = publishing
+    for layer_index, table_name in enumerate(service["tables"]):
+        assert layer_rows(server, service["service"], layer_index) == table_rows(database_path, table_name)
+    assert server.requests["overwrite_service"] == 1
+
+
+def test_delta_sends_only_the_changed_rows(publishing):
+    server, database_path, service, publish = publishing
+    table_name = service["tables"][0]
+    changed_oids = update_survey_rows(database_path, table_name, 5)
+    with sqlite3.connect(database_path) as connection:
+        connection.execute(f"DELETE FROM {table_name} WHERE OID = ?", (next(oid for oid in range(ROWS) if oid not in changed_oids),))
+        connection.execute(f"UPDATE {table_name} SET SHAPE_WKB = NULL WHERE OID = ?", (changed_oids[0],))
+        connection.execute(
+            f"INSERT INTO {table_name} (OID, SURVEY_NAME, LABEL_0, VALUE_1, LABEL_2, VALUE_3, SHAPE_SRID, SHAPE_WKB) "
+            f"VALUES (?, 'Synthetic Survey', 'STRATUM NEW', 1.0, 'STRATUM A', 2.0, 4269, ?)",
+            (ROWS, shapely.to_wkb(Point(-70, 40).buffer(0.1)))
+        )
+    server.reset_counts()
+
+    publish()
+    assert server.requests["overwrite_service"] == 0
+    # one delete, one update and one add request for the changed table only
+    assert server.requests["apply_edits"] == 3
+    for layer_index, table_name in enumerate(service["tables"]):
+        assert layer_rows(server, service["service"], layer_index) == table_rows(database_path, table_name)
+
+    # nothing changed since
+    server.reset_counts()
+    publish()
+    assert server.requests["apply_edits"] == 0 and server.requests["overwrite_service"] == 0
+
+
+def test_delta_falls_back_to_an_overwrite_before_editing(publishing):
+    server, database_path, service, publish = publishing
+    table_name = service["tables"][0]
+    changed_oids = update_survey_rows(database_path, table_name, 5)
+    with sqlite3.connect(database_path) as connection:
+        connection.execute(f"DELETE FROM {table_name} WHERE OID = ?", (next(oid for oid in range(ROWS) if oid not in changed_oids),))
+    # a changed row was removed from the layer, the layer no longer matches the published snapshot
+    missing = [feature["attributes"]["OBJECTID"] for feature in server.layer_features(service["service"], 0)
+               if int(feature["attributes"]["OID"]) == changed_oids[0]]
+    server.delete_features(service["service"], 0, missing)
+    server.reset_counts()
+
+    publish()
+    # nothing was edited, the service was rebuilt from the snapshots and overwritten
+    assert server.requests["apply_edits"] == 0
+    assert server.requests["overwrite_service"] == 1
+    for layer_index, table_name in enumerate(service["tables"]):
+        assert layer_rows(server, service["service"], layer_index) == table_rows(database_path, table_name)
+
+
+def test_delta_overwrites_a_service_with_a_table_without_fingerprint(publishing, monkeypatch):
+    server, database_path, service, publish = publishing
+    update_survey_rows(database_path, service["tables"][0], 5)
+    table_fingerprint = dataupdate.table_fingerprint
+
+    def fingerprint_or_fail(connection, schema, table_name, *args):
+        if table_name == service["tables"][1]:
+            raise RuntimeError("fingerprint query failed")
+        return table_fingerprint(connection, schema, table_name, *args)
+
+    monkeypatch.setattr(dataupdate, "table_fingerprint", fingerprint_or_fail)
+    server.reset_counts()
+
+    publish()
+    assert server.requests["apply_edits"] == 0
+    assert server.requests["overwrite_service"] == 1
+    for layer_index, table_name in enumerate(service["tables"]):
+        assert layer_rows(server, service["service"], layer_index) == table_rows(database_path, table_name)
+
+
+def test_run_report_lists_archive_sizes(capsys, publishing, tmp_path):
+    # (capsys is set up first, so the report of the fixture's first publish is captured)
+    server, database_path, service, publish = publishing
+    state_store = StateStore(str(tmp_path / "state.sqlite"))
+    first_size = int(state_store.get_fingerprint(f"archive/{service['service']}"))
+    state_store.close()
+    assert first_size > 0
+    assert f"{service['service']}: unknown -> {first_size / 1e6:.2f} MB" in capsys.readouterr().out
+
+    update_survey_rows(database_path, service["tables"][0], 5)
+    publish(delta = False)
+    assert f"{service['service']}: {first_size / 1e6:.2f} MB -> " in capsys.readouterr().out
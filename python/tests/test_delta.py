@@ -0,0 +1,68 @@
+import geopandas as gpd
+from shapely.geometry import Point
+from MDEB_SPATIAL_delta import diff_tables, lookup_object_ids, sql_literal
+
+
+def make_table(rows):
+    """
+    rows: list of (OID, LABEL, geometry)
+    """
+    oids, labels, geometries = zip(*rows)
+    return gpd.GeoDataFrame({"OID": list(oids), "LABEL": list(labels)}, geometry = list(geometries), crs = "EPSG:4269")
+
+
+def test_diff_tables_finds_adds_updates_and_deletes():
+    old = make_table([(1, "A", Point(0, 0)), (2, "B", Point(1, 1)), (3, "C", Point(2, 2)), (4, "D", Point(3, 3))])
+    new = make_table([(1, "A", Point(0, 0)), (2, "B2", Point(1, 1)), (3, "C", Point(5, 5)), (5, "E", Point(4, 4))])
+    table_delta = diff_tables(old, new)
+    assert list(table_delta.adds.index) == [5]
+    assert list(table_delta.updates.index) == [2, 3]
+    assert table_delta.deletes == [4]
+
+
+def test_diff_tables_null_geometries_are_unchanged():
+    old = make_table([(1, "A", None), (2, "B", None), (3, None, Point(0, 0))])
+    new = make_table([(1, "A", None), (2, "B", Point(1, 1)), (3, None, Point(0, 0))])
+    table_delta = diff_tables(old, new)
+    assert list(table_delta.updates.index) == [2]
+    assert table_delta.adds.empty and table_delta.deletes == []
+
+
+def test_diff_tables_needs_matching_schema_and_unique_keys():
+    table = make_table([(1, "A", Point(0, 0)), (2, "B", Point(1, 1))])
+    assert diff_tables(table, table.drop(columns = "LABEL")) is None
+    assert diff_tables(table, table.to_crs("EPSG:4326")) is None
+    assert diff_tables(table, make_table([(1, "A", Point(0, 0)), (1, "B", Point(1, 1))])) is None
+    assert diff_tables(None, table) is None
+
+
+def test_sql_literal_escapes_quotes():
+    assert sql_literal("O'Brien") == "'O''Brien'"
+    assert sql_literal("A") == "'A'"
+    assert sql_literal(12) == "12"
+
+
+class StubFeature:
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+
+class StubFeatureSet:
+    def __init__(self, features):
+        self.features = features
+
+
+class StubLayer:
+    def __init__(self):
+        self.queries = []
+
+    def query(self, where, out_fields, return_geometry):
+        self.queries.append(where)
+        return StubFeatureSet([StubFeature({"OBJECTID": 7, "OID": "O'Brien"})])
+
+
+def test_lookup_object_ids_quotes_string_keys():
+    layer = StubLayer()
+    object_ids = lookup_object_ids(layer, ["O'Brien", "A"], "OBJECTID", chunk_size = 10)
+    assert layer.queries == ["OID IN ('O''Brien', 'A')"]
+    assert object_ids == {"O'Brien": 7}
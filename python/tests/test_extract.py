@@ -0,0 +1,220 @@
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyogrio
+import pytest
+import shapely
+from shapely.geometry import Point
+from sqlalchemy import event, text
+from MDEB_SPATIAL_delta import diff_tables, read_snapshot_table
+from MDEB_SPATIAL_extract import (
+    ARROW_STRING, build_table_query, table_fingerprint, read_table_chunks, start_table_extraction, plan_dtypes, compact_dtypes,
+    compact_batches, generalize_geometry, get_source_dtypes, write_table_to_fgdb
+)
+from MDEB_SPATIAL_instrument import metrics
+from MDEB_SPATIAL_snapshot import SnapshotStore
+from MDEB_SPATIAL_synthetic import SYNTHETIC_SCHEMA, SYNTHETIC_SRID, make_polygons, table_columns, build_synthetic_database, update_survey_rows, create_synthetic_engine
+
+ROWS = 1200
+COLUMNS = 6
+POOL_SIZE = 2
+
+
+@pytest.fixture
+def synthetic_database(tmp_path):
+    database_path = str(tmp_path / "synthetic.sqlite")
+    services = build_synthetic_database(database_path, "http://127.0.0.1", services = 2, tables_per_service = 3, rows = ROWS, vertices = 12, columns = COLUMNS)
+    return database_path, services
+
+
+def read_serially(engine, table_name):
+    query = build_table_query(SYNTHETIC_SCHEMA, table_name, ["OID", "SURVEY_NAME"] + table_columns(COLUMNS), dialect = "sqlite")
+    with engine.connect() as connection:
+        return pd.concat(read_table_chunks(connection, query, chunk_size = 500), ignore_index = True)
+
+
+def test_concurrent_extraction_matches_serial_read(synthetic_database, tmp_path):
+    database_path, services = synthetic_database
+    engine = create_synthetic_engine(database_path, pool_size = POOL_SIZE)
+
+    # track the connections checked out of the pool at the same time
+    checked_out = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(*args):
+        with lock:
+            checked_out["now"] += 1
+            checked_out["max"] = max(checked_out["max"], checked_out["now"])
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(*args):
+        with lock:
+            checked_out["now"] -= 1
+
+    # the tables of a service share a file geodatabase
+    columns = ["OID", "SURVEY_NAME"] + table_columns(COLUMNS)
+    jobs = [
+        (table_name, columns, str(tmp_path / f"{service['service']}.gdb"))
+        for service in services
+        for table_name in service["tables"]
+    ]
+    with ThreadPoolExecutor(max_workers = 4) as executor:
+        futures = start_table_extraction(executor, engine, SYNTHETIC_SCHEMA, jobs, chunk_size = 500)
+        results = [future.result() for future in futures]
+
+    assert results == [ROWS] * len(jobs)
+    assert 0 < checked_out["max"] <= POOL_SIZE
+
+    for table_name, _, fgdb_path in jobs:
+        expected = read_serially(engine, table_name)
+        written = gpd.read_file(fgdb_path, layer = table_name).sort_values("OID", ignore_index = True)
+        assert list(written.columns) == list(expected.columns)
+        pd.testing.assert_frame_equal(
+            pd.DataFrame(written.drop(columns = written.geometry.name)), pd.DataFrame(expected.drop(columns = expected.geometry.name)),
+            check_dtype = False
+        )
+        # the file geodatabase stores multipolygons with its own ring order, compare the shapes
+        assert written.geometry.symmetric_difference(expected.geometry).area.max() < 1e-9
+    engine.dispose()
+
+
+def make_batch(oids, labels, codes):
+    return gpd.GeoDataFrame(
+        {"OID": oids, "LABEL": pd.Series(labels, dtype = object), "CODE": codes},
+        geometry = [Point(oid, oid) for oid in oids], crs = "EPSG:4269"
+    )
+
+
+def test_compact_dtypes_are_chosen_once_per_table():
+    # LABEL repeats in the first batch only, every batch still gets a categorical
+    batches = [
+        make_batch([0, 1, 2, 3], ["A", "A", "B", "A"], [1, 2, 3, 4]),
+        make_batch([4, 5, 6, 7], ["C", "D", "E", None], [5, 6, 7, 8]),
+    ]
+    compacted = list(compact_batches(batches, "SYN_0_0", {"CODE": "Int16"}))
+    for gdf in compacted:
+        assert isinstance(gdf["LABEL"].dtype, pd.CategoricalDtype)
+        assert gdf["CODE"].dtype == "Int16"
+        assert gdf["OID"].dtype == "int64"
+    assert compacted[1]["LABEL"].isna().tolist() == [False, False, False, True]
+
+
+def test_text_columns_with_many_values_become_arrow_strings():
+    batch = make_batch([0, 1, 2, 3], ["A", "B", "C", "D"], [1, 2, 3, 4])
+    dtypes = plan_dtypes(batch)
+    assert dtypes == {"LABEL": ARROW_STRING}
+    memory_before, memory_after = compact_dtypes(batch, dtypes)
+    assert batch["LABEL"].dtype == ARROW_STRING
+    assert memory_before > 0 and memory_after > 0
+
+
+def test_declared_integer_dtype_is_only_applied_when_values_fit():
+    batch = make_batch([0, 1], ["A", "A"], [1, 40000])
+    with pytest.warns(UserWarning, match = "does not fit"):
+        compact_dtypes(batch, plan_dtypes(batch, {"CODE": "int16"}))
+    assert batch["CODE"].dtype == "int64"
+
+
+def test_compacted_snapshot_parts_read_back_as_one_categorical(tmp_path):
+    batches = [
+        make_batch([0, 1, 2, 3], ["A", "A", "B", "A"], [1, 2, 3, 4]),
+        make_batch([4, 5, 6, 7], ["C", "C", "C", "D"], [5, 6, 7, 8]),
+    ]
+    snapshot_store = SnapshotStore(str(tmp_path))
+    list(snapshot_store.save("SYN_0_0", "a", compact_batches(batches, "SYN_0_0")))
+    old = read_snapshot_table(snapshot_store, "SYN_0_0", "a")
+    assert isinstance(old["LABEL"].dtype, pd.CategoricalDtype)
+    assert old["LABEL"].tolist() == ["A", "A", "B", "A", "C", "C", "C", "D"]
+
+    new = old.copy()
+    new["LABEL"] = new["LABEL"].cat.add_categories("Z")
+    new.loc[5, "LABEL"] = "Z"
+    table_delta = diff_tables(old, new)
+    assert list(table_delta.updates.index) == [5]
+
+
+def table_fingerprint_after(engine, fingerprint, statement):
+    with engine.begin() as connection:
+        connection.execute(text(statement))
+    return fingerprint()
+
+
+def test_fingerprint_changes_with_every_insert_update_and_delete(synthetic_database):
+    database_path, services = synthetic_database
+    table_name = services[0]["tables"][0]
+    columns = ["OID", "SURVEY_NAME"] + table_columns(COLUMNS)
+    engine = create_synthetic_engine(database_path)
+
+    def fingerprint():
+        with engine.connect() as connection:
+            return table_fingerprint(connection, SYNTHETIC_SCHEMA, table_name, columns)
+
+    fingerprints = [fingerprint()]
+    assert fingerprint() == fingerprints[0]
+    fingerprints.append(table_fingerprint_after(engine, fingerprint, f"UPDATE {table_name} SET VALUE_1 = 0 WHERE OID = 10"))
+    # an update of a row that was already the latest change
+    fingerprints.append(table_fingerprint_after(engine, fingerprint, f"UPDATE {table_name} SET VALUE_1 = 1 WHERE OID = 10"))
+    fingerprints.append(table_fingerprint_after(engine, fingerprint, f"DELETE FROM {table_name} WHERE OID = 20"))
+    fingerprints.append(table_fingerprint_after(
+        engine, fingerprint, f"INSERT INTO {table_name} (OID, SURVEY_NAME, SHAPE_SRID) VALUES (20, 'Synthetic Survey', 4269)"
+    ))
+    assert len(set(fingerprints)) == len(fingerprints)
+
+    # updated rows of the other tables do not change this table's fingerprint
+    update_survey_rows(database_path, services[0]["tables"][1], 5)
+    assert fingerprint() == fingerprints[-1]
+    assert update_survey_rows(database_path, table_name, 5)
+    assert fingerprint() != fingerprints[-1]
+    engine.dispose()
+
+
+
+def test_numeric_column_null_in_the_first_batch_keeps_its_type(synthetic_database, tmp_path):
+    database_path, services = synthetic_database
+    table_name = services[0]["tables"][0]
+    with sqlite3.connect(database_path) as connection:
+        connection.execute(f"UPDATE {table_name} SET VALUE_1 = NULL WHERE OID < 500")
+    engine = create_synthetic_engine(database_path)
+    columns = ["OID", "SURVEY_NAME"] + table_columns(COLUMNS)
+    fgdb_path = str(tmp_path / "Synthetic_Survey_0.gdb")
+    with engine.connect() as connection:
+        assert get_source_dtypes(connection, SYNTHETIC_SCHEMA, table_name)["VALUE_1"] == "float64"
+        rows_written = write_table_to_fgdb(connection, SYNTHETIC_SCHEMA, table_name, columns, fgdb_path, chunk_size = 500)
+        expected = pd.read_sql(f"SELECT OID, VALUE_1 FROM {table_name} ORDER BY OID", connection)
+    engine.dispose()
+
+    assert rows_written == ROWS
+    layer_info = pyogrio.read_info(fgdb_path, layer = table_name)
+    assert dict(zip(layer_info["fields"], layer_info["dtypes"]))["VALUE_1"] == "float64"
+    written = gpd.read_file(fgdb_path, layer = table_name).sort_values("OID", ignore_index = True)
+    assert written["VALUE_1"].isna().sum() == 500
+    assert np.allclose(written["VALUE_1"], expected["VALUE_1"], equal_nan = True)
+
+
+@pytest.mark.parametrize("tolerance, precision", [(0.01, None), (None, 2), (0.01, 3)])
+def test_generalization_drops_vertices_and_keeps_geometries_valid(tolerance, precision):
+    polygons = make_polygons(200, 100)
+    gdf = gpd.GeoDataFrame({"OID": range(200)}, geometry = polygons, crs = f"EPSG:{SYNTHETIC_SRID}")
+    metrics.reset()
+    generalized = generalize_geometry(gdf.copy(), tolerance, precision).geometry.to_numpy()
+
+    vertices_before = int(shapely.get_num_coordinates(polygons).sum())
+    vertices_after = int(shapely.get_num_coordinates(generalized).sum())
+    assert vertices_after < vertices_before
+    assert (metrics.counters["data.vertices_before"], metrics.counters["data.vertices_after"]) == (vertices_before, vertices_after)
+    assert shapely.is_valid(generalized).all() and not shapely.is_empty(generalized).any()
+    # the strata keep roughly their extent
+    assert np.allclose(shapely.area(generalized).sum(), shapely.area(polygons).sum(), rtol = 0.05)
+    if precision is not None:
+        coordinates = shapely.get_coordinates(generalized)
+        assert np.allclose(coordinates, np.round(coordinates, precision))
+    metrics.reset()
+
+
+def test_no_generalization_returns_the_batch_unchanged():
+    gdf = gpd.GeoDataFrame({"OID": range(5)}, geometry = make_polygons(5, 10), crs = f"EPSG:{SYNTHETIC_SRID}")
+    assert generalize_geometry(gdf) is gdf
@@ -0,0 +1,61 @@
+import sqlite3
+import pandas as pd
+import pytest
+from MDEB_SPATIAL_extract import FETCH_ENGINES, build_table_query, is_text_column
+from MDEB_SPATIAL_synthetic import SYNTHETIC_SCHEMA, SYNTHETIC_SRID, table_columns, build_synthetic_database, create_synthetic_engine
+
+COLUMNS = 6
+
+
+@pytest.fixture
+def synthetic_table(tmp_path):
+    database_path = str(tmp_path / "synthetic.sqlite")
+    services = build_synthetic_database(database_path, "http://127.0.0.1", services = 1, tables_per_service = 1, rows = 900, vertices = 12, columns = COLUMNS)
+    table_name = services[0]["tables"][0]
+    connection = sqlite3.connect(database_path)
+    # rows without geometry, text or numbers
+    connection.execute(f"UPDATE {table_name} SET SHAPE_WKB = NULL, SHAPE_SRID = NULL WHERE OID IN (3, 401, 899)")
+    connection.execute(f"UPDATE {table_name} SET LABEL_0 = NULL, VALUE_1 = NULL WHERE OID IN (5, 600)")
+    connection.commit()
+    connection.close()
+    engine = create_synthetic_engine(database_path)
+    yield engine, table_name
+    engine.dispose()
+
+
+def read_table(engine, table_name, fetch_engine):
+    query = build_table_query(SYNTHETIC_SCHEMA, table_name, ["OID", "SURVEY_NAME"] + table_columns(COLUMNS), dialect = "sqlite")
+    with engine.connect() as connection:
+        batches = list(FETCH_ENGINES[fetch_engine](connection, query, 400))
+    assert [len(gdf) for gdf in batches] == [400, 400, 100]
+    return pd.concat(batches, ignore_index = True)
+
+
+def test_arrow_engine_matches_pandas_engine(synthetic_table):
+    engine, table_name = synthetic_table
+    expected = read_table(engine, table_name, "pandas")
+    result = read_table(engine, table_name, "arrow")
+
+    assert list(result.columns) == list(expected.columns)
+    assert result.geometry.name == expected.geometry.name
+    for column in expected.columns:
+        if expected[column].dtype == object and is_text_column(expected[column]):
+            # pandas 2 reads text as python strings, the arrow engine keeps Arrow backed strings
+            assert isinstance(result[column].dtype, pd.StringDtype)
+        else:
+            assert result[column].dtype == expected[column].dtype, column
+
+    # the SRID becomes the CRS of both
+    assert result.crs == expected.crs
+    assert result.crs.to_epsg() == SYNTHETIC_SRID
+
+    assert result.geometry.isna().tolist() == expected.geometry.isna().tolist()
+    assert result.geometry.isna().sum() == 3
+    has_geometry = expected.geometry.notna()
+    assert result.geometry[has_geometry].geom_equals_exact(expected.geometry[has_geometry], tolerance = 0).all()
+    attributes = [column for column in expected.columns if column != expected.geometry.name]
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(result[attributes]).astype(object).where(result[attributes].notna(), None),
+        pd.DataFrame(expected[attributes]).astype(object).where(expected[attributes].notna(), None)
+    )
+    assert result["LABEL_0"].isna().sum() == 2 and result["VALUE_1"].isna().sum() == 2
@@ -0,0 +1,77 @@
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+from MDEB_SPATIAL_agol import ItemCache
+from MDEB_SPATIAL_catalog import Catalog
+from MDEB_SPATIAL_fieldsupdate import EMPTY_DESCRIPTION, diff_fields, index_field_catalog, update_fields
+from MDEB_SPATIAL_synthetic import SYNTHETIC_SCHEMA, SYNTHETIC_TABLES
+
+DF_FIELDS = pd.DataFrame({
+    "table_name": ["SYN_0_0"] * 3,
+    "col_name": ["DEPTH", "STRATUM", "NOTES"],
+    "col_alias": ["Depth (m)", "Stratum", np.nan],
+    "col_description": ["Water depth", np.nan, np.nan],
+})
+
+
+def live_field(name, alias, description = None):
+    return {"name": name, "type": "esriFieldTypeString", "alias": alias, "description": description}
+
+
+def test_field_catalog_normalizes_nulls():
+    field_catalog = index_field_catalog(DF_FIELDS)
+    assert list(field_catalog) == ["SYN_0_0"]
+    fields = field_catalog["SYN_0_0"]
+    assert fields["DEPTH"] == {"alias": "Depth (m)", "description": json.dumps({"value": "Water depth", "fieldValueType": ""})}
+    assert fields["STRATUM"] == {"alias": "Stratum", "description": EMPTY_DESCRIPTION}
+    assert fields["NOTES"] == {"alias": None, "description": EMPTY_DESCRIPTION}
+
+
+def test_unchanged_fields_are_left_out():
+    field_updates = index_field_catalog(DF_FIELDS)["SYN_0_0"]
+    current_fields = [
+        live_field("OBJECTID", "OBJECTID"),
+        live_field("DEPTH", "Depth (m)", field_updates["DEPTH"]["description"]),
+        live_field("STRATUM", "Stratum", None),
+        live_field("NOTES", "NOTES", ""),
+    ]
+    assert diff_fields(current_fields, field_updates) == []
+
+
+def test_changed_fields_keep_their_old_values():
+    field_updates = index_field_catalog(DF_FIELDS)["SYN_0_0"]
+    current_fields = [
+        live_field("DEPTH", "DEPTH", None),
+        live_field("STRATUM", "Stratum", json.dumps({"value": "Old description", "fieldValueType": ""})),
+        live_field("NOTES", "Notes", None),
+    ]
+    changed_fields = diff_fields(current_fields, field_updates)
+    assert [(field["name"], field["alias"], field["description"], old_alias, old_description)
+            for field, old_alias, old_description in changed_fields] == [
+        ("DEPTH", "Depth (m)", field_updates["DEPTH"]["description"], "DEPTH", None),
+        ("STRATUM", "Stratum", EMPTY_DESCRIPTION, "Stratum", current_fields[1]["description"]),
+    ]
+    # the cached definitions are not modified
+    assert current_fields[0]["alias"] == "DEPTH"
+
+
+def test_second_update_sends_nothing(synthetic_agol):
+    server = synthetic_agol.server
+    with sqlite3.connect(synthetic_agol.database_path) as connection:
+        connection.execute(f"UPDATE {SYNTHETIC_TABLES['fld_table']} SET col_alias = NULL WHERE col_name = 'LABEL_0'")
+        connection.execute(f"UPDATE {SYNTHETIC_TABLES['fld_table']} SET col_description = NULL WHERE col_name = 'VALUE_1'")
+    catalog = Catalog.load(synthetic_agol.engine, schema = SYNTHETIC_SCHEMA, **SYNTHETIC_TABLES)
+
+    field_diffs = update_fields(synthetic_agol.gis, catalog, ItemCache(synthetic_agol.gis))
+    # every field but OBJECTID changes, VALUE_1 only gets its alias
+    assert len(field_diffs) == 4 and all(len(changed_fields) == 6 for _, _, _, changed_fields in field_diffs)
+    assert server.requests["update_layer_definition"] == 4
+    layer = server.services["Synthetic_Survey_0"]["layers"][0]
+    fields = {field["name"]: field for field in layer["fields"]}
+    assert fields["LABEL_0"]["alias"] == "LABEL_0"
+    assert fields["VALUE_1"]["alias"] == "Value 1" and fields["VALUE_1"]["description"] == EMPTY_DESCRIPTION
+
+    server.reset_counts()
+    assert update_fields(synthetic_agol.gis, catalog, ItemCache(synthetic_agol.gis)) == []
+    assert server.requests["update_layer_definition"] == 0
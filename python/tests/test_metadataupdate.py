@@ -0,0 +1,69 @@
+import sqlite3
+import tempfile
+import pytest
+from MDEB_SPATIAL_agol import ItemCache
+from MDEB_SPATIAL_catalog import Catalog
+from MDEB_SPATIAL_fakeagol import FakeFeatureLayer, FakeFeatureLayerCollection
+from MDEB_SPATIAL_metadataupdate import plan_metadata, update_metadata
+from MDEB_SPATIAL_state import StateStore
+from MDEB_SPATIAL_synthetic import SYNTHETIC_SCHEMA, SYNTHETIC_TABLES
+
+
+@pytest.fixture
+def metadata_run(synthetic_agol, tmp_path, monkeypatch):
+    """
+    Runs update_metadata against the fake AGOL server, with temporary files written to
+    their own folder. Returns the server request counts of the run.
+    """
+    temp_folder = tmp_path / "temp"
+    temp_folder.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(temp_folder))
+    monkeypatch.setenv("AGOL_RATE_LIMIT", "0")
+    state_store = StateStore(str(tmp_path / "state.sqlite"))
+    server = synthetic_agol.server
+
+    def run(catalog = None, force = False):
+        server.reset_counts()
+        results = update_metadata(synthetic_agol.gis, catalog or synthetic_agol.catalog, ItemCache(synthetic_agol.gis), force = force,
+                                  state_store = state_store, collection_type = FakeFeatureLayerCollection, layer_type = FakeFeatureLayer)
+        assert all(result.success for result in results)
+        # the metadata and thumbnail files are removed
+        assert list(temp_folder.iterdir()) == []
+        return dict(server.requests)
+
+    yield run, state_store
+    state_store.close()
+
+
+def test_unchanged_metadata_is_skipped(synthetic_agol, metadata_run):
+    run, state_store = metadata_run
+    server = synthetic_agol.server
+    requests = run()
+    # xml and thumbnail item updates, and the REST page of both surveys
+    assert requests["update_item"] == 4 and requests["update_service_definition"] == 2
+    assert requests["update_layer_definition"] == 4
+    item = server.items[synthetic_agol.services[0]["item_id"]]
+    assert b"Synthetic survey 0" in item["metadata"] and item["thumbnail"] == synthetic_agol.catalog.df_features["thumbnail"][0]
+    assert plan_metadata(ItemCache(synthetic_agol.gis), synthetic_agol.catalog, state_store)["surveys"] == []
+
+    requests = run()
+    assert requests.get("update_item", 0) == 0 and requests.get("update_service_definition", 0) == 0
+
+    requests = run(force = True)
+    assert requests["update_item"] == 4 and requests["update_service_definition"] == 2
+
+
+def test_only_the_changed_survey_is_uploaded(synthetic_agol, metadata_run):
+    run, state_store = metadata_run
+    run()
+    with sqlite3.connect(synthetic_agol.database_path) as connection:
+        connection.execute(f"UPDATE {SYNTHETIC_TABLES['ftr_table']} SET abstract = 'Changed abstract' WHERE strata_short = 'SYN1'")
+    catalog = Catalog.load(synthetic_agol.engine, schema = SYNTHETIC_SCHEMA, **SYNTHETIC_TABLES)
+    assert plan_metadata(ItemCache(synthetic_agol.gis), catalog, state_store)["surveys"] == [
+        {"survey": "SYN1", "item_id": synthetic_agol.services[1]["item_id"], "parts": ["xml", "rest"]}
+    ]
+
+    requests = run(catalog)
+    # the xml of SYN1 only, its REST page properties did not change
+    assert requests["update_item"] == 1 and requests.get("update_service_definition", 0) == 0
+    assert b"Changed abstract" in synthetic_agol.server.items[synthetic_agol.services[1]["item_id"]]["metadata"]
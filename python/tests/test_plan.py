@@ -0,0 +1,70 @@
+import json
+import pytest
+from MDEB_SPATIAL_agol import ItemCache
+from MDEB_SPATIAL_fakeagol import FakeFeatureLayer, FakeFeatureLayerCollection
+from MDEB_SPATIAL_plan import apply_plan, build_plan, summarize_plan
+from MDEB_SPATIAL_synthetic import update_survey_rows
+
+
+@pytest.fixture
+def planning(synthetic_agol, tmp_path, monkeypatch):
+    """
+    Builds, saves and applies plans against the fake AGOL server.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("STATE_DB", str(tmp_path / "state.sqlite"))
+    monkeypatch.setenv("SNAPSHOT_FOLDER", str(tmp_path / "snapshots"))
+    monkeypatch.setenv("UPLOAD_RETRY_DELAY", "0")
+    monkeypatch.setenv("AGOL_RATE_LIMIT", "0")
+
+    def plan(**options):
+        built = build_plan(synthetic_agol.gis, synthetic_agol.engine, synthetic_agol.catalog, ItemCache(synthetic_agol.gis), **options)
+        # the plan is saved as JSON and applied later
+        return json.loads(json.dumps(built, default = str))
+
+    def apply(saved_plan):
+        synthetic_agol.server.reset_counts()
+        apply_plan(synthetic_agol.gis, synthetic_agol.engine, synthetic_agol.catalog, ItemCache(synthetic_agol.gis), saved_plan,
+                   collection_type = FakeFeatureLayerCollection, layer_type = FakeFeatureLayer)
+        return synthetic_agol.server.requests
+
+    return plan, apply
+
+
+def test_applied_plan_leaves_nothing_to_plan(synthetic_agol, planning):
+    plan, apply = planning
+    first_plan = plan()
+    assert summarize_plan(first_plan) == [
+        "data: 2 service(s) to overwrite",
+        "fields: 24 field(s) in 4 layer(s)",
+        "metadata: 6 part(s) in 2 survey(s), 4 layer(s)",
+        "popup: 2 service(s)",
+    ]
+    assert first_plan["data_options"] == {"delta": False, "fetch_engine": None}
+
+    requests = apply(first_plan)
+    assert requests["overwrite_service"] == 2
+    assert requests["update_layer_definition"] == 8 and requests["update_service_definition"] == 2
+
+    assert summarize_plan(plan()) == [
+        "data: 0 service(s) to overwrite",
+        "fields: 0 field(s) in 0 layer(s)",
+        "metadata: 0 part(s) in 0 survey(s), 0 layer(s)",
+        "popup: 0 service(s)",
+    ]
+
+
+def test_planned_delta_is_applied_as_a_delta(synthetic_agol, planning):
+    plan, apply = planning
+    apply(plan(stages = ["data"]))
+    changed_table = synthetic_agol.services[1]["tables"][0]
+    update_survey_rows(synthetic_agol.database_path, changed_table, 3)
+
+    delta_plan = plan(stages = ["data"], delta = True, fetch_engine = "pandas")
+    assert summarize_plan(delta_plan) == ["data: 1 service(s) to update (delta)"]
+    assert [entry["service"] for entry in delta_plan["data"]] == ["Synthetic_Survey_1"]
+
+    requests = apply(delta_plan)
+    assert requests["overwrite_service"] == 0 and requests["apply_edits"] == 1
+    labels = {feature["attributes"]["LABEL_0"] for feature in synthetic_agol.server.layer_features("Synthetic_Survey_1", 0)}
+    assert "STRATUM UPDATED" in labels
@@ -0,0 +1,163 @@
+import copy
+import json
+import pytest
+from MDEB_SPATIAL_popupmodel import FieldRule, FieldRuleSet, PopupModel, load_field_rules
+from MDEB_SPATIAL_popupupdate import update_popup_info
+
+LAYER_SCHEMA = [
+    {"name": "OBJECTID", "alias": "OBJECTID", "type": "esriFieldTypeOID"},
+    {"name": "OID", "alias": "Oid", "type": "esriFieldTypeInteger"},
+    {"name": "SURVEY_NAME", "alias": "Survey Name", "type": "esriFieldTypeString"},
+]
+
+
+def make_popup_info(field_names):
+    field_infos = [{"fieldName": name, "label": name, "visible": True, "isEditable": True} for name in field_names]
+    return {
+        "title": "Layer",
+        "fieldInfos": field_infos,
+        "popupElements": [{"type": "fields", "fieldInfos": copy.deepcopy(field_infos)}, {"type": "text", "text": "{OID}"}],
+    }
+
+
+def test_add_missing_fields_adds_to_main_list_and_fields_elements():
+    popup_info = make_popup_info(["oid"])
+    popup_model = PopupModel(popup_info)
+
+    assert popup_model.add_missing_fields(LAYER_SCHEMA) == 2
+    assert [info["fieldName"] for info in popup_info["fieldInfos"]] == ["oid", "OBJECTID", "SURVEY_NAME"]
+    assert [info["fieldName"] for info in popup_info["popupElements"][0]["fieldInfos"]] == ["oid", "OBJECTID", "SURVEY_NAME"]
+    assert popup_info["fieldInfos"][2]["label"] == "Survey Name"
+    assert "fieldInfos" not in popup_info["popupElements"][1]
+    # a second pass finds nothing missing
+    assert popup_model.add_missing_fields(LAYER_SCHEMA) == 0
+
+
+def test_add_missing_fields_creates_field_infos_list():
+    popup_info = {"title": "Layer"}
+    assert PopupModel(popup_info).add_missing_fields(LAYER_SCHEMA) == 3
+    assert len(popup_info["fieldInfos"]) == 3
+
+
+def test_apply_rules_counts_only_changed_field_infos():
+    popup_info = make_popup_info(["OBJECTID", "OID"])
+    rules = load_field_rules()
+    popup_model = PopupModel(popup_info)
+
+    # OBJECTID in the main list and in the fields element
+    assert popup_model.apply_rules(rules, LAYER_SCHEMA) == 2
+    assert popup_info["fieldInfos"][0]["visible"] is False
+    assert popup_info["popupElements"][0]["fieldInfos"][0]["visible"] is False
+    assert popup_info["fieldInfos"][1]["visible"] is True
+    assert PopupModel(popup_info).apply_rules(rules, LAYER_SCHEMA) == 0
+
+
+def test_apply_rules_checks_added_fields_once():
+    popup_info = make_popup_info([])
+    popup_model = PopupModel(popup_info)
+    popup_model.add_missing_fields(LAYER_SCHEMA)
+
+    # the added OBJECTID fieldInfo is shared by the main list and the fields element
+    assert popup_model.apply_rules(load_field_rules(), LAYER_SCHEMA) == 1
+    assert popup_info["popupElements"][0]["fieldInfos"][0]["visible"] is False
+
+
+def test_apply_rules_updates_duplicate_field_infos():
+    popup_info = make_popup_info(["OBJECTID", "OID", "OBJECTID"])
+    popup_model = PopupModel(popup_info)
+
+    assert popup_model.apply_rules(load_field_rules(), LAYER_SCHEMA) == 4
+    for field_infos in (popup_info["fieldInfos"], popup_info["popupElements"][0]["fieldInfos"]):
+        assert [info["visible"] for info in field_infos] == [False, True, False]
+
+
+def test_field_rules_file_matches_objectid_only():
+    rules = load_field_rules()
+    assert rules.rule_for("OBJECTID").config["visible"] is False
+    assert rules.rule_for("OID", "esriFieldTypeInteger") is None
+    assert rules.rule_for("SURVEY_NAME") is None
+
+
+def test_field_rules_match_names_patterns_and_types(tmp_path):
+    rules_path = tmp_path / "rules.json"
+    rules_path.write_text(json.dumps([
+        {"names": ["SURVEY_NAME"], "config": {"label": "Survey"}},
+        {"pattern": "VALUE_\\d+", "config": {"visible": False}},
+        {"field_types": ["esriFieldTypeOID"], "config": {"isEditable": False}},
+        {"pattern": ".*", "config": {"visible": True}},
+    ]))
+    rules = load_field_rules(str(rules_path))
+
+    assert rules.rule_for("SURVEY_NAME").config == {"label": "Survey"}
+    assert rules.rule_for("VALUE_12").config == {"visible": False}
+    # patterns match the whole name
+    assert rules.rule_for("VALUE_12_FLAG").config == {"visible": True}
+    assert rules.rule_for("FID", "esriFieldTypeOID").config == {"isEditable": False}
+    # the first matching rule wins
+    assert rules.rule_for("VALUE_1", "esriFieldTypeOID").config == {"visible": False}
+
+
+def test_field_rule_needs_a_matcher():
+    with pytest.raises(ValueError):
+        FieldRule({"visible": False})
+
+
+def test_rule_set_remembers_matches():
+    rule = FieldRule({"visible": False}, names = ["OBJECTID"])
+    rules = FieldRuleSet([rule])
+    assert rules.rule_for("OBJECTID") is rule
+    rules.rules.clear()
+    assert rules.rule_for("OBJECTID") is rule
+
+
+class StubItem:
+    type = "Feature Service"
+    title = "Synthetic Survey"
+
+    def __init__(self, definition):
+        self.definition = definition
+        self.updates = []
+
+    def get_data(self):
+        return copy.deepcopy(self.definition)
+
+    def update(self, item_properties):
+        self.updates.append(item_properties)
+
+
+class StubItemCache:
+    def __init__(self, item, schemas):
+        self.item = item
+        self.schemas = schemas
+        self.invalidated = []
+
+    def get_item(self, item_id):
+        return self.item
+
+    def get_layer_properties(self, item_id, layer_index):
+        return {"fields": self.schemas[layer_index]}
+
+    def invalidate(self, item_id):
+        self.invalidated.append(item_id)
+
+
+def test_dry_run_counts_changes_without_pushing():
+    item = StubItem({"layers": [
+        {"name": "SYN_0_0", "popupInfo": make_popup_info(["OBJECTID", "OID", "SURVEY_NAME"])},
+        {"name": "SYN_0_1", "popupInfo": make_popup_info(["OID"])},
+        {"name": "SYN_0_2"},
+    ]})
+    item_cache = StubItemCache(item, [LAYER_SCHEMA, LAYER_SCHEMA, LAYER_SCHEMA])
+
+    changes = update_popup_info(item_cache, "item", load_field_rules(), dry_run = True)
+
+    assert changes == [
+        {"layer_index": 0, "layer_name": "SYN_0_0", "added": 0, "updated": 2},
+        {"layer_index": 1, "layer_name": "SYN_0_1", "added": 2, "updated": 1},
+        {"layer_index": 2, "layer_name": "SYN_0_2", "added": 3, "updated": 1},
+    ]
+    assert item.updates == [] and item_cache.invalidated == []
+
+    # the same changes are pushed without dry_run
+    assert update_popup_info(item_cache, "item", load_field_rules()) == changes
+    assert len(item.updates) == 1 and item_cache.invalidated == ["item"]
@@ -0,0 +1,29 @@
+from MDEB_SPATIAL_agol import ItemCache
+from MDEB_SPATIAL_popupupdate import update_popups
+
+
+def test_each_item_is_updated_once(synthetic_agol):
+    server = synthetic_agol.server
+    item_cache = ItemCache(synthetic_agol.gis)
+    # the layer table has one row per layer, two per item
+    assert len(synthetic_agol.catalog.df_layers) == 4
+
+    popup_changes = update_popups(synthetic_agol.gis, synthetic_agol.catalog, item_cache)
+    assert sorted(popup_changes) == [service["item_id"] for service in synthetic_agol.services]
+    assert [change["layer_name"] for change in popup_changes[synthetic_agol.services[0]["item_id"]]] == ["SYN_0_0", "SYN_0_1"]
+    assert server.requests["get_item"] == server.requests["get_item_data"] == server.requests["update_item"] == 2
+    # one /layers request per item instead of one request per layer
+    assert server.requests["get_service_layers"] == 2 and server.requests["get_layer"] == 0
+
+    # the popups are up to date, nothing is pushed
+    server.reset_counts()
+    assert update_popups(synthetic_agol.gis, synthetic_agol.catalog, item_cache) == {}
+    assert server.requests["update_item"] == 0
+
+
+def test_popup_update_limited_to_items(synthetic_agol):
+    server = synthetic_agol.server
+    item_id = synthetic_agol.services[1]["item_id"]
+    popup_changes = update_popups(synthetic_agol.gis, synthetic_agol.catalog, ItemCache(synthetic_agol.gis), item_ids = {item_id}, dry_run = True)
+    assert list(popup_changes) == [item_id]
+    assert server.requests["get_item"] == 1 and server.requests["update_item"] == 0
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+import zipfile
+import pytest
+from MDEB_SPATIAL_dataupdate import update_data
+from MDEB_SPATIAL_fakeagol import FakeFeatureLayerCollection
+from MDEB_SPATIAL_publish import check_compression, run_pipeline, zip_fgdb
+
+
+@pytest.fixture
+def fgdb_folder(tmp_path):
+    """
+    A folder laid out like a file geodatabase, with a nested folder and an empty file.
+    """
+    fgdb_path = tmp_path / "Synthetic_Survey_0.gdb"
+    (fgdb_path / "nested").mkdir(parents = True)
+    files = {
+        "a00000001.gdbtable": os.urandom(5000),
+        "a00000001.gdbtablx": b"\0" * 20000,
+        "gdb": b"",
+        os.path.join("nested", "timestamps"): b"nested file",
+    }
+    for name, content in files.items():
+        (fgdb_path / name).write_bytes(content)
+    return str(fgdb_path), files
+
+
+@pytest.mark.parametrize("compression, level", [("store", None), ("deflate", None), ("deflate", 1), ("deflate", 9)])
+def test_archive_round_trips(fgdb_folder, tmp_path, compression, level):
+    fgdb_path, files = fgdb_folder
+    zip_path = str(tmp_path / "Synthetic_Survey_0.zip")
+    zip_fgdb(fgdb_path, zip_path, compression, level)
+
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.testzip() is None
+        # paths start with the .gdb folder name, as AGOL expects
+        assert sorted(zf.namelist()) == sorted(f"Synthetic_Survey_0.gdb/{name.replace(os.sep, '/')}" for name in files)
+        assert {info.compress_type for info in zf.infolist()} == {zipfile.ZIP_STORED if compression == "store" else zipfile.ZIP_DEFLATED}
+        zf.extractall(tmp_path / "extracted")
+    for name, content in files.items():
+        assert (tmp_path / "extracted" / "Synthetic_Survey_0.gdb" / name).read_bytes() == content
+
+
+@pytest.mark.parametrize("compression, level, message", [
+    ("bzip2", None, "Unknown compression 'bzip2'"),
+    ("deflate", 0, "level 0 is out of range"),
+    ("deflate", 10, "level 10 is out of range"),
+])
+def test_bad_compression_settings_are_rejected(compression, level, message):
+    with pytest.raises(ValueError, match = message):
+        check_compression(compression, level)
+
+
+def test_bad_compression_settings_fail_before_extraction(synthetic_agol, tmp_path, monkeypatch):
+    work_folder = tmp_path / "work"
+    work_folder.mkdir()
+    monkeypatch.chdir(work_folder)
+    monkeypatch.setenv("STATE_DB", str(work_folder / "state.sqlite"))
+    monkeypatch.setenv("PACKAGE_LEVEL", "12")
+    with pytest.raises(ValueError, match = "level 12"):
+        update_data(synthetic_agol.gis, synthetic_agol.engine, synthetic_agol.catalog, collection_type = FakeFeatureLayerCollection)
+    assert sum(synthetic_agol.server.requests.values()) == 0
+    # no state file, snapshot or file geodatabase was written
+    assert os.listdir(work_folder) == []
+
+
+def run_pipeline_or_fail(items, stages, queue_size = 1, timeout = 20):
+    """
+    Runs run_pipeline in a thread and fails if it has not finished after timeout
+    seconds (a lost end marker leaves the stage threads waiting forever).
+    """
+    outcome = {}
+    runner = threading.Thread(target = lambda: outcome.update(timings = run_pipeline(items, stages, queue_size)), daemon = True)
+    runner.start()
+    runner.join(timeout)
+    assert not runner.is_alive(), "the pipeline did not finish"
+    return outcome["timings"]
+
+
+def test_pipeline_keeps_the_item_order_with_one_worker_per_stage():
+    finished = []
+    timings = run_pipeline_or_fail(range(50), [
+        ("build", lambda item: item * 2),
+        ("zip", lambda item: item + 1),
+        ("upload", finished.append),
+    ])
+    assert finished == [item * 2 + 1 for item in range(50)]
+    assert timings.items == {"build": 50, "zip": 50, "upload": 50}
+
+
+def test_failed_items_are_dropped_and_the_others_finish():
+    def zip_or_fail(item):
+        if item == 3:
+            raise RuntimeError("zip failed")
+        if item == 5:
+            return None
+        return item
+
+    finished = []
+    timings = run_pipeline_or_fail(range(10), [("build", lambda item: item), ("zip", zip_or_fail), ("upload", finished.append)])
+    assert finished == [0, 1, 2, 4, 6, 7, 8, 9]
+    assert timings.items == {"build": 10, "zip": 10, "upload": 8}
+
+
+def test_every_item_passes_once_through_stages_with_several_workers():
+    running = {"now": 0, "most": 0}
+    lock = threading.Lock()
+
+    def slow_zip(item):
+        with lock:
+            running["now"] += 1
+            running["most"] = max(running["most"], running["now"])
+        time.sleep(0.01)
+        with lock:
+            running["now"] -= 1
+        return item
+
+    finished = []
+    timings = run_pipeline_or_fail(range(40), [
+        ("build", lambda item: item, 2),
+        ("zip", slow_zip, 4),
+        ("upload", lambda item: finished.append(item) or item, 3),
+    ])
+    assert sorted(finished) == list(range(40))
+    assert timings.items == {"build": 40, "zip": 40, "upload": 40}
+    assert running["most"] > 1
+
+
+def test_pipeline_without_items_stops():
+    timings = run_pipeline_or_fail([], [("build", lambda item: item, 3), ("upload", lambda item: item, 2)])
+    assert timings.items == {"build": 0, "upload": 0}
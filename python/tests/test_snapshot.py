@@ -0,0 +1,69 @@
+import os
+import geopandas as gpd
+from shapely.geometry import Point
+from MDEB_SPATIAL_snapshot import SnapshotStore
+
+
+def make_batch(rows):
+    return gpd.GeoDataFrame({"OID": list(range(rows))}, geometry = [Point(oid, oid) for oid in range(rows)], crs = "EPSG:4269")
+
+
+def save_snapshot(snapshot_store, table_name, fingerprint, age):
+    list(snapshot_store.save(table_name, fingerprint, [make_batch(3)]))
+    # make the snapshots' order independent of the file system's mtime resolution
+    mtime = 1_700_000_000 - age
+    os.utime(snapshot_store.path(table_name, fingerprint), (mtime, mtime))
+
+
+def test_save_and_read_snapshot(tmp_path):
+    snapshot_store = SnapshotStore(str(tmp_path))
+    batches = [make_batch(3), make_batch(2)]
+    assert [len(gdf) for gdf in snapshot_store.save("syn_0_0", "a", batches)] == [3, 2]
+    assert snapshot_store.has("SYN_0_0", "a")
+    assert [len(gdf) for gdf in snapshot_store.read("SYN_0_0", "a")] == [3, 2]
+
+
+def test_interrupted_save_leaves_no_snapshot(tmp_path):
+    snapshot_store = SnapshotStore(str(tmp_path))
+    saving = snapshot_store.save("SYN_0_0", "a", [make_batch(3), make_batch(2)])
+    next(saving)
+    saving.close()
+    assert not snapshot_store.has("SYN_0_0", "a")
+    assert snapshot_store.fingerprints("SYN_0_0") == []
+
+
+def test_prune_keeps_newest_snapshots(tmp_path):
+    snapshot_store = SnapshotStore(str(tmp_path), keep = 2)
+    for age, fingerprint in enumerate(["c", "b", "a"]):
+        save_snapshot(snapshot_store, "SYN_0_0", fingerprint, age = 10 - age)
+    assert snapshot_store.fingerprints("SYN_0_0") == ["a", "b"]
+
+
+def test_prune_never_removes_published_snapshot(tmp_path):
+    # "a" was published, then "b" was saved by a run whose upload failed and "c" by the next run
+    snapshot_store = SnapshotStore(str(tmp_path), keep = 1, published = {"SYN_0_0": {"a"}})
+    for age, fingerprint in enumerate(["a", "b", "c"]):
+        save_snapshot(snapshot_store, "SYN_0_0", fingerprint, age = 10 - age)
+    assert snapshot_store.fingerprints("SYN_0_0") == ["c", "a"]
+    assert snapshot_store.latest("SYN_0_0") == "c"
+
+
+def test_concurrent_saves_of_the_same_table(tmp_path):
+    snapshot_store = SnapshotStore(str(tmp_path))
+    # two jobs save the same table, their batches interleaved
+    first = snapshot_store.save("SYN_0_0", "a", [make_batch(3), make_batch(2)])
+    second = snapshot_store.save("SYN_0_0", "a", [make_batch(3), make_batch(2)])
+    assert len(next(first)) == 3 and len(next(second)) == 3
+    assert [len(gdf) for gdf in first] == [2]
+    assert [len(gdf) for gdf in second] == [2]
+    assert [len(gdf) for gdf in snapshot_store.read("SYN_0_0", "a")] == [3, 2]
+    assert os.listdir(tmp_path / "SYN_0_0") == ["a"]
+
+
+def test_interrupted_save_leaves_no_snapshot(tmp_path):
+    snapshot_store = SnapshotStore(str(tmp_path))
+    batches = snapshot_store.save("SYN_0_0", "a", [make_batch(3), make_batch(2)])
+    next(batches)
+    batches.close()
+    assert not snapshot_store.has("SYN_0_0", "a")
+    assert os.listdir(tmp_path / "SYN_0_0") == []